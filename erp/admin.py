@@ -1,15 +1,17 @@
 from decimal import Decimal
 from django.contrib import admin
-from django.db.models import Sum, F
+from django.db.models import Count, Sum, F, Q, Value, DecimalField
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils import timezone
 from .models import (
-    Supplier, Client, Product, ProductCostHistory,
+    Supplier, Client, ClientBalance, Product, ProductCostHistory, StockMovement,
     Purchase, PurchaseItem, PurchaseExpense,
     Sale, SaleItem, SaleExpense,
     Payment, PaymentAllocation
 )
+from .services import PurchaseService, SaleService
 
 
 # -------------------------------------------------------------------------
@@ -67,8 +69,8 @@ class PaymentAllocationInline(admin.TabularInline):
             balance = obj.sale.get_balance()
             color = 'red' if balance > 0 else 'green'
             return format_html(
-                '<span style="color: {};">${:,.2f}</span>',
-                color, balance
+                '<span style="color: {};">${}</span>',
+                color, f"{balance:,.2f}"
             )
         return "-"
     get_sale_balance.short_description = "Saldo Venta"
@@ -106,10 +108,15 @@ class SupplierAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('created_at', 'updated_at')
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            completed_purchases=Count('purchases', filter=Q(purchases__status=Purchase.Status.COMPLETED))
+        )
+    
     def get_total_purchases(self, obj):
-        count = obj.purchases.filter(status=Purchase.Status.COMPLETED).count()
-        return f"{count} compras"
+        return f"{obj.completed_purchases} compras"
     get_total_purchases.short_description = "Compras"
+    get_total_purchases.admin_order_field = 'completed_purchases'
 
 
 # -------------------------------------------------------------------------
@@ -133,20 +140,31 @@ class ClientAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('created_at', 'updated_at')
     
+    def get_queryset(self, request):
+        # Conteo de ventas y deuda (desde ClientBalance) en la misma consulta
+        return super().get_queryset(request).annotate(
+            completed_sales=Count('sales', filter=Q(sales__status=Sale.Status.COMPLETED)),
+            debt=Coalesce(
+                'balance_summary__open_debt',
+                Value(Decimal('0.00'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+            ),
+        )
+    
     def get_total_sales(self, obj):
-        count = obj.sales.filter(status=Sale.Status.COMPLETED).count()
-        return f"{count} ventas"
+        return f"{obj.completed_sales} ventas"
     get_total_sales.short_description = "Ventas"
+    get_total_sales.admin_order_field = 'completed_sales'
     
     def get_debt(self, obj):
-        debt = obj.get_total_debt()
+        debt = obj.debt
         if debt > 0:
             return format_html(
-                '<span style="color: red; font-weight: bold;">${:,.2f}</span>',
-                debt
+                '<span style="color: red; font-weight: bold;">${}</span>',
+                f"{debt:,.2f}"
             )
         return format_html('<span style="color: green;">$0.00</span>')
     get_debt.short_description = "Deuda Total"
+    get_debt.admin_order_field = 'debt'
 
 
 # -------------------------------------------------------------------------
@@ -167,14 +185,16 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('name', 'description', 'unit_type', 'active')
         }),
         ('Stock e Inventario', {
-            'fields': ('stock', 'min_stock', 'reference_price')
+            'fields': (
+                'stock', 'min_stock', 'reference_price', 'last_cost', 'last_cost_date', 'avg_cost'
+            )
         }),
         ('Metadatos', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('last_cost', 'last_cost_date', 'avg_cost', 'created_at', 'updated_at')
     inlines = [ProductCostHistoryInline]
     
     def get_stock_display(self, obj):
@@ -182,8 +202,8 @@ class ProductAdmin(admin.ModelAdmin):
         color = 'red' if is_low else 'green'
         icon = '⚠️' if is_low else '✓'
         return format_html(
-            '<span style="color: {};">{} {:.3f} {}</span>',
-            color, icon, obj.stock, obj.get_unit_type_display()
+            '<span style="color: {};">{} {} {}</span>',
+            color, icon, f"{obj.stock:.3f}", obj.get_unit_type_display()
         )
     get_stock_display.short_description = "Stock"
     
@@ -204,6 +224,7 @@ class PurchaseAdmin(admin.ModelAdmin):
         'folio', 'supplier', 'date', 'get_status_display', 
         'get_total_display', 'created_by', 'created_at'
     )
+    list_select_related = ('supplier', 'created_by')
     list_filter = ('status', 'date', 'supplier', 'created_at')
     search_fields = ('folio', 'supplier__name', 'notes')
     ordering = ('-date', '-id')
@@ -247,26 +268,30 @@ class PurchaseAdmin(admin.ModelAdmin):
         )
     get_status_display.short_description = "Estado"
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+    
     def get_total_items_display(self, obj):
         if obj.pk:
-            return f"${obj.get_total_items():,.2f}"
+            return f"${obj.items_amount:,.2f}"
         return "$0.00"
     get_total_items_display.short_description = "Total Items"
     
     def get_total_expenses_display(self, obj):
         if obj.pk:
-            return f"${obj.get_total_expenses():,.2f}"
+            return f"${obj.expenses_amount:,.2f}"
         return "$0.00"
     get_total_expenses_display.short_description = "Total Gastos"
     
     def get_total_display(self, obj):
         if obj.pk:
             return format_html(
-                '<strong style="color: green; font-size: 14px;">${:,.2f}</strong>',
-                obj.get_total()
+                '<strong style="color: green; font-size: 14px;">${}</strong>',
+                f"{obj.total_amount:,.2f}"
             )
         return "$0.00"
     get_total_display.short_description = "TOTAL"
+    get_total_display.admin_order_field = 'total_amount'
     
     def save_model(self, request, obj, form, change):
         if not change:
@@ -274,6 +299,13 @@ class PurchaseAdmin(admin.ModelAdmin):
         obj.updated_by = request.user
         super().save_model(request, obj, form, change)
     
+    def save_formset(self, request, form, formset, change):
+        if formset.model is PurchaseItem:
+            # Items nuevos en bloque (un UPDATE de stock por compra)
+            PurchaseService.save_item_formset(form.instance, formset)
+            return
+        super().save_formset(request, form, formset, change)
+    
     def mark_as_completed(self, request, queryset):
         updated = 0
         for purchase in queryset:
@@ -284,15 +316,11 @@ class PurchaseAdmin(admin.ModelAdmin):
     mark_as_completed.short_description = "Marcar como Completadas"
     
     def mark_as_cancelled(self, request, queryset):
-        updated = 0
-        for purchase in queryset:
-            try:
-                purchase.cancel()
-                updated += 1
-            except Exception as e:
-                self.message_user(request, f"Error al cancelar {purchase.folio}: {str(e)}", level='error')
-        if updated > 0:
-            self.message_user(request, f"{updated} compra(s) cancelada(s).")
+        cancelled, failures = PurchaseService.cancel_many(queryset)
+        for folio, error in failures.items():
+            self.message_user(request, f"Error al cancelar {folio}: {error}", level='error')
+        if cancelled:
+            self.message_user(request, f"{len(cancelled)} compra(s) cancelada(s).")
     mark_as_cancelled.short_description = "Cancelar Compras"
 
 
@@ -306,6 +334,8 @@ class SaleAdmin(admin.ModelAdmin):
         'get_payment_status_display', 'get_total_display',
         'get_balance_display', 'due_date', 'created_by'
     )
+    # Totales y saldo salen de las columnas desnormalizadas de Sale
+    list_select_related = ('client', 'created_by')
     list_filter = ('status', 'payment_status', 'date', 'due_date', 'client')
     search_fields = ('folio', 'client__name', 'notes')
     ordering = ('-date', '-id')
@@ -389,18 +419,19 @@ class SaleAdmin(admin.ModelAdmin):
     def get_total_display(self, obj):
         if obj.pk:
             return format_html(
-                '<strong style="color: blue; font-size: 14px;">${:,.2f}</strong>',
-                obj.get_total()
+                '<strong style="color: blue; font-size: 14px;">${}</strong>',
+                f"{obj.get_total():,.2f}"
             )
         return "$0.00"
     get_total_display.short_description = "TOTAL"
+    get_total_display.admin_order_field = F('items_total') + F('expenses_total')
     
     def get_paid_display(self, obj):
         if obj.pk:
             paid = obj.get_amount_paid()
             return format_html(
-                '<span style="color: green;">${:,.2f}</span>',
-                paid
+                '<span style="color: green;">${}</span>',
+                f"{paid:,.2f}"
             )
         return "$0.00"
     get_paid_display.short_description = "Pagado"
@@ -410,11 +441,12 @@ class SaleAdmin(admin.ModelAdmin):
             balance = obj.get_balance()
             color = 'red' if balance > 0 else 'green'
             return format_html(
-                '<strong style="color: {}; font-size: 14px;">${:,.2f}</strong>',
-                color, balance
+                '<strong style="color: {}; font-size: 14px;">${}</strong>',
+                color, f"{balance:,.2f}"
             )
         return "$0.00"
     get_balance_display.short_description = "SALDO"
+    get_balance_display.admin_order_field = 'balance'
     
     def save_model(self, request, obj, form, change):
         if not change:
@@ -422,6 +454,18 @@ class SaleAdmin(admin.ModelAdmin):
         obj.updated_by = request.user
         super().save_model(request, obj, form, change)
     
+    def save_related(self, request, form, formsets, change):
+        # Items y gastos de la venta: un solo recálculo del saldo del cliente
+        with ClientBalance.deferred():
+            super().save_related(request, form, formsets, change)
+    
+    def save_formset(self, request, form, formset, change):
+        if formset.model is SaleItem:
+            # Items nuevos en bloque (un lock y un UPDATE de stock por venta)
+            SaleService.save_item_formset(form.instance, formset)
+            return
+        super().save_formset(request, form, formset, change)
+    
     def mark_as_completed(self, request, queryset):
         updated = 0
         for sale in queryset:
@@ -432,23 +476,11 @@ class SaleAdmin(admin.ModelAdmin):
     mark_as_completed.short_description = "Marcar como Completadas"
     
     def mark_as_cancelled(self, request, queryset):
-        updated = 0
-        for sale in queryset:
-            try:
-                if sale.get_amount_paid() > 0:
-                    self.message_user(
-                        request,
-                        f"No se puede cancelar {sale.folio}: tiene pagos asignados",
-                        level='error'
-                    )
-                    continue
-                sale.status = Sale.Status.CANCELLED
-                sale.save()
-                updated += 1
-            except Exception as e:
-                self.message_user(request, f"Error al cancelar {sale.folio}: {str(e)}", level='error')
-        if updated > 0:
-            self.message_user(request, f"{updated} venta(s) cancelada(s).")
+        cancelled, failures = SaleService.cancel_many(queryset)
+        for folio, error in failures.items():
+            self.message_user(request, f"No se puede cancelar {folio}: {error}", level='error')
+        if cancelled:
+            self.message_user(request, f"{len(cancelled)} venta(s) cancelada(s).")
     mark_as_cancelled.short_description = "Cancelar Ventas"
 
 
@@ -461,6 +493,7 @@ class PaymentAdmin(admin.ModelAdmin):
         'id', 'client', 'date', 'get_amount_display',
         'get_allocated_display', 'get_available_display', 'created_by'
     )
+    list_select_related = ('client', 'created_by')
     list_filter = ('date', 'client', 'created_at')
     search_fields = ('id', 'client__name', 'notes')
     ordering = ('-date', '-id')
@@ -486,30 +519,35 @@ class PaymentAdmin(admin.ModelAdmin):
     readonly_fields = ('get_allocated_display', 'get_available_display', 'created_at')
     inlines = [PaymentAllocationInline]
     
+    actions = ['auto_allocate']
+    
     def get_amount_display(self, obj):
         return format_html(
-            '<strong style="color: blue;">${:,.2f}</strong>',
-            obj.amount
+            '<strong style="color: blue;">${}</strong>',
+            f"{obj.amount:,.2f}"
         )
     get_amount_display.short_description = "Monto"
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_allocated()
+    
     def get_allocated_display(self, obj):
         if obj.pk:
-            allocated = obj.total_allocated()
             return format_html(
-                '<span style="color: green;">${:,.2f}</span>',
-                allocated
+                '<span style="color: green;">${}</span>',
+                f"{obj.allocated:,.2f}"
             )
         return "$0.00"
     get_allocated_display.short_description = "Asignado"
+    get_allocated_display.admin_order_field = 'allocated'
     
     def get_available_display(self, obj):
         if obj.pk:
-            available = obj.unallocated_amount()
+            available = obj.amount - obj.allocated
             color = 'red' if available > 0 else 'green'
             return format_html(
-                '<strong style="color: {};">${:,.2f}</strong>',
-                color, available
+                '<strong style="color: {};">${}</strong>',
+                color, f"{available:,.2f}"
             )
         return "$0.00"
     get_available_display.short_description = "Disponible"
@@ -518,6 +556,11 @@ class PaymentAdmin(admin.ModelAdmin):
         if not change:
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
+    
+    def auto_allocate(self, request, queryset):
+        created = Payment.auto_allocate_pending(queryset=queryset)
+        self.message_user(request, f"{created} asignación(es) creada(s) automáticamente.")
+    auto_allocate.short_description = "Asignar automáticamente (vencimiento más antiguo primero)"
 
 
 # -------------------------------------------------------------------------
@@ -577,4 +620,28 @@ class ProductCostHistoryAdmin(admin.ModelAdmin):
     
     def has_add_permission(self, request):
         # Solo se crean automáticamente desde compras
-        return False
\ No newline at end of file
+        return False
+
+
+# -------------------------------------------------------------------------
+# STOCK MOVEMENT
+# -------------------------------------------------------------------------
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('product', 'delta', 'source_type', 'source_id', 'created_at')
+    list_filter = ('source_type', 'created_at')
+    search_fields = ('product__name',)
+    ordering = ('-created_at', '-id')
+    date_hierarchy = 'created_at'
+    list_select_related = ('product',)
+    readonly_fields = ('product', 'delta', 'source_type', 'source_id', 'created_at')
+    
+    def has_add_permission(self, request):
+        # Solo se crean desde compras, ventas y ajustes
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,270 @@
+from datetime import date, timedelta
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework import mixins, serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from .models import (
+    Supplier, Product, Client, Purchase, PurchaseItem, Sale, SaleItem, Payment
+)
+from .pagination import ListFilterMixin
+from .reports import (
+    AGING_BUCKETS, aging_report, client_statement, decode_statement_cursor, encode_statement_cursor
+)
+from .serializers import (
+    SupplierSerializer, ProductSerializer, ClientSerializer,
+    PurchaseSerializer, PurchaseCreateSerializer, SaleSerializer, SaleCreateSerializer,
+    PaymentSerializer, SyncUploadSerializer
+)
+from .services import SaleService
+from .sync import changes_since
+
+
+# -------------------------------------------------------------------------
+# BASE
+# -------------------------------------------------------------------------
+class DocumentCursorPagination(CursorPagination):
+    """Paginación por cursor (sin OFFSET) sobre (-date, -id)"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-date', '-id')
+
+class CatalogCursorPagination(DocumentCursorPagination):
+    ordering = ('name', 'id')
+
+
+class SparseFieldsetMixin:
+    """
+    ?fields=id,folio,items: limita los campos de la respuesta y solo hace los
+    prefetch de las relaciones anidadas que se pidieron (prefetch_fields).
+    """
+    prefetch_fields = {}
+
+    def get_requested_fields(self):
+        raw = self.request.query_params.get('fields', '')
+        return {name.strip() for name in raw.split(',') if name.strip()} or None
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        prefetches = [
+            prefetch for name, prefetch in self.prefetch_fields.items()
+            if fields is None or name in fields
+        ]
+        return queryset.prefetch_related(*prefetches) if prefetches else queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in ('list', 'retrieve'):
+            kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+
+class DocumentCreateMixin(mixins.CreateModelMixin):
+    """Alta con el serializer de escritura; la respuesta usa el de lectura"""
+    create_serializer_class = None
+
+    def get_serializer_class(self):
+        if self.action == 'create':
+            return self.create_serializer_class
+        return super().get_serializer_class()
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        document = serializer.save(created_by=request.user)
+        output = self.serializer_class(
+            self.get_queryset().get(pk=document.pk), context=self.get_serializer_context()
+        )
+        return Response(output.data, status=status.HTTP_201_CREATED)
+
+
+# -------------------------------------------------------------------------
+# CATÁLOGOS
+# -------------------------------------------------------------------------
+class SupplierViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = Supplier.objects.all()
+    serializer_class = SupplierSerializer
+    pagination_class = CatalogCursorPagination
+    permission_classes = [IsAuthenticated]
+
+class ProductViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.all()
+    serializer_class = ProductSerializer
+    pagination_class = CatalogCursorPagination
+    permission_classes = [IsAuthenticated]
+
+class ClientViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = Client.objects.select_related('balance_summary')
+    serializer_class = ClientSerializer
+    pagination_class = CatalogCursorPagination
+    permission_classes = [IsAuthenticated]
+    statement_days = 90
+    statement_page_size = 100
+    statement_max_page_size = 1000
+
+    def get_date_param(self, name, default):
+        raw = self.request.query_params.get(name)
+        if not raw:
+            return default
+        try:
+            return date.fromisoformat(raw)
+        except ValueError:
+            raise serializers.ValidationError({name: ["Fecha inválida (AAAA-MM-DD)."]})
+
+    @action(detail=True)
+    def statement(self, request, pk=None):
+        """
+        GET clients/<id>/statement/?date_from&date_to&cursor&page_size: estado de
+        cuenta con saldo acumulado; next trae el cursor de la página siguiente.
+        """
+        client = self.get_object()
+        date_to = self.get_date_param('date_to', timezone.now().date())
+        date_from = self.get_date_param('date_from', date_to - timedelta(days=self.statement_days))
+        after = None
+        if request.query_params.get('cursor'):
+            try:
+                after = decode_statement_cursor(request.query_params['cursor'])
+            except DjangoValidationError as e:
+                raise serializers.ValidationError({'cursor': e.messages})
+        try:
+            page_size = int(request.query_params.get('page_size', self.statement_page_size))
+        except ValueError:
+            page_size = self.statement_page_size
+        page_size = max(1, min(page_size, self.statement_max_page_size))
+
+        balance, rows, next_after = client_statement(
+            client.pk, date_from, date_to, after=after, limit=page_size
+        )
+        next_url = None
+        if next_after:
+            query = request.query_params.copy()
+            query['date_from'], query['date_to'] = date_from, date_to
+            query['cursor'] = encode_statement_cursor(next_after)
+            next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+        return Response({
+            'client': client.pk,
+            'date_from': date_from,
+            'date_to': date_to,
+            'balance_forward': str(balance),
+            'next': next_url,
+            'results': [
+                {**row, 'charge': str(row['charge']), 'credit': str(row['credit']),
+                 'balance': str(row['balance'])}
+                for row in rows
+            ],
+        })
+
+
+# -------------------------------------------------------------------------
+# DOCUMENTOS
+# -------------------------------------------------------------------------
+class PurchaseViewSet(SparseFieldsetMixin, ListFilterMixin, DocumentCreateMixin,
+                      viewsets.ReadOnlyModelViewSet):
+    queryset = Purchase.objects.select_related('supplier').with_totals()
+    serializer_class = PurchaseSerializer
+    create_serializer_class = PurchaseCreateSerializer
+    pagination_class = DocumentCursorPagination
+    permission_classes = [IsAuthenticated]
+    filter_fields = ('date', 'status')
+    prefetch_fields = {
+        'items': Prefetch('items', queryset=PurchaseItem.objects.select_related('product')),
+        'expenses': 'expenses',
+    }
+
+class SaleViewSet(SparseFieldsetMixin, ListFilterMixin, DocumentCreateMixin,
+                  viewsets.ReadOnlyModelViewSet):
+    queryset = Sale.objects.select_related('client')
+    serializer_class = SaleSerializer
+    create_serializer_class = SaleCreateSerializer
+    pagination_class = DocumentCursorPagination
+    permission_classes = [IsAuthenticated]
+    filter_fields = ('date', 'status', 'client')
+    prefetch_fields = {
+        'items': Prefetch('items', queryset=SaleItem.objects.select_related('product')),
+        'expenses': 'expenses',
+    }
+
+class PaymentViewSet(SparseFieldsetMixin, ListFilterMixin, mixins.CreateModelMixin,
+                     viewsets.ReadOnlyModelViewSet):
+    queryset = Payment.objects.select_related('client').with_allocated()
+    serializer_class = PaymentSerializer
+    pagination_class = DocumentCursorPagination
+    permission_classes = [IsAuthenticated]
+    filter_fields = ('date', 'client')
+    prefetch_fields = {'allocations': 'allocations'}
+
+    def perform_create(self, serializer):
+        serializer.save(created_by=self.request.user)
+
+
+# -------------------------------------------------------------------------
+# SINCRONIZACIÓN (TERMINALES FUERA DE LÍNEA)
+# -------------------------------------------------------------------------
+class SyncViewSet(viewsets.ViewSet):
+    """
+    GET sync/?since=<marca>&limit=N: cambios de productos (precio, stock),
+    clientes y saldos desde la marca de agua anterior, con los ids borrados.
+    POST sync/sales/: lote de ventas hechas fuera de línea, con clave de idempotencia.
+    """
+    permission_classes = [IsAuthenticated]
+    default_limit = 500
+    max_limit = 5000
+
+    def list(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        try:
+            data = changes_since(request.query_params.get('since'), max(limit, 1))
+        except DjangoValidationError as e:
+            raise serializers.ValidationError({'since': e.messages})
+        return Response(data)
+
+    @action(detail=False, methods=['post'])
+    def sales(self, request):
+        serializer = SyncUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = SaleService.sync_offline(serializer.validated_data['sales'], user=request.user)
+        return Response({'results': results})
+
+
+# -------------------------------------------------------------------------
+# REPORTES
+# -------------------------------------------------------------------------
+class ReportViewSet(viewsets.ViewSet):
+    """GET reports/aging/?as_of=AAAA-MM-DD&client=<id>: antigüedad de saldos por cliente"""
+    permission_classes = [IsAuthenticated]
+
+    @staticmethod
+    def get_as_of(request):
+        raw = request.query_params.get('as_of')
+        if not raw:
+            return timezone.now().date()
+        try:
+            return date.fromisoformat(raw)
+        except ValueError:
+            raise serializers.ValidationError({'as_of': ["Fecha inválida (AAAA-MM-DD)."]})
+
+    @action(detail=False)
+    def aging(self, request):
+        as_of = self.get_as_of(request)
+        client = request.query_params.get('client', '')
+        rows, totals = aging_report(as_of, int(client) if client.isdigit() else None)
+        fields = [field for field, _, _, _ in AGING_BUCKETS] + ['total']
+        return Response({
+            'as_of': as_of,
+            'buckets': [{'field': field, 'label': label} for field, label, _, _ in AGING_BUCKETS],
+            'results': [
+                {'client': row['client_id'], 'client_name': row['client__name'],
+                 **{field: str(row[field]) for field in fields}, 'oldest_due': row['oldest_due']}
+                for row in rows
+            ],
+            'totals': {field: str(totals[field]) for field in fields},
+        })
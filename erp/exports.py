@@ -0,0 +1,61 @@
+import csv
+
+from django.db.models import F
+
+from .models import Payment, Purchase, Sale
+
+
+# -------------------------------------------------------------------------
+# LIBROS (LEDGERS) EXPORTABLES
+# -------------------------------------------------------------------------
+# Cada libro: (encabezados, queryset base, columnas)
+LEDGERS = {
+    'sales': (
+        ['Folio', 'Fecha', 'Vencimiento', 'Cliente ID', 'Cliente', 'Estado', 'Estado Pago',
+         'Total Items', 'Total Gastos', 'Pagado', 'Saldo'],
+        Sale.objects.all(),
+        ['folio', 'date', 'due_date', 'client_id', 'client__name', 'status', 'payment_status',
+         'items_total', 'expenses_total', 'paid_total', 'balance'],
+    ),
+    'purchases': (
+        ['Folio', 'Fecha', 'Proveedor ID', 'Proveedor', 'Estado',
+         'Total Items', 'Total Gastos', 'Total'],
+        Purchase.objects.with_totals(),
+        ['folio', 'date', 'supplier_id', 'supplier__name', 'status',
+         'items_amount', 'expenses_amount', 'total_amount'],
+    ),
+    'payments': (
+        ['ID', 'Fecha', 'Cliente ID', 'Cliente', 'Monto', 'Asignado', 'Disponible'],
+        Payment.objects.with_allocated().annotate(unallocated=F('amount') - F('allocated')),
+        ['id', 'date', 'client_id', 'client__name', 'amount', 'allocated', 'unallocated'],
+    ),
+}
+
+
+class Echo:
+    """Objeto tipo archivo que devuelve lo escrito (para csv.writer en streaming)"""
+
+    def write(self, value):
+        return value
+
+
+def ledger_rows(ledger, date_from=None, date_to=None, chunk_size=2000):
+    """
+    Genera el encabezado y las filas del libro en orden (date, id), leyendo la
+    base de datos por bloques con iterator(); la memoria no depende del total.
+    """
+    headers, queryset, columns = LEDGERS[ledger]
+    yield headers
+
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+    yield from queryset.order_by('date', 'id').values_list(*columns).iterator(chunk_size=chunk_size)
+
+
+def stream_csv(rows):
+    """Convierte filas en líneas CSV, una por una"""
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
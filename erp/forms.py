@@ -1,9 +1,92 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from django.forms.models import BaseInlineFormSet
+from django.urls import reverse
+from django.utils.functional import cached_property
 from .models import (
     Supplier, Product, Client, Purchase, PurchaseItem, PurchaseExpense,
     Sale, SaleItem, SaleExpense, Payment, PaymentAllocation
 )
 
+# Selectores de catálogo (productos, clientes, proveedores)
+class AutocompleteSelect(forms.Select):
+    """
+    Select que solo renderiza la opción seleccionada; el resto se busca con
+    el endpoint catalog-autocomplete desde el navegador.
+    """
+    template_name = 'widgets/autocomplete_select.html'
+
+    def __init__(self, catalog, attrs=None):
+        super().__init__(attrs)
+        self.catalog = catalog
+        self.cache = None
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete-url'] = reverse(
+            'catalog-autocomplete', args=[self.catalog]
+        )
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [str(v) for v in value if v not in ('', None) and str(v).isdigit()]
+        options = [self.create_option(name, '', '---------', not selected, 0)]
+        for index, (pk, label) in enumerate(self.selected_labels(selected), start=1):
+            options.append(self.create_option(name, pk, label, True, index))
+        return [(None, options, 0)]
+
+    def selected_labels(self, selected):
+        if not selected:
+            return []
+        if self.cache is not None:
+            return [(pk, str(self.cache[int(pk)])) for pk in selected if int(pk) in self.cache]
+        return [(str(obj.pk), str(obj)) for obj in self.choices.queryset.filter(pk__in=selected)]
+
+class CatalogChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField que puede validar contra una caché compartida (ver CatalogFormSet)"""
+
+    def __init__(self, queryset, **kwargs):
+        super().__init__(queryset, **kwargs)
+        self.cache = None
+
+    def use_cache(self, cache):
+        self.cache = cache
+        self.widget.cache = cache
+
+    def to_python(self, value):
+        if self.cache is None or value in self.empty_values:
+            return super().to_python(value)
+        obj = self.cache.get(int(value)) if str(value).isdigit() else None
+        if obj is None:
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return obj
+
+class CatalogFormSet(BaseInlineFormSet):
+    """
+    Formset que resuelve los productos de todas las filas con un solo in_bulk,
+    en lugar de una consulta por fila al validar y al renderizar.
+    """
+    catalog_field = 'product'
+
+    @cached_property
+    def catalog_cache(self):
+        ids = {getattr(obj, f'{self.catalog_field}_id') for obj in self.get_queryset()}
+        if self.is_bound:
+            for key, value in self.data.items():
+                if (key.startswith(f'{self.prefix}-') and key.endswith(f'-{self.catalog_field}')
+                        and value.isdigit()):
+                    ids.add(int(value))
+        return self.form.base_fields[self.catalog_field].queryset.in_bulk(ids)
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        form.fields[self.catalog_field].use_cache(self.catalog_cache)
+        return form
+
 class SupplierForm(forms.ModelForm):
     class Meta:
         model = Supplier
@@ -41,8 +124,9 @@ class PurchaseForm(forms.ModelForm):
     class Meta:
         model = Purchase
         fields = ['supplier', 'date', 'status', 'notes']
+        field_classes = {'supplier': CatalogChoiceField}
         widgets = {
-            'supplier': forms.Select(attrs={'class': 'form-control'}),
+            'supplier': AutocompleteSelect('suppliers', attrs={'class': 'form-control'}),
             'date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'status': forms.Select(attrs={'class': 'form-control'}),
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
@@ -52,8 +136,9 @@ class PurchaseItemForm(forms.ModelForm):
     class Meta:
         model = PurchaseItem
         fields = ['product', 'quantity', 'unit_price']
+        field_classes = {'product': CatalogChoiceField}
         widgets = {
-            'product': forms.Select(attrs={'class': 'form-control'}),
+            'product': AutocompleteSelect('products', attrs={'class': 'form-control'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control'}),
             'unit_price': forms.NumberInput(attrs={'class': 'form-control'}),
         }
@@ -71,8 +156,9 @@ class SaleForm(forms.ModelForm):
     class Meta:
         model = Sale
         fields = ['client', 'date', 'due_date', 'status', 'payment_status', 'notes']
+        field_classes = {'client': CatalogChoiceField}
         widgets = {
-            'client': forms.Select(attrs={'class': 'form-control'}),
+            'client': AutocompleteSelect('clients', attrs={'class': 'form-control'}),
             'date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'due_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'status': forms.Select(attrs={'class': 'form-control'}),
@@ -84,8 +170,9 @@ class SaleItemForm(forms.ModelForm):
     class Meta:
         model = SaleItem
         fields = ['product', 'quantity', 'unit_price']
+        field_classes = {'product': CatalogChoiceField}
         widgets = {
-            'product': forms.Select(attrs={'class': 'form-control'}),
+            'product': AutocompleteSelect('products', attrs={'class': 'form-control'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control'}),
             'unit_price': forms.NumberInput(attrs={'class': 'form-control'}),
         }
@@ -103,8 +190,9 @@ class PaymentForm(forms.ModelForm):
     class Meta:
         model = Payment
         fields = ['client', 'date', 'amount', 'notes']
+        field_classes = {'client': CatalogChoiceField}
         widgets = {
-            'client': forms.Select(attrs={'class': 'form-control'}),
+            'client': AutocompleteSelect('clients', attrs={'class': 'form-control'}),
             'date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'amount': forms.NumberInput(attrs={'class': 'form-control'}),
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
@@ -117,4 +205,15 @@ class PaymentAllocationForm(forms.ModelForm):
         widgets = {
             'sale': forms.Select(attrs={'class': 'form-control'}),
             'amount': forms.NumberInput(attrs={'class': 'form-control'}),
-        }
\ No newline at end of file
+        }
+
+class CatalogImportForm(forms.Form):
+    catalog = forms.ChoiceField(
+        label="Catálogo",
+        choices=[('products', 'Productos'), ('clients', 'Clientes'), ('suppliers', 'Proveedores')],
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    file = forms.FileField(
+        label="Archivo CSV",
+        help_text="Codificación UTF-8 con encabezados; la columna name es obligatoria.",
+    )
@@ -0,0 +1,171 @@
+import csv
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+import logging
+
+from .models import Client, ClientBalance, Product, Supplier
+
+logger = logging.getLogger(__name__)
+
+
+# -------------------------------------------------------------------------
+# CATÁLOGOS IMPORTABLES
+# -------------------------------------------------------------------------
+# Columnas aceptadas por catálogo (name es obligatoria)
+CATALOGS = {
+    'products': (Product, ['name', 'description', 'unit_type', 'reference_price', 'min_stock', 'active']),
+    'clients': (Client, ['name', 'contact_info', 'active']),
+    'suppliers': (Supplier, ['name', 'contact_info', 'active']),
+}
+
+TRUE_VALUES = {'1', 'true', 't', 'si', 'sí', 's', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n'}
+
+
+class ImportResult:
+    """Resumen de una importación: creados, actualizados y errores por línea"""
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.errors = []  # [(línea, mensaje)]
+
+    @property
+    def total(self):
+        return self.created + self.updated
+
+
+def build_instance(model, columns, row):
+    """
+    Construye una instancia sin guardar a partir de la fila y la valida con
+    clean_fields() (sin consultas a la base de datos). Las celdas vacías
+    conservan el valor por defecto del modelo.
+    """
+    values = {}
+    for column in columns:
+        value = (row.get(column) or '').strip()
+        if not value:
+            continue
+        if column == 'active':
+            if value.lower() not in TRUE_VALUES | FALSE_VALUES:
+                raise ValidationError({'active': f"Valor booleano inválido: {value}"})
+            value = value.lower() in TRUE_VALUES
+        values[column] = value
+    if 'name' not in values:
+        raise ValidationError({'name': "El nombre es obligatorio."})
+
+    instance = model(**values)
+    instance.clean_fields(exclude=[f.name for f in model._meta.fields if f.name not in columns])
+    return instance
+
+
+def format_error(error):
+    """Aplana un ValidationError en un solo mensaje legible"""
+    if hasattr(error, 'message_dict'):
+        return '; '.join(f"{name}: {' '.join(messages)}" for name, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+def utf8_lines(upload):
+    """
+    Líneas de texto de un archivo subido, leídas en streaming. Antes recorre
+    el archivo completo para validar la codificación: los lotes de la
+    importación se confirman por separado y un UnicodeDecodeError a mitad del
+    archivo dejaría una importación parcial. Lanza UnicodeDecodeError.
+    """
+    for line in upload:
+        line.decode('utf-8')
+    upload.seek(0)
+    return (line.decode('utf-8-sig') for line in upload)
+
+
+def import_catalog(catalog, lines, batch_size=1000):
+    """
+    Importa un CSV (iterable de líneas de texto, leído en streaming) al catálogo.
+    Valida por lotes de batch_size filas; las filas con error se reportan y no
+    detienen el lote. Los productos se insertan/actualizan con un solo
+    INSERT ... ON CONFLICT (name) DO UPDATE por lote; clientes y proveedores se
+    emparejan por nombre con una consulta por lote.
+    """
+    model, columns = CATALOGS[catalog]
+    reader = csv.DictReader(lines)
+    result = ImportResult()
+    if not reader.fieldnames or 'name' not in [c.strip() for c in reader.fieldnames]:
+        result.errors.append((1, "El archivo debe tener encabezados y una columna 'name'."))
+        return result
+    reader.fieldnames = [c.strip() for c in reader.fieldnames]
+    # Solo se actualizan las columnas presentes en el archivo
+    columns = [c for c in columns if c in reader.fieldnames]
+
+    rows = enumerate(reader, start=2)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        instances = {}
+        for line, row in batch:
+            try:
+                instance = build_instance(model, columns, row)
+            except ValidationError as e:
+                result.errors.append((line, format_error(e)))
+                continue
+            # Si el nombre se repite en el lote, gana la última fila
+            instances[instance.name] = instance
+        if instances:
+            save = upsert_products if model is Product else upsert_by_name
+            created, updated = save(model, columns, list(instances.values()))
+            result.created += created
+            result.updated += updated
+
+    logger.info(
+        f"Importación de {catalog}: {result.created} creado(s), {result.updated} actualizado(s), "
+        f"{len(result.errors)} error(es)"
+    )
+    return result
+
+
+def upsert_products(model, columns, instances):
+    """Upsert por Product.name (único) con bulk_create(update_conflicts=True)"""
+    names = [instance.name for instance in instances]
+    with transaction.atomic():
+        existing = set(model.objects.filter(name__in=names).values_list('name', flat=True))
+        model.objects.bulk_create(
+            instances,
+            update_conflicts=True,
+            unique_fields=['name'],
+            update_fields=[c for c in columns if c != 'name'] + ['updated_at'],
+        )
+    return len(instances) - len(existing), len(existing)
+
+
+def upsert_by_name(model, columns, instances):
+    """
+    Clientes y proveedores no tienen nombre único: se actualiza el registro más
+    antiguo con ese nombre y se crean los que no existen.
+    """
+    names = [instance.name for instance in instances]
+    with transaction.atomic():
+        existing = {}
+        for pk, name in model.objects.filter(name__in=names).order_by('-pk').values_list('pk', 'name'):
+            existing[name] = pk
+
+        to_update, to_create = [], []
+        for instance in instances:
+            if instance.name in existing:
+                instance.pk = existing[instance.name]
+                to_update.append(instance)
+            else:
+                to_create.append(instance)
+
+        now = timezone.now()
+        for instance in to_update:
+            instance.updated_at = now
+        model.objects.bulk_update(to_update, [c for c in columns if c != 'name'] + ['updated_at'])
+        created = model.objects.bulk_create(to_create)
+        if model is Client and created:
+            # bulk_create no dispara post_save: se crean los resúmenes de saldo
+            ClientBalance.rebuild(Client.objects.filter(pk__in=[c.pk for c in created]))
+    return len(to_create), len(to_update)
@@ -0,0 +1,102 @@
+import re
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+
+# -------------------------------------------------------------------------
+# REGISTRO DE CONSULTAS
+# -------------------------------------------------------------------------
+class QueryBudgetExceeded(AssertionError):
+    """Se emitieron más consultas que el presupuesto permitido"""
+
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    Normaliza una sentencia para agrupar las repetidas: literales y listas
+    IN (%s, %s, ...) se reemplazan, así dos consultas que solo difieren en
+    sus valores (el patrón N+1) tienen la misma huella.
+    """
+    sql = _LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+class QueryStats:
+    """
+    Consultas ejecutadas dentro de record_queries(): cantidad, tiempo total,
+    huellas repetidas y las sentencias más lentas. Se usa como
+    connection.execute_wrapper.
+    """
+
+    def __init__(self):
+        self.queries = []  # [(sql, segundos)]
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def duplicates(self):
+        """{huella: veces} de las consultas ejecutadas más de una vez"""
+        counts = {}
+        for sql, _ in self.queries:
+            key = fingerprint(sql)
+            counts[key] = counts.get(key, 0) + 1
+        return {key: n for key, n in counts.items() if n > 1}
+
+    def slowest(self, limit=5):
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:limit]
+
+    def summary(self, slowest=3):
+        """Resumen serializable (para el log estructurado)"""
+        duplicates = self.duplicates()
+        return {
+            'queries': self.count,
+            'db_ms': round(self.total_time * 1000, 2),
+            'duplicates': sum(duplicates.values()) - len(duplicates),
+            'duplicate_fingerprints': sorted(duplicates, key=duplicates.get, reverse=True)[:slowest],
+            'slowest': [
+                {'ms': round(duration * 1000, 2), 'sql': sql[:300]}
+                for sql, duration in self.slowest(slowest)
+            ],
+        }
+
+
+@contextmanager
+def record_queries(budget=None, using=None):
+    """
+    Registra las consultas de todas las conexiones (o solo `using`) dentro del
+    bloque y devuelve QueryStats. Con budget, lanza QueryBudgetExceeded al
+    salir si se superó; útil en pruebas:
+
+        with record_queries(budget=8):
+            client.get(reverse('sale-list'))
+    """
+    stats = QueryStats()
+    aliases = [using] if using else list(connections)
+    with ExitStack() as stack:
+        for alias in aliases:
+            stack.enter_context(connections[alias].execute_wrapper(stats))
+        yield stats
+    if budget is not None and stats.count > budget:
+        raise QueryBudgetExceeded(
+            f"{stats.count} consultas (presupuesto: {budget}); "
+            f"repetidas: {stats.duplicates()}"
+        )
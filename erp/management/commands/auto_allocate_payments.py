@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from erp.models import Payment
+
+
+class Command(BaseCommand):
+    help = "Asigna automáticamente los pagos con monto disponible a las ventas abiertas"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--strategy', default='oldest_due_first',
+            choices=sorted(Payment.ALLOCATION_STRATEGIES),
+            help="Orden en que se cubren las ventas abiertas"
+        )
+        parser.add_argument(
+            '--client', type=int, action='append', dest='clients',
+            help="Limitar a los pagos de estos clientes (id); se puede repetir"
+        )
+
+    def handle(self, *args, **options):
+        queryset = Payment.objects.all()
+        if options['clients']:
+            queryset = queryset.filter(client_id__in=options['clients'])
+        try:
+            created = Payment.auto_allocate_pending(options['strategy'], queryset)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"{created} asignación(es) creada(s)."))
@@ -0,0 +1,227 @@
+import json
+import statistics
+import subprocess
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client as TestClient
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from erp.instrumentation import record_queries
+from erp.models import (
+    Client, Payment, PaymentAllocation, Product, Purchase, Sale, SaleItem, StockMovement
+)
+
+# Vistas medidas: (nombre del benchmark, nombre de la URL)
+VIEWS = [
+    ('view.sale_list', 'sale-list'),
+    ('view.product_list', 'product-list'),
+    ('view.aging_report', 'aging-report'),
+    ('admin.sale_changelist', 'admin:erp_sale_changelist'),
+    ('admin.purchase_changelist', 'admin:erp_purchase_changelist'),
+    ('admin.payment_changelist', 'admin:erp_payment_changelist'),
+    ('admin.client_changelist', 'admin:erp_client_changelist'),
+    ('admin.product_changelist', 'admin:erp_product_changelist'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide los caminos críticos del ERP (guardado de items y asignaciones, deuda del "
+        "cliente, listados y changelists del admin) y emite los resultados en JSON para "
+        "compararlos entre commits. Usar sobre datos de generate_data"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10, help="Corridas medidas por benchmark")
+        parser.add_argument('--warmup', type=int, default=1, help="Corridas previas sin medir")
+        parser.add_argument('--only', nargs='+', help="Ejecuta solo los benchmarks que empiezan así")
+        parser.add_argument('--label', help="Etiqueta de la corrida (por defecto, el commit actual)")
+        parser.add_argument('--user', help="Email del superusuario para las vistas (por defecto, el primero)")
+        parser.add_argument('--output', '-o', help="Archivo JSON de salida (por defecto stdout)")
+        parser.add_argument('--compare', help="JSON de una corrida anterior para mostrar la diferencia")
+
+    def handle(self, *args, **options):
+        if settings.DEBUG:
+            self.stderr.write(self.style.WARNING(
+                "DEBUG está activo: Django guarda cada consulta y los tiempos no son representativos."
+            ))
+        if options['repeat'] < 1:
+            raise CommandError("--repeat debe ser mayor a 0.")
+        if not Sale.objects.exists():
+            raise CommandError("No hay ventas; genere datos primero con generate_data.")
+
+        self.repeat, self.warmup = options['repeat'], options['warmup']
+        self.user = self.get_user(options['user'])
+        benchmarks = [
+            ('model.sale_item_save', self.bench_sale_item_save),
+            ('model.payment_allocation_save', self.bench_payment_allocation_save),
+            ('model.client_get_total_debt', self.bench_client_get_total_debt),
+        ] + [(name, self.bench_view(url_name)) for name, url_name in VIEWS]
+        if options['only']:
+            benchmarks = [(n, b) for n, b in benchmarks if n.startswith(tuple(options['only']))]
+
+        results = []
+        # El cliente de pruebas usa el host "testserver"
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for name, bench in benchmarks:
+                result = self.measure(name, *bench())
+                results.append(result)
+                self.stderr.write(
+                    f"{name:34} mediana {result['median_ms']:9.2f} ms  "
+                    f"p95 {result['p95_ms']:9.2f} ms  {result['queries']} consulta(s)"
+                )
+
+        report = {
+            'label': options['label'] or self.git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'rows': {
+                'clients': Client.objects.count(),
+                'products': Product.objects.count(),
+                'purchases': Purchase.objects.count(),
+                'sales': Sale.objects.count(),
+                'sale_items': SaleItem.objects.count(),
+                'payments': Payment.objects.count(),
+                'stock_movements': StockMovement.objects.count(),
+            },
+            'repeat': self.repeat,
+            'results': results,
+        }
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+        payload = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(payload)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['output']}."))
+        else:
+            self.stdout.write(payload)
+
+    # ---------------------------------------------------------------------
+    # MEDICIÓN
+    # ---------------------------------------------------------------------
+    def measure(self, name, prepare, run, rollback=False):
+        """
+        Ejecuta prepare() (sin medir) y run(*preparado) warmup + repeat veces.
+        Con rollback, cada corrida va en su propia transacción revertida para
+        no alterar los datos entre corridas.
+        """
+        timings, queries = [], None
+        for index in range(self.warmup + self.repeat):
+            with transaction.atomic() if rollback else nullcontext():
+                args = prepare()
+                with record_queries() as stats:
+                    start = time.perf_counter()
+                    run(*args)
+                    elapsed = time.perf_counter() - start
+                if rollback:
+                    transaction.set_rollback(True)
+            if index >= self.warmup:
+                timings.append(elapsed * 1000)
+                queries = stats.count
+
+        timings.sort()
+        return {
+            'name': name,
+            'runs': len(timings),
+            'queries': queries,
+            'min_ms': round(timings[0], 3),
+            'median_ms': round(statistics.median(timings), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            'max_ms': round(timings[-1], 3),
+        }
+
+    def compare(self, report, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                baseline = {r['name']: r for r in json.load(f)['results']}
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"No se pudo leer {path}: {e}")
+        for result in report['results']:
+            base = baseline.get(result['name'])
+            if not base or not base['median_ms']:
+                continue
+            change = (result['median_ms'] - base['median_ms']) / base['median_ms'] * 100
+            result['baseline_median_ms'] = base['median_ms']
+            result['change_pct'] = round(change, 1)
+            style = self.style.ERROR if change > 10 else self.style.SUCCESS
+            self.stderr.write(style(
+                f"{result['name']:34} {base['median_ms']:9.2f} -> {result['median_ms']:9.2f} ms "
+                f"({change:+.1f}%), consultas {base['queries']} -> {result['queries']}"
+            ))
+
+    def get_user(self, email):
+        users = get_user_model().objects.filter(is_superuser=True, is_active=True)
+        if email:
+            users = users.filter(email=email)
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError("Se necesita un superusuario activo para medir las vistas del admin.")
+        return user
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    # ---------------------------------------------------------------------
+    # BENCHMARKS: cada uno devuelve (prepare, run[, rollback])
+    # ---------------------------------------------------------------------
+    def bench_sale_item_save(self):
+        sale = Sale.objects.filter(status=Sale.Status.COMPLETED).order_by('-pk').first()
+        product = Product.objects.filter(stock__gte=1).exclude(sale_items__sale=sale).first()
+        if product is None:
+            raise CommandError("No hay productos con stock para medir SaleItem.save.")
+
+        def prepare():
+            return [SaleItem(sale=sale, product=product, quantity=1, unit_price=product.reference_price)]
+
+        return prepare, lambda item: item.save(), True
+
+    def bench_payment_allocation_save(self):
+        sale = Sale.objects.filter(
+            status=Sale.Status.COMPLETED, payment_status=Sale.PaymentStatus.CREDIT, balance__gte=1
+        ).order_by('-pk').first()
+        if sale is None:
+            raise CommandError("No hay ventas a crédito con saldo para medir PaymentAllocation.save.")
+
+        def prepare():
+            payment = Payment.objects.create(client_id=sale.client_id, date=sale.date, amount=1)
+            return [PaymentAllocation(payment=payment, sale=sale, amount=1)]
+
+        return prepare, lambda allocation: allocation.save(), True
+
+    def bench_client_get_total_debt(self):
+        client_id = Client.objects.annotate(n=Count('sales')).order_by('-n').values_list(
+            'pk', flat=True
+        ).first()
+        return lambda: [Client.objects.get(pk=client_id)], lambda client: client.get_total_debt()
+
+    def bench_view(self, url_name):
+        def bench():
+            client = TestClient()
+            client.force_login(self.user)
+            url = reverse(url_name)
+
+            def run():
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f"{url} respondió {response.status_code}")
+
+            return lambda: [], run
+        return bench
@@ -0,0 +1,45 @@
+import csv
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from erp.exports import LEDGERS, ledger_rows
+
+
+class Command(BaseCommand):
+    help = "Exporta en CSV (en streaming) el libro de ventas, compras o pagos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('ledger', choices=sorted(LEDGERS))
+        parser.add_argument('--date-from', type=date.fromisoformat, help="Fecha inicial (AAAA-MM-DD)")
+        parser.add_argument('--date-to', type=date.fromisoformat, help="Fecha final (AAAA-MM-DD)")
+        parser.add_argument('--output', '-o', help="Archivo de salida (por defecto stdout)")
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help="Filas leídas por bloque de la base de datos"
+        )
+
+    def handle(self, *args, **options):
+        rows = ledger_rows(
+            options['ledger'], options['date_from'], options['date_to'], options['chunk_size']
+        )
+        output = sys.stdout
+        if options['output']:
+            try:
+                output = open(options['output'], 'w', newline='', encoding='utf-8')
+            except OSError as e:
+                raise CommandError(f"No se pudo abrir {options['output']}: {e}")
+
+        count = -1
+        try:
+            writer = csv.writer(output)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"{count} fila(s) exportada(s) a {options['output']}."))
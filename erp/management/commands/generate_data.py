@@ -0,0 +1,292 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from erp.models import (
+    Client, ClientBalance, ClientStatementCheckpoint, Payment, PaymentAllocation, Product,
+    ProductCostHistory, Purchase, PurchaseExpense, PurchaseItem, Sale, SaleExpense, SaleItem,
+    StockMovement, Supplier, reserve_folios, to_decimal
+)
+
+# Tamaños predefinidos: (clientes, productos, proveedores, ventas, compras)
+SCALES = {
+    '10k': (200, 100, 20, 10_000, 1_500),
+    '100k': (2_000, 500, 50, 100_000, 15_000),
+    '1m': (20_000, 2_000, 200, 1_000_000, 150_000),
+}
+
+EXPENSES = ['Flete', 'Empaque', 'Descargue', 'Comisión']
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera un conjunto de datos sintético y reproducible (semilla) para pruebas de "
+        "rendimiento: clientes, productos, compras, ventas, gastos y pagos con "
+        "asignaciones parciales, insertados en bloque"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='10k',
+                            help="Tamaño predefinido (ventas aproximadas)")
+        parser.add_argument('--clients', type=int, help="Cantidad de clientes")
+        parser.add_argument('--products', type=int, help="Cantidad de productos")
+        parser.add_argument('--suppliers', type=int, help="Cantidad de proveedores")
+        parser.add_argument('--sales', type=int, help="Cantidad de ventas")
+        parser.add_argument('--purchases', type=int, help="Cantidad de compras")
+        parser.add_argument('--years', type=int, default=3, help="Años de historia hasta hoy")
+        parser.add_argument('--seed', type=int, default=42, help="Semilla del generador")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Documentos acumulados antes de cada inserción en bloque")
+
+    def handle(self, *args, **options):
+        clients, products, suppliers, sales, purchases = SCALES[options['scale']]
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        counts = {
+            'clients': options['clients'] or clients,
+            'products': options['products'] or products,
+            'suppliers': options['suppliers'] or suppliers,
+            'sales': options['sales'] or sales,
+            'purchases': options['purchases'] or purchases,
+        }
+        if min(counts.values()) < 1 or options['years'] < 1:
+            raise CommandError("Todas las cantidades deben ser mayores a 0.")
+
+        with transaction.atomic():
+            self.create_catalogs(counts, options['seed'])
+            self.create_documents(counts, options['years'])
+
+        # Costo promedio, costo de venta de los items, acumulados, saldos y puntos de
+        # control del estado de cuenta, con los
+        # comandos de reconstrucción
+        call_command('rebuild_average_cost', stdout=self.stdout)
+        call_command('rebuild_rollups', only='purchases', stdout=self.stdout)
+        Product.refresh_last_cost(self.products)
+        ClientBalance.rebuild(Client.objects.filter(pk__in=self.clients))
+        ClientStatementCheckpoint.rebuild(Client.objects.filter(pk__in=self.clients))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generados: {len(self.clients)} cliente(s), {len(self.products)} producto(s), "
+            f"{self.totals['purchases']} compra(s), {self.totals['sales']} venta(s), "
+            f"{self.totals['items']} item(s), {self.totals['payments']} pago(s)."
+        ))
+
+    # ---------------------------------------------------------------------
+    # CATÁLOGOS
+    # ---------------------------------------------------------------------
+    def create_catalogs(self, counts, seed):
+        rng = self.rng
+        tag = f"S{seed}"
+        if Product.objects.filter(name__startswith=f"Producto {tag}-").exists():
+            raise CommandError(
+                f"Ya existen datos generados con la semilla {seed} (Product.name es único); "
+                "use otra --seed."
+            )
+        self.suppliers = [s.pk for s in Supplier.objects.bulk_create(
+            [Supplier(name=f"Proveedor {tag}-{i:05d}") for i in range(counts['suppliers'])],
+            batch_size=self.batch_size,
+        )]
+        self.clients = [c.pk for c in Client.objects.bulk_create(
+            [Client(name=f"Cliente {tag}-{i:06d}") for i in range(counts['clients'])],
+            batch_size=self.batch_size,
+        )]
+        catalog = []
+        for i in range(counts['products']):
+            cost = to_decimal(rng.uniform(1, 200))
+            catalog.append(Product(
+                name=f"Producto {tag}-{i:05d}",
+                unit_type=rng.choice([u for u, _ in Product.UNIT_CHOICES]),
+                reference_price=to_decimal(cost * Decimal(rng.uniform(1.15, 1.6))),
+                min_stock=Decimal(rng.randint(0, 50)),
+            ))
+        self.products = {}
+        for product in Product.objects.bulk_create(catalog, batch_size=self.batch_size):
+            # [costo base, precio de referencia, stock simulado]
+            self.products[product.pk] = [
+                to_decimal(product.reference_price / Decimal('1.35')),
+                product.reference_price,
+                Decimal('0'),
+            ]
+
+    # ---------------------------------------------------------------------
+    # DOCUMENTOS
+    # ---------------------------------------------------------------------
+    def create_documents(self, counts, years):
+        """
+        Simula los días en orden cronológico: primero las compras del día (entran
+        al stock simulado) y luego las ventas, limitadas al stock disponible,
+        de modo que el diario de movimientos y Product.stock cuadran.
+        """
+        rng = self.rng
+        today = timezone.now().date()
+        days = years * 365
+        start = today - timedelta(days=days - 1)
+        purchases_per_day = counts['purchases'] / days
+        sales_per_day = counts['sales'] / days
+        product_ids = list(self.products)
+
+        self.totals = dict.fromkeys(['purchases', 'sales', 'items', 'payments'], 0)
+        self.reset_buffers()
+        owed_purchases = owed_sales = 0.0
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            owed_purchases += purchases_per_day
+            owed_sales += sales_per_day
+            while owed_purchases >= 1:
+                owed_purchases -= 1
+                self.add_purchase(day, rng.sample(product_ids, rng.randint(1, min(5, len(product_ids)))))
+            while owed_sales >= 1:
+                owed_sales -= 1
+                self.add_sale(day, today, rng.sample(product_ids, rng.randint(1, min(5, len(product_ids)))))
+            if len(self.purchases) + len(self.sales) >= self.batch_size:
+                self.flush()
+        self.flush()
+
+        Product.objects.bulk_update(
+            [Product(pk=pk, stock=stock) for pk, (_, _, stock) in self.products.items()],
+            ['stock'], batch_size=self.batch_size,
+        )
+
+    def reset_buffers(self):
+        self.purchases, self.sales = [], []
+        self.payments = []
+        # Movimientos en orden cronológico: (documento, product_id, delta, costo)
+        self.movements = []
+
+    def add_purchase(self, day, product_ids):
+        rng = self.rng
+        purchase = Purchase(
+            supplier_id=rng.choice(self.suppliers), date=day, status=Purchase.Status.COMPLETED
+        )
+        purchase.lines = []
+        for product_id in product_ids:
+            cost, _, _ = self.products[product_id]
+            quantity = Decimal(rng.randint(20, 200))
+            unit_price = to_decimal(cost * Decimal(rng.uniform(0.9, 1.1)))
+            purchase.lines.append(PurchaseItem(product_id=product_id, quantity=quantity,
+                                               unit_price=unit_price))
+            self.products[product_id][2] += quantity
+            self.movements.append((purchase, product_id, quantity, unit_price))
+        purchase.extra = []
+        if rng.random() < 0.3:
+            purchase.extra.append(PurchaseExpense(
+                description=rng.choice(EXPENSES), amount=to_decimal(rng.uniform(5, 80))
+            ))
+        self.purchases.append(purchase)
+
+    def add_sale(self, day, today, product_ids):
+        rng = self.rng
+        lines = []
+        for product_id in product_ids:
+            _, price, stock = self.products[product_id]
+            quantity = min(Decimal(rng.randint(1, 10)), stock)
+            if quantity > 0:
+                lines.append((product_id, quantity, to_decimal(price * Decimal(rng.uniform(0.95, 1.1)))))
+        if not lines:
+            return
+
+        cash = rng.random() < 0.4
+        sale = Sale(
+            client_id=rng.choice(self.clients), date=day,
+            status=Sale.Status.COMPLETED if rng.random() < 0.97 else Sale.Status.PENDING,
+            payment_status=Sale.PaymentStatus.CREDIT,
+            due_date=None if cash else day + timedelta(days=rng.choice([15, 30, 45, 60])),
+        )
+        sale.lines = []
+        for product_id, quantity, unit_price in lines:
+            sale.lines.append(SaleItem(product_id=product_id, quantity=quantity, unit_price=unit_price))
+            self.products[product_id][2] -= quantity
+            self.movements.append((sale, product_id, -quantity, None))
+        sale.extra = []
+        if rng.random() < 0.2:
+            sale.extra.append(SaleExpense(
+                description=rng.choice(EXPENSES), amount=to_decimal(rng.uniform(2, 40))
+            ))
+        sale.items_total = to_decimal(sum(item.get_total() for item in sale.lines))
+        sale.expenses_total = to_decimal(sum(expense.amount for expense in sale.extra))
+        total = sale.items_total + sale.expenses_total
+
+        # Contado: pago completo el mismo día. Crédito: abono parcial (o total) posterior
+        paid = Decimal('0.00')
+        if sale.status == Sale.Status.COMPLETED and total > 0:
+            if cash:
+                paid, paid_on = total, day
+            elif rng.random() < 0.7:
+                paid = total if rng.random() < 0.5 else to_decimal(total * Decimal(rng.uniform(0.1, 0.9)))
+                paid_on = min(day + timedelta(days=rng.randint(1, 90)), today)
+        if paid > 0:
+            # A veces el cliente paga de más y queda crédito sin asignar
+            amount = paid + (to_decimal(rng.uniform(1, 50)) if rng.random() < 0.05 else 0)
+            self.payments.append((sale, Payment(client_id=sale.client_id, date=paid_on, amount=amount), paid))
+        sale.paid_total = paid
+        sale.balance = total - paid
+        if paid == total and total > 0:
+            sale.payment_status = Sale.PaymentStatus.PAID
+        self.sales.append(sale)
+
+    def flush(self):
+        """Inserta en bloque los documentos acumulados y sus hijos"""
+        if not (self.purchases or self.sales):
+            return
+        for prefix, documents in (('PURCHASE', self.purchases), ('SALE', self.sales)):
+            if documents:
+                for document, folio in zip(documents, reserve_folios(prefix, len(documents))):
+                    document.folio = folio
+        Purchase.objects.bulk_create(self.purchases, batch_size=self.batch_size)
+        Sale.objects.bulk_create(self.sales, batch_size=self.batch_size)
+
+        purchase_items, purchase_expenses, cost_history = [], [], []
+        for purchase in self.purchases:
+            for item in purchase.lines:
+                item.purchase_id = purchase.pk
+                purchase_items.append(item)
+                cost_history.append(ProductCostHistory(
+                    product_id=item.product_id, cost=item.unit_price, date=purchase.date
+                ))
+            for expense in purchase.extra:
+                expense.purchase_id = purchase.pk
+                purchase_expenses.append(expense)
+        sale_items, sale_expenses = [], []
+        for sale in self.sales:
+            for item in sale.lines:
+                item.sale_id = sale.pk
+                sale_items.append(item)
+            for expense in sale.extra:
+                expense.sale_id = sale.pk
+                sale_expenses.append(expense)
+
+        PurchaseItem.objects.bulk_create(purchase_items, batch_size=self.batch_size)
+        PurchaseExpense.objects.bulk_create(purchase_expenses, batch_size=self.batch_size)
+        ProductCostHistory.objects.bulk_create(cost_history, batch_size=self.batch_size)
+        SaleItem.objects.bulk_create(sale_items, batch_size=self.batch_size)
+        SaleExpense.objects.bulk_create(sale_expenses, batch_size=self.batch_size)
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                product_id=product_id, delta=delta, unit_cost=unit_cost,
+                source_type=(StockMovement.Source.PURCHASE if isinstance(document, Purchase)
+                             else StockMovement.Source.SALE),
+                source_id=document.pk,
+            )
+            for document, product_id, delta, unit_cost in self.movements
+        ], batch_size=self.batch_size)
+
+        Payment.objects.bulk_create([payment for _, payment, _ in self.payments],
+                                    batch_size=self.batch_size)
+        PaymentAllocation.objects.bulk_create([
+            PaymentAllocation(payment_id=payment.pk, sale_id=sale.pk, amount=paid)
+            for sale, payment, paid in self.payments
+        ], batch_size=self.batch_size)
+
+        self.totals['purchases'] += len(self.purchases)
+        self.totals['sales'] += len(self.sales)
+        self.totals['items'] += len(purchase_items) + len(sale_items)
+        self.totals['payments'] += len(self.payments)
+        self.stdout.write(
+            f"  {self.totals['sales']} venta(s), {self.totals['purchases']} compra(s)..."
+        )
+        self.reset_buffers()
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from erp.imports import CATALOGS, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Importa productos, clientes o proveedores desde un CSV (upsert por nombre)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('catalog', choices=sorted(CATALOGS))
+        parser.add_argument('path', help="Archivo CSV con encabezados (columna 'name' obligatoria)")
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Filas validadas y guardadas por lote"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as f:
+                result = import_catalog(options['catalog'], f, options['batch_size'])
+        except OSError as e:
+            raise CommandError(f"No se pudo leer {options['path']}: {e}")
+
+        for line, error in result.errors:
+            self.stderr.write(f"Línea {line}: {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.created} creado(s), {result.updated} actualizado(s), "
+            f"{len(result.errors)} fila(s) con error."
+        ))
@@ -0,0 +1,113 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from erp.models import DailySalesRollup, Product, SaleItem, StockMovement
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye el costo promedio ponderado de los productos recorriendo el "
+        "diario de movimientos en orden cronológico, y el costo de venta de los items"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help="Productos por transacción; también movimientos leídos por lote y filas por UPDATE"
+        )
+        parser.add_argument(
+            '--skip-sale-items', action='store_true',
+            help="No recalcula SaleItem.unit_cost"
+        )
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        self.update_items = not options['skip_sale_items']
+        self.sale_dates = set()
+        products_total = items_total = 0
+
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(product_ids), self.chunk_size):
+            products, items = self.rebuild_chunk(product_ids[start:start + self.chunk_size])
+            products_total += products
+            items_total += items
+
+        # El costo de venta acumulado sale de SaleItem.unit_cost: solo se
+        # recalculan los días con algún item cuyo costo cambió
+        rollups_total = sum(
+            DailySalesRollup.rebuild(date_from, date_to)
+            for date_from, date_to in self.date_ranges(self.sale_dates)
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{products_total} producto(s) y {items_total} item(s) de venta recalculados, "
+            f"{rollups_total} acumulado(s) diario(s) reescrito(s)."
+        ))
+
+    def rebuild_chunk(self, product_ids):
+        """
+        Recorre los movimientos de un lote de productos en su propia transacción,
+        con los productos bloqueados: una venta o compra concurrente espera al
+        UPDATE de stock y su movimiento entra en el recorrido o llega después,
+        con el costo ya corregido.
+        """
+        with transaction.atomic():
+            list(Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk')
+                 .values_list('pk', flat=True))
+            movements = StockMovement.objects.filter(product_id__in=product_ids).order_by(
+                'product_id', 'created_at', 'id'
+            ).values_list('product_id', 'delta', 'unit_cost', 'source_type', 'source_id')
+
+            costs = {}
+            item_costs = {}
+            current = None
+            stock = avg_cost = Decimal('0')
+            for product_id, delta, unit_cost, source_type, source_id in movements.iterator(
+                chunk_size=self.chunk_size
+            ):
+                if product_id != current:
+                    current, stock, avg_cost = product_id, Decimal('0'), Decimal('0')
+
+                if delta > 0 and unit_cost is not None:
+                    avg_cost = StockMovement.next_average_cost(stock, avg_cost, delta, unit_cost)
+                elif (delta < 0 and self.update_items
+                        and source_type == StockMovement.Source.SALE
+                        and (source_id, product_id) not in item_costs):
+                    # La primera salida de la venta fija el costo del item
+                    item_costs[(source_id, product_id)] = avg_cost
+                stock += delta
+                costs[product_id] = avg_cost
+
+            products = Product.objects.bulk_update(
+                [Product(pk=pk, avg_cost=cost) for pk, cost in costs.items()],
+                ['avg_cost'], batch_size=self.chunk_size,
+            )
+            items = self.update_item_costs(product_ids, item_costs) if item_costs else 0
+        return products, items
+
+    def update_item_costs(self, product_ids, item_costs):
+        """Escribe solo los items cuyo costo cambió y anota la fecha de su venta"""
+        items = []
+        for pk, sale_id, product_id, unit_cost, sale_date in SaleItem.objects.filter(
+            product_id__in=product_ids
+        ).values_list('pk', 'sale_id', 'product_id', 'unit_cost', 'sale__date').iterator(
+            chunk_size=self.chunk_size
+        ):
+            cost = item_costs.get((sale_id, product_id))
+            if cost is not None and cost != unit_cost:
+                items.append(SaleItem(pk=pk, unit_cost=cost))
+                self.sale_dates.add(sale_date)
+        return SaleItem.objects.bulk_update(items, ['unit_cost'], batch_size=self.chunk_size)
+
+    @staticmethod
+    def date_ranges(dates):
+        """Agrupa fechas en rangos (desde, hasta) de días consecutivos"""
+        ranges = []
+        for day in sorted(dates):
+            if ranges and day - ranges[-1][1] == timedelta(days=1):
+                ranges[-1][1] = day
+            else:
+                ranges.append([day, day])
+        return [tuple(r) for r in ranges]
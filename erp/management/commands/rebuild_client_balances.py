@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from erp.models import ClientBalance
+
+
+class Command(BaseCommand):
+    help = "Reconstruye en bloque los resúmenes de saldo de los clientes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Cantidad de clientes por bloque de upsert"
+        )
+
+    def handle(self, *args, **options):
+        processed = ClientBalance.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{processed} cliente(s) reconstruido(s)."))
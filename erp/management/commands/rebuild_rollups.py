@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+
+from erp.models import DailyPurchaseRollup, DailySalesRollup, Purchase, Sale
+
+ROLLUPS = {
+    'sales': (DailySalesRollup, Sale),
+    'purchases': (DailyPurchaseRollup, Purchase),
+}
+
+
+def rebuild_partition(rollup, date_from, date_to):
+    """Reconstruye un rango de fechas en su propia transacción y conexión"""
+    try:
+        return rollup.rebuild(date_from, date_to)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye los acumulados diarios de ventas y compras desde los items, por "
+        "particiones de fechas que pueden procesarse en paralelo. Cada partición reemplaza "
+        "sus filas en una transacción; conviene ejecutarlo sin escrituras concurrentes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=sorted(ROLLUPS), help="Solo ventas o solo compras")
+        parser.add_argument('--date-from', type=date.fromisoformat, help="Fecha inicial (AAAA-MM-DD)")
+        parser.add_argument('--date-to', type=date.fromisoformat, help="Fecha final (AAAA-MM-DD)")
+        parser.add_argument('--partition-days', type=int, default=31, help="Días por partición")
+        parser.add_argument('--workers', type=int, default=1, help="Particiones en paralelo (siempre 1 en SQLite)")
+
+    def handle(self, *args, **options):
+        if options['partition_days'] < 1 or options['workers'] < 1:
+            raise CommandError("--partition-days y --workers deben ser mayores a 0.")
+        workers = options['workers']
+        if workers > 1 and connection.vendor == 'sqlite':
+            # Un solo escritor: las particiones en paralelo fallarían con "database is locked"
+            self.stderr.write(self.style.WARNING(
+                "SQLite no admite escrituras en paralelo; se usa --workers 1."
+            ))
+            workers = 1
+
+        names = [options['only']] if options['only'] else sorted(ROLLUPS)
+        for name in names:
+            rollup, document = ROLLUPS[name]
+            bounds = document.objects.aggregate(first=Min('date'), last=Max('date'))
+            date_from = options['date_from'] or bounds['first']
+            date_to = options['date_to'] or bounds['last']
+            if date_from is None or date_to is None:
+                # Sin documentos: solo se limpian las filas del rango indicado
+                written = rollup.rebuild(options['date_from'], options['date_to'])
+                self.stdout.write(self.style.SUCCESS(f"{name}: {written} fila(s)."))
+                continue
+
+            partitions = []
+            start = date_from
+            while start <= date_to:
+                end = min(start + timedelta(days=options['partition_days'] - 1), date_to)
+                partitions.append((start, end))
+                start = end + timedelta(days=1)
+
+            if workers == 1:
+                written = sum(rollup.rebuild(start, end) for start, end in partitions)
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    written = sum(pool.map(
+                        rebuild_partition,
+                        [rollup] * len(partitions),
+                        [start for start, _ in partitions],
+                        [end for _, end in partitions],
+                    ))
+            self.stdout.write(self.style.SUCCESS(
+                f"{name}: {written} fila(s) en {len(partitions)} partición(es) "
+                f"del {date_from} al {date_to}."
+            ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from erp.models import Client, ClientBalance, Sale
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula en bloque los totales desnormalizados y el estado de pago de las "
+        "ventas, y después los resúmenes de saldo de sus clientes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Cantidad de ventas (rango de ids) recalculadas por transacción"
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Sale.objects.aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['first'] is None:
+            self.stdout.write("No hay ventas para recalcular.")
+            return
+
+        total = 0
+        start = bounds['first']
+        while start <= bounds['last']:
+            end = start + batch_size
+            total += Sale.rebuild_totals(
+                Sale.objects.filter(pk__gte=start, pk__lt=end), rebuild_balances=False
+            )
+            start = end
+
+        # Una sola vez al final: un cliente puede tener ventas en muchos lotes
+        clients = ClientBalance.rebuild(Client.objects.filter(pk__in=Sale.objects.values('client_id')))
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} venta(s) recalculada(s), {clients} saldo(s) de cliente reconstruido(s)."
+        ))
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from erp.models import ClientStatementCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Regenera los puntos de control del estado de cuenta (saldo de cada cliente al "
+        "cierre de cada mes con movimientos). Conviene programarlo al cerrar cada mes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--through', type=date.fromisoformat,
+            help="Último día con punto de control (AAAA-MM-DD; por omisión, el fin del mes anterior)"
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help="Filas por bloque de inserción")
+
+    def handle(self, *args, **options):
+        written = ClientStatementCheckpoint.rebuild(
+            through=options['through'], batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f"{written} punto(s) de control generado(s)."))
@@ -0,0 +1,257 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from erp.models import (
+    Client, Product, Purchase, PurchaseItem, Sale, SaleItem, StockMovement, Supplier
+)
+from erp.services import PurchaseService, SaleService
+
+# SQLSTATE de PostgreSQL que se reintentan: deadlock y fallo de serialización
+DEADLOCK_CODES = {'40P01', '40001'}
+
+# SQLite ignora select_for_update: con BEGIN IMMEDIATE cada transacción toma el
+# lock de escritura al empezar y las demás esperan (timeout) en lugar de fallar
+# con "database is locked" al intentar escalar el lock a mitad de la transacción
+SQLITE_WORKER_OPTIONS = {'transaction_mode': 'IMMEDIATE', 'timeout': 20}
+
+
+def configure_worker_connection():
+    """
+    Ajusta la conexión del hilo/proceso actual antes de abrirla. Solo afecta a
+    los trabajadores de esta prueba: el resto de la aplicación sigue con las
+    opciones de settings.
+    """
+    if connection.vendor == 'sqlite':
+        connection.close()
+        connection.settings_dict = {
+            **connection.settings_dict,
+            'OPTIONS': {**connection.settings_dict.get('OPTIONS', {}), **SQLITE_WORKER_OPTIONS},
+        }
+
+
+def classify_error(error):
+    """Clasifica un error de base de datos reintentable: 'deadlock', 'locked' o None"""
+    cause = error.__cause__
+    code = getattr(cause, 'pgcode', None) or getattr(cause, 'sqlstate', None)
+    if code in DEADLOCK_CODES or 'deadlock' in str(error).lower():
+        return 'deadlock'
+    if 'locked' in str(error).lower():
+        return 'locked'
+    return None
+
+
+def create_sale(path, client_id, lines):
+    """
+    Crea una venta por el camino indicado: 'service' (SaleService, un lock y un
+    UPDATE para todas las líneas) o 'item' (SaleItem.save por línea, como el formulario).
+    """
+    if path == 'service':
+        return SaleService.create_with_items(
+            Client(pk=client_id), timezone.now().date(), lines, status=Sale.Status.COMPLETED
+        )
+    with transaction.atomic():
+        sale = Sale(client_id=client_id, date=timezone.now().date(), status=Sale.Status.COMPLETED)
+        sale.save()
+        for line in lines:
+            SaleItem(sale=sale, product_id=line['product'], quantity=line['quantity'],
+                     unit_price=line['unit_price']).save()
+    return sale
+
+
+def run_worker(worker, options, client_ids, product_ids):
+    """
+    Crea options['iterations'] ventas contra los productos calientes y devuelve
+    sus métricas. Reintenta deadlocks, bloqueos y choques de unicidad (folios).
+    Se ejecuta en un hilo o en un proceso; cierra su conexión al terminar.
+    """
+    rng = random.Random(options['seed'] + worker)
+    stats = {
+        'latencies': [], 'created': 0, 'rejected': 0, 'failed': 0,
+        'deadlock': 0, 'locked': 0, 'integrity': 0, 'retries': 0, 'errors': [],
+    }
+    configure_worker_connection()
+    try:
+        for _ in range(options['iterations']):
+            lines = [
+                {'product': product_id, 'quantity': Decimal(rng.randint(1, options['max_quantity'])),
+                 'unit_price': Decimal('10.00')}
+                for product_id in rng.sample(product_ids, rng.randint(1, min(3, len(product_ids))))
+            ]
+            client_id = rng.choice(client_ids)
+            start = time.perf_counter()
+            for attempt in range(options['max_retries'] + 1):
+                try:
+                    create_sale(options['path'], client_id, lines)
+                    stats['created'] += 1
+                    break
+                except ValidationError:
+                    # Stock agotado: rechazo esperado, no es un error
+                    stats['rejected'] += 1
+                    break
+                except IntegrityError as e:
+                    kind, error = 'integrity', e
+                except OperationalError as e:
+                    kind, error = classify_error(e), e
+                    if kind is None:
+                        raise
+                stats[kind] += 1
+                if attempt == options['max_retries']:
+                    stats['failed'] += 1
+                    stats['errors'].append(f"{kind}: {error}")
+                    break
+                stats['retries'] += 1
+                time.sleep(rng.uniform(0, 0.01 * (2 ** attempt)))
+            stats['latencies'].append((time.perf_counter() - start) * 1000)
+    finally:
+        connection.close()
+    return stats
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de concurrencia: N trabajadores (hilos o procesos) crean ventas contra los "
+        "mismos productos y verifica que no haya sobreventa, stock negativo ni folios repetidos"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Trabajadores en paralelo")
+        parser.add_argument('--iterations', type=int, default=50, help="Ventas por trabajador")
+        parser.add_argument('--mode', choices=['threads', 'processes'], default='threads')
+        parser.add_argument('--path', choices=['service', 'item'], default='service',
+                            help="SaleService.create_with_items o SaleItem.save por línea")
+        parser.add_argument('--products', type=int, default=3, help="Productos calientes compartidos")
+        parser.add_argument('--clients', type=int, default=5)
+        parser.add_argument('--stock', type=int, default=500,
+                            help="Stock inicial por producto (comprado antes de la prueba)")
+        parser.add_argument('--max-quantity', type=int, default=3, help="Cantidad máxima por línea")
+        parser.add_argument('--max-retries', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if min(options['workers'], options['iterations'], options['products'], options['clients']) < 1:
+            raise CommandError("workers, iterations, products y clients deben ser mayores a 0.")
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] in ('', ':memory:'):
+            raise CommandError("Con SQLite se necesita una base en archivo (no en memoria).")
+
+        client_ids, product_ids, started_at = self.setup(options)
+        # Solo valores simples: en modo processes se envían a cada proceso
+        worker_options = {
+            key: options[key] for key in ('iterations', 'path', 'max_quantity', 'max_retries', 'seed')
+        }
+        # Cada hilo/proceso abre su propia conexión; no heredar la del proceso principal
+        connections.close_all()
+
+        executor = ThreadPoolExecutor if options['mode'] == 'threads' else ProcessPoolExecutor
+        start = time.perf_counter()
+        with executor(max_workers=options['workers']) as pool:
+            results = list(pool.map(
+                run_worker, range(options['workers']),
+                [worker_options] * options['workers'],
+                [client_ids] * options['workers'],
+                [product_ids] * options['workers'],
+            ))
+        elapsed = time.perf_counter() - start
+
+        totals = {
+            key: sum(r[key] for r in results)
+            for key in ('created', 'rejected', 'failed', 'deadlock', 'locked', 'integrity', 'retries')
+        }
+        latencies = sorted(latency for r in results for latency in r['latencies'])
+        self.stdout.write(
+            f"{connection.vendor}, {options['workers']} {options['mode']}, camino {options['path']}: "
+            f"{len(latencies)} intento(s) en {elapsed:.2f} s\n"
+            f"  creadas: {totals['created']}, rechazadas por stock: {totals['rejected']}, "
+            f"fallidas: {totals['failed']}\n"
+            f"  rendimiento: {totals['created'] / elapsed:.1f} ventas/s\n"
+            f"  latencia: p50 {percentile(latencies, 0.5):.1f} ms, "
+            f"p99 {percentile(latencies, 0.99):.1f} ms, "
+            f"máx {latencies[-1] if latencies else 0:.1f} ms\n"
+            f"  deadlocks: {totals['deadlock']}, bloqueos: {totals['locked']}, "
+            f"choques de unicidad: {totals['integrity']}, reintentos: {totals['retries']}"
+        )
+        for error in {e for r in results for e in r['errors']}:
+            self.stdout.write(self.style.WARNING(f"  {error}"))
+
+        failures = self.check_invariants(product_ids, started_at, totals['created'])
+        if failures:
+            raise CommandError("Invariantes violados:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Invariantes OK: sin stock negativo, sin sobreventa, folios únicos."))
+
+    def setup(self, options):
+        """Crea clientes y productos propios de la corrida, con stock cargado por una compra"""
+        tag = f"Stress {timezone.now():%Y%m%d%H%M%S%f}"
+        started_at = timezone.now()
+        with transaction.atomic():
+            supplier = Supplier.objects.create(name=tag)
+            clients = [Client.objects.create(name=f"{tag} C{i}") for i in range(options['clients'])]
+            products = Product.objects.bulk_create([
+                Product(name=f"{tag} P{i}", reference_price=Decimal('10.00'))
+                for i in range(options['products'])
+            ])
+            PurchaseService.create_with_items(
+                supplier, timezone.now().date(),
+                [{'product': p, 'quantity': options['stock'], 'unit_price': Decimal('5.00')}
+                 for p in products],
+                status=Purchase.Status.COMPLETED,
+            )
+        return [c.pk for c in clients], [p.pk for p in products], started_at
+
+    def check_invariants(self, product_ids, started_at, created):
+        """
+        Verifica sobre los productos de la corrida: stock >= 0, stock = compras - ventas
+        (no canceladas), stock = suma del diario de movimientos, totales de las ventas
+        iguales a la suma de sus items y folios sin repetir.
+        """
+        failures = []
+        purchased = dict(
+            PurchaseItem.objects.filter(product_id__in=product_ids)
+            .exclude(purchase__status=Purchase.Status.CANCELLED)
+            .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        sold = dict(
+            SaleItem.objects.filter(product_id__in=product_ids)
+            .exclude(sale__status=Sale.Status.CANCELLED)
+            .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        journal = dict(
+            StockMovement.objects.filter(product_id__in=product_ids)
+            .values('product_id').annotate(total=Sum('delta')).values_list('product_id', 'total')
+        )
+        for pk, name, stock in Product.objects.filter(pk__in=product_ids).values_list('pk', 'name', 'stock'):
+            expected = purchased.get(pk, 0) - sold.get(pk, 0)
+            if stock < 0:
+                failures.append(f"{name}: stock negativo ({stock})")
+            if stock != expected:
+                failures.append(f"{name}: stock {stock} != compras - ventas {expected}")
+            if stock != journal.get(pk, 0):
+                failures.append(f"{name}: stock {stock} != diario de movimientos {journal.get(pk, 0)}")
+
+        sales = Sale.objects.filter(
+            pk__in=SaleItem.objects.filter(product_id__in=product_ids).values('sale_id')
+        )
+        if sales.count() != created:
+            failures.append(f"ventas creadas {created} != ventas en la base {sales.count()}")
+        mismatched = sales.annotate(
+            items_sum=Sum(F('items__quantity') * F('items__unit_price'))
+        ).exclude(items_sum=F('items_total')).count()
+        if mismatched:
+            failures.append(f"{mismatched} venta(s) con items_total distinto a la suma de sus items")
+        duplicated = (
+            Sale.objects.filter(created_at__gte=started_at).values('folio')
+            .annotate(n=Count('id')).filter(n__gt=1).count()
+        )
+        if duplicated:
+            failures.append(f"{duplicated} folio(s) repetido(s)")
+        return failures
@@ -0,0 +1,63 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .instrumentation import QueryBudgetExceeded, record_queries
+
+logger = logging.getLogger(__name__)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Registra por petición la cantidad de consultas, el tiempo de base de datos,
+    las consultas repetidas y las más lentas. Los expone en cabeceras
+    X-DB-* y en una línea de log JSON, y compara contra ERP_QUERY_BUDGETS.
+    Una clave 'vista' limita las lecturas (GET/HEAD); ('POST', 'vista') limita
+    otro método, así un alta no se mide contra el presupuesto del listado.
+    Si se supera: warning, o QueryBudgetExceeded con ERP_QUERY_BUDGET_STRICT
+    (para las pruebas).
+
+    Las respuestas en streaming solo cuentan las consultas hechas en la vista,
+    no las que ocurren al recorrer el contenido.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'ERP_QUERY_INSTRUMENTATION', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as stats:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        summary = stats.summary()
+        response['X-DB-Query-Count'] = str(summary['queries'])
+        response['X-DB-Time-Ms'] = str(summary['db_ms'])
+        response['X-DB-Duplicate-Queries'] = str(summary['duplicates'])
+
+        record = {'method': request.method, 'path': request.path, 'view': view_name,
+                  'status': response.status_code, **summary}
+        # Se leen en cada petición para que override_settings funcione en las pruebas
+        budget = self.get_budget(request.method, view_name)
+        if budget is not None and stats.count > budget:
+            record['budget'] = budget
+            logger.warning(f"Presupuesto de consultas excedido: {json.dumps(record)}")
+            if getattr(settings, 'ERP_QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(
+                    f"{view_name}: {stats.count} consultas (presupuesto: {budget})"
+                )
+        else:
+            logger.info(json.dumps(record))
+        return response
+
+    @staticmethod
+    def get_budget(method, view_name):
+        budgets = getattr(settings, 'ERP_QUERY_BUDGETS', {})
+        budget = budgets.get((method, view_name))
+        if budget is None and method in ('GET', 'HEAD'):
+            budget = budgets.get(view_name)
+        return budget
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-16 17:28
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+
+def populate_sale_totals(apps, schema_editor):
+    Sale = apps.get_model('erp', 'Sale')
+    SaleItem = apps.get_model('erp', 'SaleItem')
+    SaleExpense = apps.get_model('erp', 'SaleExpense')
+    PaymentAllocation = apps.get_model('erp', 'PaymentAllocation')
+
+    money = DecimalField(max_digits=14, decimal_places=2)
+    zero = Value(Decimal('0.00'), output_field=money)
+
+    items = SaleItem.objects.filter(sale=OuterRef('pk')).values('sale').annotate(
+        total=Sum(Round(F('quantity') * F('unit_price'), 2))
+    ).values('total')
+    expenses = SaleExpense.objects.filter(sale=OuterRef('pk')).values('sale').annotate(
+        total=Sum('amount')
+    ).values('total')
+    paid = PaymentAllocation.objects.filter(sale=OuterRef('pk')).values('sale').annotate(
+        total=Sum('amount')
+    ).values('total')
+
+    Sale.objects.update(
+        items_total=Coalesce(Subquery(items, output_field=money), zero),
+        expenses_total=Coalesce(Subquery(expenses, output_field=money), zero),
+        paid_total=Coalesce(Subquery(paid, output_field=money), zero),
+    )
+    Sale.objects.update(balance=F('items_total') + F('expenses_total') - F('paid_total'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='expenses_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='items_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='paid_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14),
+        ),
+        migrations.RunPython(populate_sale_totals, migrations.RunPython.noop),
+    ]
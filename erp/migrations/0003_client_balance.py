@@ -0,0 +1,78 @@
+# Generated by Django 5.2.7 on 2026-10-16 17:29
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, Min, OuterRef, Subquery, Sum
+
+
+def populate_client_balances(apps, schema_editor):
+    Client = apps.get_model('erp', 'Client')
+    ClientBalance = apps.get_model('erp', 'ClientBalance')
+    Sale = apps.get_model('erp', 'Sale')
+    Payment = apps.get_model('erp', 'Payment')
+    PaymentAllocation = apps.get_model('erp', 'PaymentAllocation')
+
+    money = DecimalField(max_digits=14, decimal_places=2)
+    open_sales = Sale.objects.filter(
+        client=OuterRef('pk'), status='COMPLETED', payment_status='CREDIT'
+    ).values('client')
+    payments = Payment.objects.filter(client=OuterRef('pk')).values('client')
+    allocations = PaymentAllocation.objects.filter(
+        payment__client=OuterRef('pk')
+    ).values('payment__client')
+
+    rows = Client.objects.order_by().annotate(
+        debt=Subquery(open_sales.annotate(t=Sum('balance')).values('t'), output_field=money),
+        sales_count=Subquery(open_sales.annotate(t=Count('id')).values('t')),
+        oldest=Subquery(open_sales.filter(balance__gt=0).annotate(t=Min('due_date')).values('t')),
+        paid=Subquery(payments.annotate(t=Sum('amount')).values('t'), output_field=money),
+        allocated=Subquery(allocations.annotate(t=Sum('amount')).values('t'), output_field=money),
+    ).values_list('pk', 'debt', 'sales_count', 'oldest', 'paid', 'allocated')
+
+    ClientBalance.objects.bulk_create([
+        ClientBalance(
+            client_id=pk,
+            open_debt=debt or Decimal('0.00'),
+            credit_sales_count=sales_count or 0,
+            oldest_unpaid_due_date=oldest,
+            unallocated_credit=(paid or Decimal('0.00')) - (allocated or Decimal('0.00')),
+        )
+        for pk, debt, sales_count, oldest, paid, allocated in rows.iterator(chunk_size=1000)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0002_sale_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientBalance',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance_summary', serialize=False, to='erp.client')),
+                ('open_debt', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('credit_sales_count', models.PositiveIntegerField(default=0)),
+                ('oldest_unpaid_due_date', models.DateField(blank=True, null=True)),
+                ('unallocated_credit', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['client', 'status', 'payment_status'], name='erp_sale_client__adb052_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientbalance',
+            index=models.Index(fields=['open_debt'], name='erp_clientb_open_de_a78f11_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientbalance',
+            index=models.Index(fields=['oldest_unpaid_due_date'], name='erp_clientb_oldest__f739ef_idx'),
+        ),
+        migrations.RunPython(populate_client_balances, migrations.RunPython.noop),
+    ]
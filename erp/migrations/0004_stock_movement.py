@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-16 17:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def seed_opening_movements(apps, schema_editor):
+    # Saldo inicial como ajuste, para que el diario cuadre con Product.stock
+    Product = apps.get_model('erp', 'Product')
+    StockMovement = apps.get_model('erp', 'StockMovement')
+    StockMovement.objects.bulk_create([
+        StockMovement(product_id=pk, delta=stock, source_type='ADJUSTMENT')
+        for pk, stock in Product.objects.exclude(stock=0).values_list('pk', 'stock').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0003_client_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.DecimalField(decimal_places=3, max_digits=14)),
+                ('source_type', models.CharField(choices=[('PURCHASE', 'Compra'), ('SALE', 'Venta'), ('ADJUSTMENT', 'Ajuste')], max_length=10)),
+                ('source_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='stock_movements', to='erp.product')),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['product', 'created_at'], name='erp_stockmo_product_059245_idx'), models.Index(fields=['source_type', 'source_id'], name='erp_stockmo_source__eba009_idx')],
+            },
+        ),
+        migrations.RunPython(seed_opening_movements, migrations.RunPython.noop),
+    ]
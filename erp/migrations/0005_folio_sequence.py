@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-16 17:31
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+
+
+def seed_today_sequences(apps, schema_editor):
+    # Continuar los consecutivos de los folios ya emitidos hoy con next_folio anterior
+    FolioSequence = apps.get_model('erp', 'FolioSequence')
+    today = timezone.now().date()
+    for model_name in ('Purchase', 'Sale'):
+        model = apps.get_model('erp', model_name)
+        prefix = model_name.upper()
+        last_folio = model.objects.filter(
+            folio__startswith=f"{prefix}-{today:%Y%m%d}-"
+        ).aggregate(Max('folio'))['folio__max']
+        if last_folio:
+            FolioSequence.objects.create(
+                prefix=prefix, date=today, last_value=int(last_folio.split('-')[-1])
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0004_stock_movement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FolioSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=32)),
+                ('date', models.DateField()),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('prefix', 'date'), name='erp_folio_sequence_prefix_date')],
+            },
+        ),
+        migrations.RunPython(seed_today_sequences, migrations.RunPython.noop),
+    ]
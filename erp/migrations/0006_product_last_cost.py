@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-16 17:36
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_last_cost(apps, schema_editor):
+    Product = apps.get_model('erp', 'Product')
+    PurchaseItem = apps.get_model('erp', 'PurchaseItem')
+    items = PurchaseItem.objects.filter(
+        product=OuterRef('pk'), purchase__status='COMPLETED'
+    ).order_by('-purchase__date', '-purchase_id')
+    Product.objects.update(
+        last_cost=Coalesce(
+            Subquery(items.values('unit_price')[:1]),
+            Value(Decimal('0.00'), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        ),
+        last_cost_date=Subquery(items.values('purchase__date')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0005_folio_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='last_cost',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='last_cost_date',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_last_cost, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-16 17:39
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def populate_costs(apps, schema_editor):
+    """
+    Costos iniciales aproximados (último costo). El promedio exacto se
+    reconstruye con el comando rebuild_average_cost.
+    """
+    Product = apps.get_model('erp', 'Product')
+    SaleItem = apps.get_model('erp', 'SaleItem')
+    StockMovement = apps.get_model('erp', 'StockMovement')
+    PurchaseItem = apps.get_model('erp', 'PurchaseItem')
+
+    Product.objects.update(avg_cost=F('last_cost'))
+    SaleItem.objects.update(
+        unit_cost=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('last_cost')[:1])
+    )
+    StockMovement.objects.filter(source_type='PURCHASE', delta__gt=0).update(
+        unit_cost=Subquery(
+            PurchaseItem.objects.filter(
+                purchase_id=OuterRef('source_id'), product_id=OuterRef('product_id')
+            ).values('unit_price')[:1]
+        )
+    )
+    StockMovement.objects.filter(source_type='ADJUSTMENT', delta__gt=0).update(
+        unit_cost=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('last_cost')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0006_product_last_cost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_cost',
+            field=models.DecimalField(decimal_places=4, default=Decimal('0.0000'), editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='saleitem',
+            name='unit_cost',
+            field=models.DecimalField(decimal_places=4, default=Decimal('0.0000'), editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='unit_cost',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.RunPython(populate_costs, migrations.RunPython.noop),
+    ]
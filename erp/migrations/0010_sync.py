@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-16 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0009_name_prefix_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='sync_key',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['updated_at', 'id'], name='erp_client_updated_f948ea_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientbalance',
+            index=models.Index(fields=['updated_at', 'client'], name='erp_clientb_updated_6d469a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at', 'id'], name='erp_product_updated_33fd0a_idx'),
+        ),
+    ]
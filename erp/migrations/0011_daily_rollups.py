@@ -0,0 +1,89 @@
+# Generated by Django 5.2.7 on 2026-10-16 18:02
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Round
+
+
+def populate_rollups(apps, schema_editor):
+    """Carga inicial de los acumulados desde los items de documentos no cancelados"""
+    for rollup_name, item_name, document, party, with_cost in (
+        ('DailySalesRollup', 'SaleItem', 'sale', 'client', True),
+        ('DailyPurchaseRollup', 'PurchaseItem', 'purchase', 'supplier', False),
+    ):
+        Rollup = apps.get_model('erp', rollup_name)
+        Item = apps.get_model('erp', item_name)
+        aggregates = {
+            'total_quantity': Sum('quantity'),
+            'total_amount': Sum(Round(F('quantity') * F('unit_price'), 2)),
+            'total_documents': Count('id'),
+        }
+        if with_cost:
+            aggregates['total_cost'] = Sum(F('quantity') * F('unit_cost'))
+        rows = Item.objects.exclude(**{f'{document}__status': 'CANCELLED'}).values(
+            f'{document}__date', f'{document}__{party}_id', 'product_id'
+        ).annotate(**aggregates).order_by()
+
+        batch = []
+        for row in rows.iterator(chunk_size=2000):
+            values = {
+                'date': row[f'{document}__date'],
+                f'{party}_id': row[f'{document}__{party}_id'],
+                'product_id': row['product_id'],
+                'quantity': row['total_quantity'],
+                'amount': row['total_amount'],
+                'documents': row['total_documents'],
+            }
+            if with_cost:
+                values['cost'] = row['total_cost']
+            batch.append(Rollup(**values))
+            if len(batch) >= 2000:
+                Rollup.objects.bulk_create(batch)
+                batch = []
+        Rollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0010_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPurchaseRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=16)),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('documents', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='erp.product')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='erp.supplier')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['supplier', 'date'], name='erp_dailypu_supplie_577445_idx'), models.Index(fields=['product', 'date'], name='erp_dailypu_product_b7d41c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'supplier', 'product'), name='erp_daily_purchase_rollup_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=16)),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('documents', models.IntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=4, default=Decimal('0.0000'), max_digits=18)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='erp.client')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='erp.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['client', 'date'], name='erp_dailysa_client__7464cb_idx'), models.Index(fields=['product', 'date'], name='erp_dailysa_product_f80320_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'client', 'product'), name='erp_daily_sales_rollup_key')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-16 18:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0011_daily_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(condition=models.Q(('payment_status', 'CREDIT'), ('status', 'COMPLETED')), fields=['client', 'due_date', 'date', 'balance'], name='erp_sale_open_credit_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-16 18:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0012_sale_open_credit_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientStatementCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='erp.client')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('client', 'date'), name='erp_client_statement_checkpoint_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.7 on 2026-10-16 18:44
+
+import erp.models
+from django.db import migrations
+
+
+def fill_search_names(apps, schema_editor):
+    # Nombres existentes: la columna solo se calcula al guardar
+    for model_name in ('Client', 'Product', 'Supplier'):
+        model = apps.get_model('erp', model_name)
+        model.objects.bulk_update([
+            model(pk=pk, search_name=erp.models.search_key(name))
+            for pk, name in model.objects.values_list('pk', 'name').iterator()
+        ], ['search_name'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0013_client_statement_checkpoints'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='client',
+            name='erp_client_name_upper_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='erp_product_name_upper_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='supplier',
+            name='erp_supplier_name_upper_idx',
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='search_name',
+            field=erp.models.SearchKeyField(db_index=True, default='', editable=False, max_length=255, source_field='name'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='search_name',
+            field=erp.models.SearchKeyField(db_index=True, default='', editable=False, max_length=255, source_field='name'),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='search_name',
+            field=erp.models.SearchKeyField(db_index=True, default='', editable=False, max_length=255, source_field='name'),
+        ),
+        migrations.RunPython(fill_search_names, migrations.RunPython.noop),
+    ]
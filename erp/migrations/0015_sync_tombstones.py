@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-16 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('erp', '0014_name_search_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stream', models.CharField(max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at', 'id'], name='erp_synctom_updated_744658_idx')],
+            },
+        ),
+    ]
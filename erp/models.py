@@ -1,13 +1,21 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
 from decimal import Decimal
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models, transaction
-from django.db.models import Sum, F, Max
-from django.db.models.signals import post_save, pre_delete
+from django.db import DEFAULT_DB_ALIAS, connection, connections, models, transaction
+from django.db.models import (
+    Sum, F, Min, Count, Q, Case, When, Exists, OuterRef, Subquery, Value, DecimalField
+)
+from django.db.models.functions import Coalesce, Greatest, Round, TruncMonth
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.functional import cached_property
 import logging
+import unicodedata
 
 logger = logging.getLogger(__name__)
 
@@ -20,29 +28,142 @@ def to_decimal(value, places=2):
     return Decimal(str(value)).quantize(Decimal(quantize_str))
 
 
-def next_folio(prefix: str, model) -> str:
+def search_key(value):
+    """Forma normalizada para búsquedas: sin acentos y en mayúsculas ('Piñón' -> 'PINON')"""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).upper()
+
+
+class SearchKeyField(models.CharField):
+    """
+    Copia de source_field normalizada con search_key, calculada en Python al
+    guardar (save y bulk_create, como auto_now) para no depender de la
+    collation ni de UPPER() de cada base. Lleva índice: en PostgreSQL Django
+    agrega además uno varchar_pattern_ops para LIKE 'abc%'.
+    """
+
+    def __init__(self, source_field='name', **kwargs):
+        self.source_field = source_field
+        kwargs.setdefault('max_length', 255)
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('db_index', True)
+        kwargs.setdefault('default', '')
+        super().__init__(**kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source_field'] = self.source_field
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = search_key(getattr(model_instance, self.source_field))[:self.max_length]
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+def prefix_search(queryset, term, field='search_name'):
+    """
+    Filtra por prefijo sin distinguir mayúsculas ni acentos: LIKE 'ABC%' sobre
+    la columna normalizada (ver SearchKeyField) con el término normalizado igual.
+    """
+    term = search_key(term)
+    if not term:
+        return queryset
+    return queryset.filter(**{f'{field}__startswith': term})
+
+
+def next_folio(prefix: str) -> str:
     """
     Genera un folio secuencial: PREFIX-YYYYMMDD-00001
-    Usa Max() para obtener el último número del día y evitar duplicados.
+    El consecutivo sale de FolioSequence (un solo UPDATE ... RETURNING),
+    sin escanear los folios existentes del documento.
     """
-    date_str = timezone.now().strftime("%Y%m%d")
-    folio_prefix = f"{prefix}-{date_str}"
-    
-    # Buscar el último folio del día
-    last_folio = model.objects.filter(
-        folio__startswith=folio_prefix
-    ).aggregate(Max('folio'))['folio__max']
-    
-    if last_folio:
-        try:
-            # Extraer el número secuencial del último folio
-            seq = int(last_folio.split('-')[-1]) + 1
-        except (ValueError, IndexError):
-            seq = 1
-    else:
-        seq = 1
-    
-    return f"{folio_prefix}-{seq:05d}"
+    return reserve_folios(prefix, 1)[0]
+
+
+def reserve_folios(prefix: str, count: int) -> list:
+    """
+    Reserva un bloque de `count` folios consecutivos del día en una sola operación.
+    Pensado para importaciones masivas: asignar los folios antes de guardar.
+
+    La reserva se confirma por su cuenta en la conexión de folio_database(): si
+    la transacción del documento se revierte, sus folios quedan sin usar (hay
+    huecos en la numeración) a cambio de no bloquear el consecutivo del día
+    hasta que termine esa transacción.
+    """
+    today = timezone.now().date()
+    first, last = FolioSequence.reserve(prefix, today, count, using=folio_database())
+    folio_prefix = f"{prefix}-{today:%Y%m%d}"
+    return [f"{folio_prefix}-{seq:05d}" for seq in range(first, last + 1)]
+
+
+FOLIO_DATABASE = 'folios'
+
+
+def folio_database():
+    """
+    Alias donde se reservan los folios. FOLIO_DATABASE, si está configurado, es
+    una segunda conexión a la misma base en autocommit (ver settings): el UPSERT
+    del consecutivo se confirma solo y el lock de la fila dura un statement, no
+    toda la transacción que crea el documento. Sin él (SQLite, un solo escritor)
+    se reserva en la conexión por omisión, dentro de la transacción del llamador.
+    """
+    return FOLIO_DATABASE if FOLIO_DATABASE in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+# -------------------------------------------------------------------------
+# FOLIOS
+# -------------------------------------------------------------------------
+class FolioSequence(models.Model):
+    """Último consecutivo emitido por prefijo y día"""
+    prefix = models.CharField(max_length=32)
+    date = models.DateField()
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['prefix', 'date'], name='erp_folio_sequence_prefix_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.prefix}-{self.date:%Y%m%d}: {self.last_value}"
+
+    @classmethod
+    def reserve(cls, prefix, date, count=1, using=DEFAULT_DB_ALIAS):
+        """
+        Incrementa atómicamente el consecutivo en `count` y devuelve (primero, último).
+        Usa INSERT ... ON CONFLICT DO UPDATE ... RETURNING cuando la base lo permite.
+        Fuera de un bloque atómico de `using` la reserva se confirma de inmediato.
+        """
+        if count < 1:
+            raise ValueError("count debe ser mayor a 0.")
+
+        conn = connections[using]
+        if conn.features.can_return_columns_from_insert:
+            qn = conn.ops.quote_name
+            table = qn(cls._meta.db_table)
+            last_value = qn('last_value')
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} ({qn('prefix')}, {qn('date')}, {last_value}) "
+                    f"VALUES (%s, %s, %s) "
+                    f"ON CONFLICT ({qn('prefix')}, {qn('date')}) "
+                    f"DO UPDATE SET {last_value} = {table}.{last_value} + EXCLUDED.{last_value} "
+                    f"RETURNING {last_value}",
+                    [prefix, conn.ops.adapt_datefield_value(date), count],
+                )
+                last = cursor.fetchone()[0]
+        else:
+            with transaction.atomic(using=using):
+                sequences = cls.objects.using(using)
+                sequences.bulk_create(
+                    [cls(prefix=prefix, date=date, last_value=0)], ignore_conflicts=True
+                )
+                sequence = sequences.filter(prefix=prefix, date=date)
+                sequence.update(last_value=F('last_value') + count)
+                last = sequence.values_list('last_value', flat=True).get()
+
+        return last - count + 1, last
 
 
 # -------------------------------------------------------------------------
@@ -50,6 +171,8 @@ def next_folio(prefix: str, model) -> str:
 # -------------------------------------------------------------------------
 class Supplier(models.Model):
     name = models.CharField(max_length=255)
+    # Nombre sin acentos y en mayúsculas para prefix_search
+    search_name = SearchKeyField()
     contact_info = models.TextField(blank=True, null=True)
     active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -59,6 +182,7 @@ class Supplier(models.Model):
         ordering = ['name']
         indexes = [
             models.Index(fields=['name']),
+            models.Index(fields=['name', 'id']),
             models.Index(fields=['active']),
         ]
 
@@ -68,6 +192,8 @@ class Supplier(models.Model):
 
 class Client(models.Model):
     name = models.CharField(max_length=255)
+    # Nombre sin acentos y en mayúsculas para prefix_search
+    search_name = SearchKeyField()
     contact_info = models.TextField(blank=True, null=True)
     active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -77,22 +203,42 @@ class Client(models.Model):
         ordering = ['name']
         indexes = [
             models.Index(fields=['name']),
+            models.Index(fields=['name', 'id']),
             models.Index(fields=['active']),
+            models.Index(fields=['updated_at', 'id']),
         ]
 
     def __str__(self):
         return self.name
 
     def get_total_debt(self):
-        """Obtiene el saldo total pendiente del cliente"""
-        sales = self.sales.filter(
-            status=Sale.Status.COMPLETED,
-            payment_status=Sale.PaymentStatus.CREDIT
+        """Obtiene el saldo total pendiente del cliente (desde ClientBalance)"""
+        try:
+            summary = self.balance_summary
+        except ClientBalance.DoesNotExist:
+            summary = ClientBalance.refresh(self.pk)
+        return to_decimal(summary.open_debt)
+
+
+class ProductQuerySet(models.QuerySet):
+    @staticmethod
+    def last_purchase_items():
+        """Items de compras completadas del producto externo, del más reciente al más antiguo"""
+        return PurchaseItem.objects.filter(
+            product=OuterRef('pk'),
+            purchase__status=Purchase.Status.COMPLETED,
+        ).order_by('-purchase__date', '-purchase_id')
+
+    def with_last_cost(self):
+        """
+        Anota last_purchase_cost y last_purchase_date con subconsultas, para uso
+        ad hoc sin depender de los campos cacheados last_cost/last_cost_date.
+        """
+        items = self.last_purchase_items()
+        return self.annotate(
+            last_purchase_cost=Subquery(items.values('unit_price')[:1]),
+            last_purchase_date=Subquery(items.values('purchase__date')[:1]),
         )
-        total = Decimal('0.00')
-        for sale in sales:
-            total += sale.get_balance()
-        return total
 
 
 class Product(models.Model):
@@ -108,22 +254,36 @@ class Product(models.Model):
     ]
 
     name = models.CharField(max_length=255, unique=True)
+    # Nombre sin acentos y en mayúsculas para prefix_search
+    search_name = SearchKeyField()
     description = models.TextField(blank=True, null=True)
     stock = models.DecimalField(max_digits=14, decimal_places=3, default=Decimal('0.000'))
     unit_type = models.CharField(max_length=10, choices=UNIT_CHOICES, default=UNIT_KG)
     reference_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     min_stock = models.DecimalField(max_digits=14, decimal_places=3, default=Decimal('0.000'), 
                                      help_text="Stock mínimo para alertas")
+    # Último costo de compra completada (mantenido por Product.refresh_last_cost)
+    last_cost = models.DecimalField(
+        max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False
+    )
+    last_cost_date = models.DateField(null=True, blank=True, editable=False)
+    # Costo promedio ponderado móvil (mantenido por StockMovement.apply_lines)
+    avg_cost = models.DecimalField(
+        max_digits=14, decimal_places=4, default=Decimal('0.0000'), editable=False
+    )
     active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ['name']
         indexes = [
             models.Index(fields=['name']),
             models.Index(fields=['active']),
             models.Index(fields=['stock']),
+            models.Index(fields=['updated_at', 'id']),
         ]
 
     def __str__(self):
@@ -135,10 +295,170 @@ class Product(models.Model):
 
     def get_last_purchase_cost(self):
         """Obtiene el último costo de compra"""
-        last_item = self.purchase_items.select_related('purchase').filter(
-            purchase__status=Purchase.Status.COMPLETED
-        ).order_by('-purchase__date').first()
-        return last_item.unit_price if last_item else Decimal('0.00')
+        return self.last_cost
+
+    @classmethod
+    def refresh_last_cost(cls, product_ids):
+        """Recalcula last_cost/last_cost_date de los productos en un solo UPDATE"""
+        product_ids = set(product_ids)
+        if not product_ids:
+            return 0
+        items = ProductQuerySet.last_purchase_items()
+        return cls.objects.filter(pk__in=product_ids).update(
+            last_cost=Coalesce(
+                Subquery(items.values('unit_price')[:1]),
+                Value(Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            ),
+            last_cost_date=Subquery(items.values('purchase__date')[:1]),
+        )
+
+
+# -------------------------------------------------------------------------
+# MOVIMIENTOS DE INVENTARIO
+# -------------------------------------------------------------------------
+class StockMovement(models.Model):
+    """
+    Diario inmutable de movimientos de stock. Cada cambio de Product.stock se
+    aplica con un UPDATE condicional (stock = stock + delta) y queda registrado aquí.
+    """
+    class Source(models.TextChoices):
+        PURCHASE = 'PURCHASE', 'Compra'
+        SALE = 'SALE', 'Venta'
+        ADJUSTMENT = 'ADJUSTMENT', 'Ajuste'
+
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='stock_movements')
+    delta = models.DecimalField(max_digits=14, decimal_places=3)
+    source_type = models.CharField(max_length=10, choices=Source.choices)
+    source_id = models.PositiveBigIntegerField(null=True, blank=True)
+    # Costo unitario de las entradas con costo conocido (compras); base del promedio ponderado
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    DEFAULT_ERROR = "Stock insuficiente para {name}. Disponible: {stock}, Requerido: {required}"
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['product', 'created_at']),
+            models.Index(fields=['source_type', 'source_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.delta:+.3f} ({self.source_type} {self.source_id})"
+
+    @classmethod
+    def apply(cls, product_id, delta, source_type, source_id=None, error_message=None,
+              unit_cost=None):
+        """Aplica un único movimiento de stock (ver apply_many)"""
+        costs = {product_id: unit_cost} if unit_cost is not None else None
+        return cls.apply_many({product_id: delta}, source_type, source_id, error_message, costs)
+
+    @classmethod
+    def apply_many(cls, deltas, source_type, source_id=None, error_message=None, costs=None):
+        """Aplica {product_id: delta} de un mismo documento (ver apply_lines)"""
+        return cls.apply_lines(
+            source_type,
+            [(source_id, pk, delta) for pk, delta in deltas.items()],
+            error_message,
+            costs,
+        )
+
+    @classmethod
+    def apply_lines(cls, source_type, lines, error_message=None, costs=None):
+        """
+        Aplica líneas (source_id, product_id, delta) con un solo UPDATE condicional
+        agrupado por producto: UPDATE ... SET stock = stock + delta WHERE stock + delta >= 0.
+        Solo las salidas de stock llevan condición. Si algún producto no cumple,
+        se revierte todo y se lanza ValidationError con error_message formateado
+        ({name}, {stock}, {required}, {missing}). Registra un movimiento por línea.
+
+        costs: {product_id: unit_cost} de las entradas con costo conocido. En el
+        mismo UPDATE se recalcula el costo promedio ponderado:
+        avg = (stock * avg + delta * unit_cost) / (stock + delta).
+        """
+        costs = {pk: Decimal(c) for pk, c in (costs or {}).items()}
+        lines = [(source_id, pk, Decimal(d)) for source_id, pk, d in lines if d]
+        deltas = {}
+        for _, pk, d in lines:
+            deltas[pk] = deltas.get(pk, Decimal('0')) + d
+        deltas = {pk: d for pk, d in deltas.items() if d}
+        if not lines:
+            return []
+
+        with transaction.atomic():
+            if deltas:
+                condition = Q(pk__in=[pk for pk, d in deltas.items() if d > 0])
+                for pk, d in deltas.items():
+                    if d < 0:
+                        condition |= Q(pk=pk, stock__gte=-d)
+
+                fields = {
+                    'stock': Round(F('stock') + Case(
+                        *[When(pk=pk, then=Value(d)) for pk, d in deltas.items()],
+                        output_field=DecimalField(max_digits=14, decimal_places=3),
+                    ), 3),
+                    'updated_at': timezone.now(),
+                }
+                incoming = {pk: d for pk, d in deltas.items() if d > 0 and pk in costs}
+                if incoming:
+                    fields['avg_cost'] = cls.average_cost_expression(incoming, costs)
+                updated = Product.objects.filter(condition).update(**fields)
+                if updated != len(deltas):
+                    raise cls._insufficient_stock(deltas, error_message or cls.DEFAULT_ERROR)
+
+            movements = cls.objects.bulk_create([
+                cls(product_id=pk, delta=d, source_type=source_type, source_id=source_id,
+                    unit_cost=costs.get(pk) if d > 0 else None)
+                for source_id, pk, d in lines
+            ])
+        logger.debug(
+            f"Stock actualizado ({source_type}): "
+            + ", ".join(f"producto {pk} {d:+.3f}" for pk, d in deltas.items())
+        )
+        return movements
+
+    @staticmethod
+    def average_cost_expression(incoming, costs):
+        """
+        Expresión del nuevo costo promedio para {product_id: cantidad entrante}.
+        El stock negativo se toma como cero para no distorsionar el promedio.
+        """
+        decimal = DecimalField(max_digits=14, decimal_places=4)
+        previous = Greatest(F('stock'), Value(Decimal('0.000')))
+        # SQLite guarda los decimales enteros como INTEGER y dividiría sin decimales
+        scale = Value(1.0) if connection.vendor == 'sqlite' else Value(1)
+        return Case(
+            *[
+                When(pk=pk, then=Round(
+                    (previous * F('avg_cost') + Value(qty * costs[pk], output_field=decimal))
+                    * scale / (previous + Value(qty)),
+                    4,
+                ))
+                for pk, qty in incoming.items()
+            ],
+            default=F('avg_cost'),
+            output_field=decimal,
+        )
+
+    @staticmethod
+    def next_average_cost(stock, avg_cost, quantity, unit_cost):
+        """Misma fórmula que average_cost_expression, en memoria (ver rebuild_average_cost)"""
+        previous = max(stock, Decimal('0'))
+        return to_decimal((previous * avg_cost + quantity * unit_cost) / (previous + quantity), 4)
+
+    @staticmethod
+    def _insufficient_stock(deltas, error_message):
+        """Construye el error para el primer producto que quedaría en negativo"""
+        outgoing = {pk: d for pk, d in deltas.items() if d < 0}
+        for p in Product.objects.filter(pk__in=outgoing).order_by('pk'):
+            if p.stock + outgoing[p.pk] < 0:
+                return ValidationError(error_message.format(
+                    name=p.name,
+                    stock=p.stock,
+                    required=-outgoing[p.pk],
+                    missing=-(p.stock + outgoing[p.pk]),
+                ))
+        return ValidationError("Producto no encontrado al actualizar el stock.")
 
 
 # -------------------------------------------------------------------------
@@ -184,26 +504,72 @@ class TransactionBase(models.Model):
         self.clean()
         if not self.folio:
             prefix = self.__class__.__name__.upper()
-            self.folio = next_folio(prefix, self.__class__)
+            self.folio = next_folio(prefix)
         super().save(*args, **kwargs)
 
 
 # -------------------------------------------------------------------------
 # PURCHASE (COMPRA)
 # -------------------------------------------------------------------------
+class PurchaseQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Anota items_amount, expenses_amount y total_amount con subconsultas
+        (sin multiplicar filas como haría un JOIN a items y gastos)
+        """
+        money = DecimalField(max_digits=14, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=money)
+        items = PurchaseItem.objects.filter(purchase=OuterRef('pk')).values('purchase').annotate(
+            total=Sum(F('quantity') * F('unit_price'))
+        ).values('total')
+        expenses = PurchaseExpense.objects.filter(purchase=OuterRef('pk')).values('purchase').annotate(
+            total=Sum('amount')
+        ).values('total')
+        return self.annotate(
+            items_amount=Coalesce(Subquery(items, output_field=money), zero),
+            expenses_amount=Coalesce(Subquery(expenses, output_field=money), zero),
+        ).annotate(
+            total_amount=F('items_amount') + F('expenses_amount'),
+        )
+
+
 class Purchase(TransactionBase):
     supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='purchases')
 
+    objects = PurchaseQuerySet.as_manager()
+
     class Meta(TransactionBase.Meta):
         indexes = [
             models.Index(fields=['date', 'status']),
             models.Index(fields=['supplier', 'date']),
+            models.Index(fields=['date', 'id']),
             models.Index(fields=['status']),
         ]
 
     def __str__(self):
         return f"Compra {self.folio} - {self.supplier.name} - {self.date}"
 
+    def save(self, *args, **kwargs):
+        """
+        Actualiza el último costo de los productos si cambia el estado o la fecha,
+        y mueve el acumulado diario si cambia la fecha, el proveedor o la cancelación.
+        """
+        with transaction.atomic():
+            old = None
+            if self.pk:
+                old = Purchase.objects.filter(pk=self.pk).values('status', 'date', 'supplier_id').first()
+            rollup_changed = old and (
+                old['date'] != self.date or old['supplier_id'] != self.supplier_id
+                or (old['status'] == self.Status.CANCELLED) != (self.status == self.Status.CANCELLED)
+            )
+            if rollup_changed:
+                DailyPurchaseRollup.record_documents([self.pk], sign=-1)
+            super().save(*args, **kwargs)
+            if rollup_changed:
+                DailyPurchaseRollup.record_documents([self.pk])
+            if old and (old['status'] != self.status or old['date'] != self.date):
+                Product.refresh_last_cost(self.items.values_list('product_id', flat=True))
+
     @classmethod
     def get_with_details(cls, pk):
         """Obtiene compra con todas las relaciones precargadas"""
@@ -247,15 +613,15 @@ class Purchase(TransactionBase):
             return
         
         with transaction.atomic():
-            # Revertir stock de todos los items
-            for item in self.items.select_for_update():
-                p = Product.objects.select_for_update().get(pk=item.product.pk)
-                p.stock -= item.quantity
-                if p.stock < 0:
-                    raise ValidationError(
-                        f"Cancelar esta compra dejaría stock negativo en {p.name}"
-                    )
-                p.save()
+            # Revertir stock de todos los items en un solo UPDATE
+            StockMovement.apply_many(
+                {
+                    product_id: -quantity
+                    for product_id, quantity in self.items.values_list('product_id', 'quantity')
+                },
+                StockMovement.Source.PURCHASE, self.pk,
+                error_message="Cancelar esta compra dejaría stock negativo en {name}",
+            )
             
             self.status = self.Status.CANCELLED
             self.save()
@@ -299,32 +665,41 @@ class PurchaseItem(models.Model):
             diff = self.quantity - old_quantity
             
             super().save(*args, **kwargs)
+
+            if self.purchase.status != Purchase.Status.CANCELLED:
+                DailyPurchaseRollup.record(
+                    [DailyPurchaseRollup.item_line(self.purchase, self)],
+                    removed=[DailyPurchaseRollup.item_line(self.purchase, old)] if is_update else [],
+                )
             
             # Actualizar stock si hay cambio
             if diff != 0:
-                p = Product.objects.select_for_update().get(pk=self.product.pk)
-                p.stock = (p.stock or Decimal('0')) + diff
-                p.save()
-                logger.debug(
-                    f"Stock actualizado para {p.name}: {diff:+.3f} "
-                    f"(nuevo stock: {p.stock})"
+                StockMovement.apply(
+                    self.product_id, diff, StockMovement.Source.PURCHASE, self.purchase_id,
+                    error_message=(
+                        "Modificar este item dejaría stock negativo en {name}. "
+                        "Stock actual: {stock}"
+                    ),
+                    unit_cost=self.unit_price if diff > 0 else None,
                 )
+            
+            if self.purchase.status == Purchase.Status.COMPLETED:
+                Product.refresh_last_cost([self.product_id])
 
     def delete(self, *args, **kwargs):
         with transaction.atomic():
-            p = Product.objects.select_for_update().get(pk=self.product.pk)
-            new_stock = p.stock - self.quantity
-            
-            if new_stock < 0:
-                raise ValidationError(
-                    f"Eliminar este item dejaría stock negativo en {p.name}. "
-                    f"Stock actual: {p.stock}, Cantidad del item: {self.quantity}"
-                )
-            
-            p.stock = new_stock
-            p.save()
+            StockMovement.apply(
+                self.product_id, -self.quantity, StockMovement.Source.PURCHASE, self.purchase_id,
+                error_message=(
+                    "Eliminar este item dejaría stock negativo en {name}. "
+                    "Stock actual: {stock}, Cantidad del item: {required}"
+                ),
+            )
+            if self.purchase.status != Purchase.Status.CANCELLED:
+                DailyPurchaseRollup.record(removed=[DailyPurchaseRollup.item_line(self.purchase, self)])
             super().delete(*args, **kwargs)
-            logger.debug(f"Item eliminado, stock de {p.name} actualizado: {p.stock}")
+            if self.purchase.status == Purchase.Status.COMPLETED:
+                Product.refresh_last_cost([self.product_id])
 
 
 class PurchaseExpense(models.Model):
@@ -360,14 +735,42 @@ class Sale(TransactionBase):
         default=PaymentStatus.CREDIT
     )
     due_date = models.DateField(null=True, blank=True)
+    # Clave de idempotencia generada por la terminal (ventas sincronizadas fuera de línea)
+    sync_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
+    # Totales desnormalizados: se mantienen con expresiones F() desde
+    # SaleItem, SaleExpense y PaymentAllocation (ver apply_totals_delta)
+    items_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False
+    )
+    expenses_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False
+    )
+    paid_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False
+    )
+    balance = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False
+    )
+
+    TOTAL_FIELDS = ('items_total', 'expenses_total', 'paid_total', 'balance')
 
     class Meta(TransactionBase.Meta):
         indexes = [
             models.Index(fields=['date', 'status', 'payment_status']),
+            models.Index(fields=['date', 'id']),
             models.Index(fields=['client', 'date']),
+            models.Index(fields=['client', 'status', 'payment_status']),
             models.Index(fields=['due_date']),
             models.Index(fields=['payment_status']),
             models.Index(fields=['status']),
+            # Ventas a crédito abiertas (antigüedad de saldos, resumen del cliente):
+            # índice parcial y cubriente, la consulta no necesita leer la tabla
+            models.Index(
+                fields=['client', 'due_date', 'date', 'balance'],
+                condition=Q(status='COMPLETED', payment_status='CREDIT'),
+                name='erp_sale_open_credit_idx',
+            ),
         ]
 
     def __str__(self):
@@ -384,36 +787,137 @@ class Sale(TransactionBase):
 
     def get_total_items(self):
         """Total de items vendidos"""
-        result = self.items.aggregate(
-            total=Sum(F('quantity') * F('unit_price'))
-        )['total']
-        return to_decimal(result or 0)
+        return to_decimal(self.items_total)
 
     def get_total_expenses(self):
         """Total de gastos adicionales"""
-        result = self.expenses.aggregate(total=Sum('amount'))['total']
-        return to_decimal(result or 0)
+        return to_decimal(self.expenses_total)
 
     def get_total(self):
         """Total general de la venta"""
-        return to_decimal(self.get_total_items() + self.get_total_expenses())
+        return to_decimal(self.items_total + self.expenses_total)
 
     def get_amount_paid(self):
         """Monto total pagado en esta venta"""
-        result = self.allocations.aggregate(total=Sum('amount'))['total']
-        return to_decimal(result or 0)
+        return to_decimal(self.paid_total)
 
     def get_balance(self):
         """Saldo pendiente de pago"""
-        return to_decimal(self.get_total() - self.get_amount_paid())
+        return to_decimal(self.balance)
 
     @cached_property
     def total(self):
         return self.get_total()
 
-    @cached_property
-    def balance(self):
-        return self.get_balance()
+    @classmethod
+    def apply_totals_delta(cls, sale_id, items=0, expenses=0, paid=0):
+        """
+        Aplica un incremento a los totales desnormalizados en un solo UPDATE.
+        Usa expresiones F() para no depender de valores leídos en memoria.
+        """
+        items, expenses, paid = to_decimal(items), to_decimal(expenses), to_decimal(paid)
+        if not (items or expenses or paid):
+            return
+        # Round(): en SQLite la suma de decimales se guarda como REAL y acumularía error
+        cls.objects.filter(pk=sale_id).update(
+            items_total=Round(F('items_total') + items, 2),
+            expenses_total=Round(F('expenses_total') + expenses, 2),
+            paid_total=Round(F('paid_total') + paid, 2),
+            balance=Round(F('balance') + (items + expenses - paid), 2),
+        )
+        if items or expenses:
+            ClientStatementCheckpoint.invalidate_sales(cls.objects.filter(pk=sale_id))
+
+    @classmethod
+    def apply_payment_delta(cls, sale_id, paid):
+        """Aplica un pago (o su reverso) a una sola venta (ver apply_payment_deltas)"""
+        cls.apply_payment_deltas({sale_id: paid})
+
+    @classmethod
+    def apply_payment_deltas(cls, deltas):
+        """
+        Suma {sale_id: paid} al monto pagado y recalcula payment_status en un
+        solo UPDATE. Los abonos (paid > 0) solo se aplican si no exceden el saldo.
+        """
+        deltas = {pk: to_decimal(paid) for pk, paid in deltas.items()}
+        deltas = {pk: paid for pk, paid in deltas.items() if paid}
+        if not deltas:
+            return
+
+        condition = Q()
+        for pk, paid in deltas.items():
+            condition |= Q(pk=pk, balance__gte=paid) if paid > 0 else Q(pk=pk)
+        paid_case = Case(
+            *[When(pk=pk, then=Value(paid)) for pk, paid in deltas.items()],
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        )
+        updated = cls.objects.filter(condition).update(
+            paid_total=Round(F('paid_total') + paid_case, 2),
+            balance=Round(F('balance') - paid_case, 2),
+            payment_status=Case(
+                When(payment_status=cls.PaymentStatus.CANCELLED, then=F('payment_status')),
+                # Saldo redondeado <= abono: tolera saldos guardados con error de REAL (SQLite)
+                *[When(LessThanOrEqual(Round(F('balance'), 2), paid), pk=pk,
+                       then=Value(cls.PaymentStatus.PAID))
+                  for pk, paid in deltas.items() if paid > 0],
+                When(payment_status=cls.PaymentStatus.PAID, then=Value(cls.PaymentStatus.CREDIT)),
+                default=F('payment_status'),
+            ),
+        )
+        if updated != len(deltas):
+            raise ValidationError(
+                "El saldo de la venta cambió mientras se asignaba el pago. Intente de nuevo."
+            )
+        logger.debug(
+            "Pagos aplicados: " + ", ".join(f"venta {pk} {paid:+.2f}" for pk, paid in deltas.items())
+        )
+
+    @classmethod
+    def rebuild_totals(cls, queryset=None, rebuild_balances=True):
+        """
+        Recalcula los totales desnormalizados de forma masiva (set-based): un
+        UPDATE de los totales y otro del saldo y payment_status (PAID/CREDIT según
+        lo asignado; las ventas de contado sin asignaciones y las canceladas no
+        cambian). Con rebuild_balances reconstruye ClientBalance de los clientes
+        afectados. Devuelve el número de ventas actualizadas.
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        money = DecimalField(max_digits=14, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=money)
+
+        items = SaleItem.objects.filter(sale=OuterRef('pk')).values('sale').annotate(
+            total=Sum(Round(F('quantity') * F('unit_price'), 2))
+        ).values('total')
+        expenses = SaleExpense.objects.filter(sale=OuterRef('pk')).values('sale').annotate(
+            total=Sum('amount')
+        ).values('total')
+        paid = PaymentAllocation.objects.filter(sale=OuterRef('pk')).values('sale').annotate(
+            total=Sum('amount')
+        ).values('total')
+
+        with transaction.atomic():
+            updated = queryset.update(
+                items_total=Coalesce(Subquery(items, output_field=money), zero),
+                expenses_total=Coalesce(Subquery(expenses, output_field=money), zero),
+                paid_total=Coalesce(Subquery(paid, output_field=money), zero),
+            )
+            # En el SET se leen los valores anteriores de la fila: el estado se
+            # calcula con la expresión del saldo nuevo, no con la columna
+            balance = Round(F('items_total') + F('expenses_total') - F('paid_total'), 2)
+            queryset.update(
+                balance=balance,
+                payment_status=Case(
+                    When(LessThanOrEqual(balance, zero), paid_total__gt=0,
+                         payment_status=cls.PaymentStatus.CREDIT, then=Value(cls.PaymentStatus.PAID)),
+                    When(GreaterThan(balance, zero), paid_total__gt=0,
+                         payment_status=cls.PaymentStatus.PAID, then=Value(cls.PaymentStatus.CREDIT)),
+                    default=F('payment_status'),
+                ),
+            )
+            ClientStatementCheckpoint.invalidate_sales(queryset)
+            if rebuild_balances:
+                ClientBalance.rebuild(Client.objects.filter(pk__in=queryset.values('client_id')))
+        return updated
 
     def is_overdue(self):
         """Verifica si la venta está vencida"""
@@ -432,6 +936,11 @@ class Sale(TransactionBase):
             if is_update:
                 old = Sale.objects.select_for_update().get(pk=self.pk)
                 old_status = old.status
+
+                # Los totales solo se modifican vía apply_totals_delta;
+                # no sobrescribirlos con valores en memoria posiblemente obsoletos
+                for field in self.TOTAL_FIELDS:
+                    setattr(self, field, getattr(old, field))
                 
                 # Validar cancelación con pagos asignados
                 if (old_status != self.status and 
@@ -442,15 +951,34 @@ class Sale(TransactionBase):
                             "No se puede cancelar una venta con pagos asignados. "
                             "Elimine primero las asignaciones de pago."
                         )
+
+            # El acumulado diario se mueve si cambia la fecha, el cliente o la cancelación
+            rollup_changed = is_update and (
+                old.date != self.date or old.client_id != self.client_id
+                or (old_status == self.Status.CANCELLED) != (self.status == self.Status.CANCELLED)
+            )
+            if rollup_changed:
+                DailySalesRollup.record_documents([self.pk], sign=-1)
             
             super().save(*args, **kwargs)
+
+            if rollup_changed:
+                DailySalesRollup.record_documents([self.pk])
+
+            # El cargo del estado de cuenta se mueve si cambia la fecha, el cliente o si se completa
+            if is_update and (
+                old.date != self.date or old.client_id != self.client_id
+                or (old_status == self.Status.COMPLETED) != (self.status == self.Status.COMPLETED)
+            ):
+                ClientStatementCheckpoint.invalidate(old.client_id, min(old.date, self.date))
+                ClientStatementCheckpoint.invalidate(self.client_id, min(old.date, self.date))
             
             # Revertir stock si se cancela
             if is_update and old_status != self.status and self.status == self.Status.CANCELLED:
-                for item in self.items.select_for_update():
-                    p = Product.objects.select_for_update().get(pk=item.product.pk)
-                    p.stock += item.quantity
-                    p.save()
+                StockMovement.apply_many(
+                    dict(self.items.values_list('product_id', 'quantity')),
+                    StockMovement.Source.SALE, self.pk,
+                )
                 
                 # Actualizar estado de pago
                 self.payment_status = self.PaymentStatus.CANCELLED
@@ -459,6 +987,8 @@ class Sale(TransactionBase):
                 )
                 logger.info(f"Venta {self.folio} cancelada y stock revertido")
 
+            ClientBalance.schedule_refresh(self.client_id, old.client_id if is_update else None)
+
     def complete(self):
         """Marca la venta como completada"""
         if self.status != self.Status.COMPLETED:
@@ -472,6 +1002,10 @@ class SaleItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='sale_items')
     quantity = models.DecimalField(max_digits=14, decimal_places=3)
     unit_price = models.DecimalField(max_digits=12, decimal_places=2)
+    # Costo promedio del producto al momento de la venta (costo de venta)
+    unit_cost = models.DecimalField(
+        max_digits=14, decimal_places=4, default=Decimal('0.0000'), editable=False
+    )
 
     class Meta:
         unique_together = ('sale', 'product')
@@ -491,6 +1025,12 @@ class SaleItem(models.Model):
     def get_total(self):
         return to_decimal(self.quantity * self.unit_price)
 
+    def get_total_cost(self):
+        return to_decimal(self.quantity * self.unit_cost)
+
+    def get_margin(self):
+        return self.get_total() - self.get_total_cost()
+
     def save(self, *args, **kwargs):
         """
         Actualiza stock del producto al crear/modificar item.
@@ -499,8 +1039,7 @@ class SaleItem(models.Model):
         self.clean()
         
         with transaction.atomic():
-            # Lock del producto y venta
-            p = Product.objects.select_for_update().get(pk=self.product.pk)
+            # Lock de la venta; el stock se valida con un UPDATE condicional
             sale = Sale.objects.select_for_update().get(pk=self.sale_id) if self.sale_id else None
             
             # Validar que la venta no esté cancelada
@@ -511,45 +1050,49 @@ class SaleItem(models.Model):
             
             is_update = self.pk is not None
             old_quantity = Decimal('0.000')
+            old_total = Decimal('0.00')
             
             if is_update:
                 old = SaleItem.objects.get(pk=self.pk)
                 old_quantity = old.quantity
+                old_total = old.get_total()
+            else:
+                # Snapshot del costo promedio vigente
+                self.unit_cost = Product.objects.values_list('avg_cost', flat=True).get(
+                    pk=self.product_id
+                )
             
-            # Diferencia neta que se resta del stock
+            # Diferencia neta que se resta del stock (falla si no hay stock suficiente)
             diff = self.quantity - old_quantity
-            new_stock = p.stock - diff
-            
-            # Validar stock suficiente
-            if new_stock < 0:
-                raise ValidationError(
-                    f"Stock insuficiente para {p.name}. "
-                    f"Disponible: {p.stock}, Requerido adicional: {diff}, "
-                    f"Faltante: {abs(new_stock)}"
+            if diff != 0:
+                StockMovement.apply(
+                    self.product_id, -diff, StockMovement.Source.SALE, self.sale_id,
+                    error_message=(
+                        "Stock insuficiente para {name}. "
+                        "Disponible: {stock}, Requerido adicional: {required}, "
+                        "Faltante: {missing}"
+                    ),
                 )
             
             super().save(*args, **kwargs)
-            
-            # Actualizar stock
-            if diff != 0:
-                p.stock = new_stock
-                p.save()
-                logger.debug(
-                    f"Stock actualizado para {p.name}: {-diff:+.3f} "
-                    f"(nuevo stock: {p.stock})"
-                )
+            Sale.apply_totals_delta(self.sale_id, items=self.get_total() - old_total)
+            DailySalesRollup.record(
+                [DailySalesRollup.item_line(sale, self)],
+                removed=[DailySalesRollup.item_line(sale, old)] if is_update else [],
+            )
+            ClientBalance.schedule_refresh(sale.client_id)
 
     def delete(self, *args, **kwargs):
         """Devuelve el stock al producto al eliminar el item"""
         with transaction.atomic():
-            p = Product.objects.select_for_update().get(pk=self.product.pk)
-            p.stock += self.quantity
-            p.save()
-            super().delete(*args, **kwargs)
-            logger.debug(
-                f"Item eliminado, stock de {p.name} restaurado: +{self.quantity} "
-                f"(nuevo stock: {p.stock})"
+            StockMovement.apply(
+                self.product_id, self.quantity, StockMovement.Source.SALE, self.sale_id
             )
+            Sale.apply_totals_delta(self.sale_id, items=-self.get_total())
+            if self.sale.status != Sale.Status.CANCELLED:
+                DailySalesRollup.record(removed=[DailySalesRollup.item_line(self.sale, self)])
+            ClientBalance.schedule_refresh(self.sale.client_id)
+            super().delete(*args, **kwargs)
 
 
 class SaleExpense(models.Model):
@@ -566,12 +1109,43 @@ class SaleExpense(models.Model):
 
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            old_amount = Decimal('0.00')
+            if self.pk:
+                old_amount = SaleExpense.objects.filter(pk=self.pk).values_list(
+                    'amount', flat=True
+                ).first() or Decimal('0.00')
+            super().save(*args, **kwargs)
+            Sale.apply_totals_delta(self.sale_id, expenses=self.amount - old_amount)
+            ClientBalance.schedule_refresh(self.sale.client_id)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Sale.apply_totals_delta(self.sale_id, expenses=-self.amount)
+            ClientBalance.schedule_refresh(self.sale.client_id)
+            super().delete(*args, **kwargs)
 
 
 # -------------------------------------------------------------------------
 # PAGOS: Payment + PaymentAllocation
 # -------------------------------------------------------------------------
+class PaymentQuerySet(models.QuerySet):
+    def with_allocated(self):
+        """Anota `allocated` (total asignado) con una subconsulta"""
+        return self.annotate(allocated=Coalesce(
+            Subquery(
+                PaymentAllocation.objects.filter(payment=OuterRef('pk')).values('payment')
+                .annotate(total=Sum('amount')).values('total'),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            Value(Decimal('0.00'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        ))
+
+    def with_unallocated(self):
+        """Pagos con monto pendiente de asignar"""
+        return self.with_allocated().filter(amount__gt=F('allocated'))
+
+
 class Payment(models.Model):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='payments')
     date = models.DateField()
@@ -585,11 +1159,20 @@ class Payment(models.Model):
         blank=True
     )
 
+    objects = PaymentQuerySet.as_manager()
+
+    # Orden en que auto_allocate cubre las ventas abiertas
+    ALLOCATION_STRATEGIES = {
+        'oldest_due_first': (F('due_date').asc(nulls_last=True), 'date', 'pk'),
+        'oldest_first': ('date', 'pk'),
+    }
+
     class Meta:
         ordering = ['-date', '-id']
         indexes = [
             models.Index(fields=['client', 'date']),
             models.Index(fields=['date']),
+            models.Index(fields=['date', 'id']),
         ]
 
     def __str__(self):
@@ -603,7 +1186,17 @@ class Payment(models.Model):
 
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            old_client_id, old_date = None, self.date
+            if self.pk:
+                old_client_id, old_date = Payment.objects.filter(pk=self.pk).values_list(
+                    'client_id', 'date'
+                ).first() or (None, self.date)
+            super().save(*args, **kwargs)
+            ClientBalance.schedule_refresh(self.client_id, old_client_id)
+            ClientStatementCheckpoint.invalidate(self.client_id, min(old_date, self.date))
+            if old_client_id and old_client_id != self.client_id:
+                ClientStatementCheckpoint.invalidate(old_client_id, old_date)
 
     def total_allocated(self):
         """Total asignado a ventas"""
@@ -619,6 +1212,72 @@ class Payment(models.Model):
         """Propiedad cacheada del monto disponible"""
         return self.unallocated_amount()
 
+    def auto_allocate(self, strategy='oldest_due_first'):
+        """
+        Reparte el monto disponible entre las ventas a crédito abiertas del cliente.
+        Lee las ventas y sus saldos en una consulta, calcula el reparto en memoria,
+        inserta las asignaciones con bulk_create y actualiza las ventas en un UPDATE.
+        Devuelve las asignaciones creadas.
+        """
+        if strategy not in self.ALLOCATION_STRATEGIES:
+            raise ValueError(f"Estrategia de asignación desconocida: {strategy}")
+
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().with_allocated().values(
+                'amount', 'allocated'
+            ).get(pk=self.pk)
+            remaining = to_decimal(payment['amount'] - payment['allocated'])
+            if remaining <= 0:
+                return []
+
+            open_sales = ClientBalance.open_sales().filter(
+                client_id=self.client_id, balance__gt=0
+            ).exclude(
+                allocations__payment_id=self.pk
+            ).select_for_update().order_by(
+                *self.ALLOCATION_STRATEGIES[strategy]
+            ).values_list('pk', 'balance')
+
+            deltas = {}
+            for sale_id, balance in open_sales:
+                if remaining <= 0:
+                    break
+                amount = min(balance, remaining)
+                deltas[sale_id] = amount
+                remaining -= amount
+            if not deltas:
+                return []
+
+            allocations = PaymentAllocation.objects.bulk_create([
+                PaymentAllocation(payment_id=self.pk, sale_id=sale_id, amount=amount)
+                for sale_id, amount in deltas.items()
+            ])
+            Sale.apply_payment_deltas(deltas)
+            ClientBalance.schedule_refresh(self.client_id)
+
+        logger.info(
+            f"Pago {self.pk}: ${sum(deltas.values())} asignado automáticamente "
+            f"a {len(allocations)} venta(s)"
+        )
+        return allocations
+
+    @classmethod
+    def auto_allocate_pending(cls, strategy='oldest_due_first', queryset=None):
+        """
+        Modo lote: asigna todos los pagos con monto disponible, del más antiguo
+        al más reciente, cada uno en su propia transacción.
+        Devuelve el número de asignaciones creadas.
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        # select_related(None): el queryset del admin trae relaciones que only() difiere
+        pending = queryset.select_related(None).with_unallocated().order_by('date', 'pk').only(
+            'pk', 'client_id'
+        )
+        created = 0
+        for payment in pending.iterator(chunk_size=500):
+            created += len(payment.auto_allocate(strategy))
+        return created
+
 
 class PaymentAllocation(models.Model):
     """
@@ -640,89 +1299,634 @@ class PaymentAllocation(models.Model):
     def __str__(self):
         return f"Asignación: ${self.amount} de Pago {self.payment.id} a Venta {self.sale.folio}"
 
-    def clean(self):
-        """Validación de montos y disponibilidad"""
+    def validation_state(self, lock=False):
+        """
+        Lee en una sola consulta todo lo necesario para validar la asignación:
+        monto y total asignado del pago, monto previo de esta asignación y
+        saldo/estado/cliente de la venta. Con lock=True bloquea la fila del pago.
+        """
+        money = DecimalField(max_digits=14, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=money)
+        sale = Sale.objects.filter(pk=self.sale_id)
+
+        if self.payment_id is None:
+            # Pago aún no guardado (inline del admin): nada asignado todavía
+            payments = Sale.objects.filter(pk=self.sale_id).annotate(
+                amount=Value(self.payment.amount, output_field=money),
+                payment_client_id=Value(self.payment.client_id, output_field=models.BigIntegerField()),
+                allocated=zero,
+                previous=zero,
+            )
+        else:
+            payments = Payment.objects.filter(pk=self.payment_id).annotate(
+                payment_client_id=F('client_id'),
+                allocated=Coalesce(Subquery(
+                    PaymentAllocation.objects.filter(payment=OuterRef('pk')).values('payment')
+                    .annotate(total=Sum('amount')).values('total'),
+                    output_field=money,
+                ), zero),
+                previous=Coalesce(Subquery(
+                    PaymentAllocation.objects.filter(pk=self.pk).values('amount'),
+                    output_field=money,
+                ), zero),
+            )
+            if lock:
+                payments = payments.select_for_update()
+
+        return payments.annotate(
+            sale_balance=Subquery(sale.values('balance'), output_field=money),
+            sale_status=Subquery(sale.values('status')),
+            sale_client_id=Subquery(sale.values('client_id')),
+        ).values(
+            'amount', 'payment_client_id', 'allocated', 'previous',
+            'sale_balance', 'sale_status', 'sale_client_id',
+        ).get()
+
+    def validate_state(self, state):
+        """Valida la asignación contra el resultado de validation_state()"""
         if self.amount <= 0:
             raise ValidationError("El monto asignado debe ser mayor a 0.")
         
-        # Calcular monto disponible en el pago
-        available = self.payment.amount - self.payment.total_allocated()
+        if state['sale_balance'] is None:
+            raise ValidationError("La venta no existe.")
         
-        # Si es una actualización, recuperar el monto anterior
-        if self.pk:
-            try:
-                old = PaymentAllocation.objects.get(pk=self.pk)
-                available += old.amount
-            except PaymentAllocation.DoesNotExist:
-                pass
-        
-        # Validar que no exceda el disponible del pago
+        # Monto disponible en el pago (sumando el monto anterior si es actualización)
+        available = to_decimal(state['amount'] - state['allocated'] + state['previous'])
         if self.amount > available:
             raise ValidationError(
                 f"El monto asignado ({self.amount}) excede el disponible del pago ({available}). "
-                f"Pago total: {self.payment.amount}, "
-                f"Ya asignado: {self.payment.total_allocated()}"
+                f"Pago total: {state['amount']}, "
+                f"Ya asignado: {to_decimal(state['allocated'])}"
             )
         
-        # Validar que no exceda el saldo de la venta
-        sale_balance = self.sale.get_balance()
-        
-        # Si es actualización, sumar el monto anterior al balance
-        if self.pk:
-            try:
-                old = PaymentAllocation.objects.get(pk=self.pk)
-                sale_balance += old.amount
-            except PaymentAllocation.DoesNotExist:
-                pass
-        
+        # Saldo de la venta (sumando el monto anterior si es actualización)
+        sale_balance = to_decimal(state['sale_balance'] + state['previous'])
         if self.amount > sale_balance:
             raise ValidationError(
                 f"El monto asignado ({self.amount}) excede el saldo de la venta ({sale_balance})."
             )
         
         # Validar que la venta no esté cancelada
-        if self.sale.status == Sale.Status.CANCELLED:
+        if state['sale_status'] == Sale.Status.CANCELLED:
             raise ValidationError("No se pueden asignar pagos a ventas canceladas.")
 
+    def clean(self):
+        """Validación de montos y disponibilidad"""
+        if self.amount <= 0:
+            raise ValidationError("El monto asignado debe ser mayor a 0.")
+        self.validate_state(self.validation_state())
+
     def save(self, *args, **kwargs):
-        self.clean()
-        
         with transaction.atomic():
-            super().save(*args, **kwargs)
-            
-            # Actualizar estado de pago de la venta
-            sale_balance = self.sale.get_balance()
+            state = self.validation_state(lock=True)
+            self.validate_state(state)
             
-            if sale_balance == Decimal('0.00'):
-                # Venta completamente pagada
-                if self.sale.payment_status != Sale.PaymentStatus.PAID:
-                    Sale.objects.filter(pk=self.sale.pk).update(
-                        payment_status=Sale.PaymentStatus.PAID
-                    )
-                    logger.info(f"Venta {self.sale.folio} marcada como PAGADA")
-            else:
-                # Venta con saldo pendiente
-                if self.sale.payment_status == Sale.PaymentStatus.PAID:
-                    Sale.objects.filter(pk=self.sale.pk).update(
-                        payment_status=Sale.PaymentStatus.CREDIT
-                    )
+            super().save(*args, **kwargs)
+            Sale.apply_payment_delta(self.sale_id, self.amount - state['previous'])
+            self._refresh_client_balances(state)
 
     def delete(self, *args, **kwargs):
         with transaction.atomic():
-            sale = self.sale
+            state = self.validation_state(lock=True)
             super().delete(*args, **kwargs)
-            
-            # Actualizar estado de pago si ahora tiene saldo
-            sale_balance = sale.get_balance()
-            if sale_balance > Decimal('0.00'):
-                if sale.payment_status == Sale.PaymentStatus.PAID:
-                    Sale.objects.filter(pk=sale.pk).update(
-                        payment_status=Sale.PaymentStatus.CREDIT
-                    )
-                    logger.info(
-                        f"Venta {sale.folio} regresada a CRÉDITO "
-                        f"(saldo: {sale_balance})"
-                    )
+            Sale.apply_payment_delta(self.sale_id, -state['previous'])
+            self._refresh_client_balances(state)
+
+    @staticmethod
+    def _refresh_client_balances(state):
+        ClientBalance.schedule_refresh(state['sale_client_id'], state['payment_client_id'])
+
+# -------------------------------------------------------------------------
+# SALDOS DE CLIENTES (MODELO DE LECTURA)
+# -------------------------------------------------------------------------
+# Clientes con refresh pendiente dentro de ClientBalance.deferred()
+_pending_client_balances = ContextVar('pending_client_balances', default=None)
+
+
+class ClientBalance(models.Model):
+    """
+    Resumen de cuenta por cliente mantenido en cada escritura de ventas y pagos.
+    Evita recorrer las ventas a crédito para obtener la deuda del cliente.
+    """
+    client = models.OneToOneField(
+        Client, on_delete=models.CASCADE, primary_key=True, related_name='balance_summary'
+    )
+    open_debt = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    credit_sales_count = models.PositiveIntegerField(default=0)
+    oldest_unpaid_due_date = models.DateField(null=True, blank=True)
+    unallocated_credit = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    SUMMARY_FIELDS = (
+        'open_debt', 'credit_sales_count', 'oldest_unpaid_due_date', 'unallocated_credit'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['open_debt']),
+            models.Index(fields=['oldest_unpaid_due_date']),
+            models.Index(fields=['updated_at', 'client']),
+        ]
+
+    def __str__(self):
+        return f"Saldo {self.client_id}: ${self.open_debt}"
+
+    @staticmethod
+    def open_sales():
+        """Ventas que generan deuda: completadas y a crédito"""
+        return Sale.objects.filter(
+            status=Sale.Status.COMPLETED,
+            payment_status=Sale.PaymentStatus.CREDIT
+        )
+
+    @classmethod
+    def refresh(cls, client_id):
+        """
+        Recalcula el resumen de un cliente a partir de los totales desnormalizados
+        de sus ventas. Bloquea primero la fila del resumen: dos escrituras
+        concurrentes del mismo cliente recalculan una después de la otra y la
+        segunda ve lo que confirmó la primera.
+        """
+        with transaction.atomic():
+            summary = cls.objects.select_for_update().filter(client_id=client_id).first()
+            debt = cls.open_sales().filter(client_id=client_id).aggregate(
+                open_debt=Sum('balance'),
+                credit_sales_count=Count('id'),
+                oldest_unpaid_due_date=Min('due_date', filter=Q(balance__gt=0)),
+            )
+            paid = Payment.objects.filter(client_id=client_id).aggregate(
+                total=Sum('amount')
+            )['total'] or 0
+            allocated = PaymentAllocation.objects.filter(payment__client_id=client_id).aggregate(
+                total=Sum('amount')
+            )['total'] or 0
+
+            values = {
+                'open_debt': to_decimal(debt['open_debt'] or 0),
+                'credit_sales_count': debt['credit_sales_count'],
+                'oldest_unpaid_due_date': debt['oldest_unpaid_due_date'],
+                'unallocated_credit': to_decimal(paid - allocated),
+            }
+            if summary is None:
+                summary, _ = cls.objects.update_or_create(client_id=client_id, defaults=values)
+                return summary
+            for name, value in values.items():
+                setattr(summary, name, value)
+            summary.save(update_fields=[*cls.SUMMARY_FIELDS, 'updated_at'])
+        return summary
+
+    @classmethod
+    def lock(cls, client_ids):
+        """
+        Bloquea, en orden de cliente, los resúmenes de client_ids (lista o
+        subconsulta). Serializa las escrituras de un cliente con los procesos
+        que reconstruyen datos derivados de su historia (ver
+        ClientStatementCheckpoint.rebuild). Debe llamarse dentro de una transacción.
+        """
+        list(
+            cls.objects.select_for_update().filter(client_id__in=client_ids)
+            .order_by('client_id').values_list('client_id', flat=True)
+        )
+
+    @classmethod
+    def schedule_refresh(cls, *client_ids):
+        """
+        Refresca los resúmenes de los clientes indicados (en orden de id, para
+        tomar los locks siempre en el mismo orden). Dentro de deferred() solo los
+        anota y se recalculan una vez al cerrar el bloque.
+        """
+        client_ids = sorted({pk for pk in client_ids if pk is not None})
+        pending = _pending_client_balances.get()
+        if pending is not None:
+            pending.update(client_ids)
+            return
+        for client_id in client_ids:
+            cls.refresh(client_id)
+
+    @classmethod
+    @contextmanager
+    def deferred(cls):
+        """
+        Agrupa los refresh de una operación compuesta (venta con sus items y
+        gastos): cada cliente tocado se recalcula una sola vez al salir, en vez
+        de una vez por línea. Usarlo dentro de la transacción de la escritura;
+        si el bloque falla no se recalcula nada. Los bloques anidados se unen
+        al exterior.
+        """
+        if _pending_client_balances.get() is not None:
+            yield
+            return
+        pending = set()
+        token = _pending_client_balances.set(pending)
+        try:
+            yield
+        finally:
+            _pending_client_balances.reset(token)
+        cls.schedule_refresh(*pending)
+
+    @classmethod
+    def rebuild(cls, clients=None, batch_size=1000):
+        """
+        Reconstruye los resúmenes de forma masiva: una consulta con subconsultas
+        agregadas por cliente y upserts en bloques. Devuelve los clientes procesados.
+        """
+        clients = Client.objects.all() if clients is None else clients
+        money = DecimalField(max_digits=14, decimal_places=2)
+
+        open_sales = cls.open_sales().filter(client=OuterRef('pk')).values('client')
+        payments = Payment.objects.filter(client=OuterRef('pk')).values('client')
+        allocations = PaymentAllocation.objects.filter(
+            payment__client=OuterRef('pk')
+        ).values('payment__client')
+
+        rows = clients.order_by().annotate(
+            debt=Subquery(open_sales.annotate(t=Sum('balance')).values('t'), output_field=money),
+            sales_count=Subquery(open_sales.annotate(t=Count('id')).values('t')),
+            oldest=Subquery(
+                open_sales.filter(balance__gt=0).annotate(t=Min('due_date')).values('t')
+            ),
+            paid=Subquery(payments.annotate(t=Sum('amount')).values('t'), output_field=money),
+            allocated=Subquery(allocations.annotate(t=Sum('amount')).values('t'), output_field=money),
+        ).values_list('pk', 'debt', 'sales_count', 'oldest', 'paid', 'allocated')
+
+        processed = 0
+        batch = []
+        for pk, debt, sales_count, oldest, paid, allocated in rows.iterator(chunk_size=batch_size):
+            batch.append(cls(
+                client_id=pk,
+                open_debt=to_decimal(debt or 0),
+                credit_sales_count=sales_count or 0,
+                oldest_unpaid_due_date=oldest,
+                unallocated_credit=to_decimal((paid or 0) - (allocated or 0)),
+            ))
+            if len(batch) >= batch_size:
+                processed += cls._upsert(batch)
+                batch = []
+        if batch:
+            processed += cls._upsert(batch)
+        return processed
+
+    @classmethod
+    def _upsert(cls, rows):
+        cls.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['client'],
+            update_fields=[*cls.SUMMARY_FIELDS, 'updated_at'],
+        )
+        return len(rows)
+
+
+# -------------------------------------------------------------------------
+# ESTADO DE CUENTA (PUNTOS DE CONTROL)
+# -------------------------------------------------------------------------
+class ClientStatementCheckpoint(models.Model):
+    """
+    Saldo del estado de cuenta de un cliente al cierre de una fecha: cargos de
+    ventas completadas menos pagos recibidos hasta ese día inclusive. Permite
+    calcular el saldo inicial de un rango sin recorrer toda la historia.
+
+    Cualquier escritura que cambie un cargo o pago con fecha <= date elimina
+    el punto de control (ver invalidate); rebuild los vuelve a generar.
+    """
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['client', 'date'], name='erp_client_statement_checkpoint_key'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Saldo {self.client_id} al {self.date}: ${self.balance}"
+
+    @staticmethod
+    def charges():
+        """Ventas que cargan al estado de cuenta: completadas"""
+        return Sale.objects.filter(status=Sale.Status.COMPLETED)
+
+    @classmethod
+    def invalidate(cls, client_id, date):
+        """
+        Elimina los puntos de control del cliente desde la fecha indicada.
+        Bloquea antes el resumen del cliente (ver rebuild).
+        """
+        with transaction.atomic():
+            ClientBalance.lock([client_id])
+            cls.objects.filter(client_id=client_id, date__gte=date).delete()
+
+    @classmethod
+    def invalidate_sales(cls, sales):
+        """
+        Elimina, en un solo DELETE, los puntos de control afectados por un
+        queryset de ventas (los de sus clientes con fecha >= la de cada venta).
+        """
+        with transaction.atomic():
+            ClientBalance.lock(sales.values('client_id'))
+            cls.objects.filter(Exists(
+                sales.filter(client_id=OuterRef('client_id'), date__lte=OuterRef('date'))
+            )).delete()
+
+    @classmethod
+    def opening_balance(cls, client_id, date):
+        """
+        Saldo al inicio de date (cierre del día anterior): el último punto de
+        control previo más los cargos y pagos posteriores a él.
+        """
+        checkpoint = cls.objects.filter(client_id=client_id, date__lt=date).order_by('-date').first()
+        sales = cls.charges().filter(client_id=client_id, date__lt=date)
+        payments = Payment.objects.filter(client_id=client_id, date__lt=date)
+        if checkpoint:
+            sales = sales.filter(date__gt=checkpoint.date)
+            payments = payments.filter(date__gt=checkpoint.date)
+        charged = sales.aggregate(total=Sum(F('items_total') + F('expenses_total')))['total'] or 0
+        paid = payments.aggregate(total=Sum('amount'))['total'] or 0
+        return to_decimal((checkpoint.balance if checkpoint else 0) + charged - paid)
+
+    @classmethod
+    def rebuild(cls, clients=None, through=None, batch_size=1000):
+        """
+        Regenera un punto de control por cliente al cierre de cada mes con
+        movimientos, hasta through (por omisión, el último mes cerrado). Dos
+        consultas agrupadas por cliente y mes; el acumulado se suma en Python.
+        Devuelve los puntos de control escritos.
+        """
+        if through is None:
+            through = timezone.now().date().replace(day=1) - timedelta(days=1)
+        clients = Client.objects.all() if clients is None else clients
+
+        # Lectura y reemplazo en la misma transacción, con los resúmenes de los
+        # clientes bloqueados: una venta o pago con fecha atrasada que se confirme
+        # durante la reconstrucción espera (invalidate también toma ese lock) y
+        # borra los puntos de control nuevos, o ya está confirmado y se lee aquí
+        with transaction.atomic():
+            ClientBalance.lock(clients.values('pk'))
+            movements = {}
+            for queryset, amount, sign in (
+                (cls.charges(), F('items_total') + F('expenses_total'), 1),
+                (Payment.objects.all(), F('amount'), -1),
+            ):
+                rows = queryset.filter(client__in=clients, date__lte=through).annotate(
+                    month=TruncMonth('date')
+                ).values('client_id', 'month').annotate(total=Sum(amount)).order_by()
+                for row in rows:
+                    key = (row['client_id'], row['month'])
+                    movements[key] = movements.get(key, 0) + sign * row['total']
+
+            checkpoints = []
+            balances = {}
+            for client_id, month in sorted(movements):
+                balances[client_id] = balances.get(client_id, 0) + movements[client_id, month]
+                month_end = (month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+                checkpoints.append(cls(
+                    client_id=client_id, date=min(month_end, through),
+                    balance=to_decimal(balances[client_id]),
+                ))
+
+            cls.objects.filter(client__in=clients).delete()
+            cls.objects.bulk_create(checkpoints, batch_size=batch_size)
+        return len(checkpoints)
+
+
+# -------------------------------------------------------------------------
+# ACUMULADOS DIARIOS (MODELO DE LECTURA)
+# -------------------------------------------------------------------------
+class DailyRollup(models.Model):
+    """
+    Acumulado diario por (fecha, tercero, producto) de los documentos no
+    cancelados. Se mantiene con deltas en la misma transacción que cada cambio
+    de items, fecha, tercero o estado del documento (ver record y record_documents).
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    quantity = models.DecimalField(max_digits=16, decimal_places=3, default=Decimal('0.000'))
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0.00'))
+    documents = models.IntegerField(default=0)
+
+    # Definidos por cada subclase
+    PARTY_FIELD = None
+    DOCUMENT_FIELD = None
+    ITEM_MODEL = None
+    ITEM_VALUE_FIELDS = ('quantity', 'unit_price')
+    VALUE_FIELDS = ('quantity', 'amount', 'documents')
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def line_values(cls, quantity, unit_price, *extra):
+        """
+        Valores que aporta una línea: cantidad, importe y un documento (los items
+        son únicos por documento y producto, así cada línea es un documento distinto).
+        """
+        return [quantity, to_decimal(quantity * unit_price), 1]
+
+    @classmethod
+    def item_lines(cls, items):
+        """
+        Líneas (fecha, tercero, producto, cantidad, precio, ...) de un queryset de
+        items, solo de documentos no cancelados.
+        """
+        document = cls.DOCUMENT_FIELD
+        return items.exclude(**{f'{document}__status': TransactionBase.Status.CANCELLED}).values_list(
+            f'{document}__date', f'{document}__{cls.PARTY_FIELD}_id', 'product_id',
+            *cls.ITEM_VALUE_FIELDS,
+        )
+
+    @classmethod
+    def record(cls, lines=(), removed=()):
+        """
+        Suma las líneas agregadas y resta las eliminadas, agrupadas por clave, con
+        un solo upsert aditivo. Cada línea: (fecha, tercero_id, producto_id, cantidad,
+        precio unitario, ...). Debe llamarse dentro de la transacción del cambio.
+        """
+        deltas = {}
+        for sign, group in ((1, lines), (-1, removed)):
+            for date, party_id, product_id, *values in group:
+                row = deltas.setdefault((date, party_id, product_id), [0] * len(cls.VALUE_FIELDS))
+                for index, value in enumerate(cls.line_values(*values)):
+                    row[index] += sign * value
+        cls.apply_deltas({key: row for key, row in deltas.items() if any(row)})
+
+    @classmethod
+    def record_documents(cls, document_ids, sign=1):
+        """Suma (o resta con sign=-1) todos los items de los documentos no cancelados"""
+        lines = cls.item_lines(
+            cls.ITEM_MODEL.objects.filter(**{f'{cls.DOCUMENT_FIELD}_id__in': list(document_ids)})
+        )
+        if sign > 0:
+            cls.record(lines)
+        else:
+            cls.record(removed=lines)
+
+    @classmethod
+    def value_places(cls):
+        """{campo: decimales} de VALUE_FIELDS (None para los enteros)"""
+        return {
+            f: getattr(cls._meta.get_field(f), 'decimal_places', None) for f in cls.VALUE_FIELDS
+        }
+
+    @classmethod
+    def apply_deltas(cls, deltas, batch_size=100):
+        """
+        Aplica {(fecha, tercero_id, producto_id): [deltas]} con
+        INSERT ... ON CONFLICT DO UPDATE SET campo = campo + EXCLUDED.campo.
+        """
+        if not deltas:
+            return
+        if not connection.features.supports_update_conflicts_with_target:
+            return cls._apply_deltas_fallback(deltas)
+
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        keys = [qn(cls._meta.get_field(f).column) for f in ('date', cls.PARTY_FIELD, 'product')]
+        values = [qn(f) for f in cls.VALUE_FIELDS]
+        placeholders = f"({', '.join(['%s'] * (len(keys) + len(values)))})"
+        # ROUND() a los decimales del campo: en SQLite la suma se guarda como REAL
+        updates = ', '.join(
+            f"{qn(f)} = ROUND({table}.{qn(f)} + EXCLUDED.{qn(f)}, {places})" if places is not None
+            else f"{qn(f)} = {table}.{qn(f)} + EXCLUDED.{qn(f)}"
+            for f, places in cls.value_places().items()
+        )
+
+        rows = list(deltas.items())
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                params = []
+                for (date, party_id, product_id), row in batch:
+                    params += [connection.ops.adapt_datefield_value(date), party_id, product_id, *row]
+                cursor.execute(
+                    f"INSERT INTO {table} ({', '.join(keys + values)}) "
+                    f"VALUES {', '.join([placeholders] * len(batch))} "
+                    f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}",
+                    params,
+                )
+
+    @classmethod
+    def _apply_deltas_fallback(cls, deltas):
+        for (date, party_id, product_id), row in deltas.items():
+            key = {'date': date, f'{cls.PARTY_FIELD}_id': party_id, 'product_id': product_id}
+            changes = {
+                f: F(f) + v if places is None else Round(F(f) + v, places)
+                for (f, places), v in zip(cls.value_places().items(), row)
+            }
+            if not cls.objects.filter(**key).update(**changes):
+                cls.objects.create(**key, **dict(zip(cls.VALUE_FIELDS, row)))
+
+    @classmethod
+    def rebuild(cls, date_from=None, date_to=None, batch_size=1000):
+        """
+        Recalcula el rango de fechas (todo si no se indica) desde los items con
+        un GROUP BY y reemplaza las filas del rango. Devuelve las filas escritas.
+        """
+        document = cls.DOCUMENT_FIELD
+        items = cls.ITEM_MODEL.objects.exclude(**{f'{document}__status': TransactionBase.Status.CANCELLED})
+        rollups = cls.objects.all()
+        if date_from:
+            items = items.filter(**{f'{document}__date__gte': date_from})
+            rollups = rollups.filter(date__gte=date_from)
+        if date_to:
+            items = items.filter(**{f'{document}__date__lte': date_to})
+            rollups = rollups.filter(date__lte=date_to)
+
+        grouped = items.values(f'{document}__date', f'{document}__{cls.PARTY_FIELD}_id', 'product_id')
+        grouped = grouped.annotate(**cls.rebuild_aggregates()).order_by()
+        with transaction.atomic():
+            rollups.delete()
+            written = 0
+            batch = []
+            for row in grouped.iterator(chunk_size=batch_size):
+                batch.append(cls(
+                    date=row[f'{document}__date'],
+                    product_id=row['product_id'],
+                    **{f'{cls.PARTY_FIELD}_id': row[f'{document}__{cls.PARTY_FIELD}_id']},
+                    **{f: row[f'total_{f}'] for f in cls.VALUE_FIELDS},
+                ))
+                if len(batch) >= batch_size:
+                    written += len(cls.objects.bulk_create(batch))
+                    batch = []
+            written += len(cls.objects.bulk_create(batch))
+        return written
+
+    @classmethod
+    def rebuild_aggregates(cls):
+        return {
+            'total_quantity': Sum('quantity'),
+            'total_amount': Sum(Round(F('quantity') * F('unit_price'), 2)),
+            'total_documents': Count('id'),
+        }
+
+
+class DailySalesRollup(DailyRollup):
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='+')
+    # Costo de venta (SaleItem.unit_cost) para márgenes sin recorrer los items
+    cost = models.DecimalField(max_digits=18, decimal_places=4, default=Decimal('0.0000'))
+
+    PARTY_FIELD = 'client'
+    DOCUMENT_FIELD = 'sale'
+    ITEM_MODEL = SaleItem
+    ITEM_VALUE_FIELDS = ('quantity', 'unit_price', 'unit_cost')
+    VALUE_FIELDS = ('quantity', 'amount', 'cost', 'documents')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'client', 'product'], name='erp_daily_sales_rollup_key'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['client', 'date']),
+            models.Index(fields=['product', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} cliente {self.client_id} producto {self.product_id}: ${self.amount}"
+
+    @classmethod
+    def line_values(cls, quantity, unit_price, unit_cost):
+        return [quantity, to_decimal(quantity * unit_price), to_decimal(quantity * unit_cost, 4), 1]
+
+    @staticmethod
+    def item_line(sale, item):
+        return (sale.date, sale.client_id, item.product_id, item.quantity, item.unit_price, item.unit_cost)
+
+    @classmethod
+    def rebuild_aggregates(cls):
+        return {
+            **super().rebuild_aggregates(),
+            'total_cost': Sum(F('quantity') * F('unit_cost')),
+        }
+
+
+class DailyPurchaseRollup(DailyRollup):
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='+')
+
+    PARTY_FIELD = 'supplier'
+    DOCUMENT_FIELD = 'purchase'
+    ITEM_MODEL = PurchaseItem
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'supplier', 'product'], name='erp_daily_purchase_rollup_key'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['supplier', 'date']),
+            models.Index(fields=['product', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} proveedor {self.supplier_id} producto {self.product_id}: ${self.amount}"
+
+    @staticmethod
+    def item_line(purchase, item):
+        return (purchase.date, purchase.supplier_id, item.product_id, item.quantity, item.unit_price)
 
 
 # -------------------------------------------------------------------------
@@ -751,6 +1955,31 @@ class ProductCostHistory(models.Model):
         return f"{self.product.name} - ${self.cost} @ {self.date}"
 
 
+# -------------------------------------------------------------------------
+# SINCRONIZACIÓN: BORRADOS
+# -------------------------------------------------------------------------
+class SyncTombstone(models.Model):
+    """
+    Constancia de una fila borrada de un flujo de sincronización (ver
+    erp.sync): sin ella la terminal conservaría para siempre su copia local.
+    Se ordena por (updated_at, id) como las filas de los flujos.
+    """
+    stream = models.CharField(max_length=20)
+    object_id = models.PositiveBigIntegerField()
+    updated_at = models.DateTimeField(auto_now_add=True)
+
+    # Modelo borrado -> flujo de erp.sync.SYNC_STREAMS
+    STREAMS = {Product: 'products', Client: 'clients', ClientBalance: 'balances'}
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.stream} {self.object_id} borrado {self.updated_at}"
+
+
 # -------------------------------------------------------------------------
 # SIGNALS - Auditoría y logging
 # -------------------------------------------------------------------------
@@ -780,21 +2009,79 @@ def log_payment_allocation(sender, instance, created, **kwargs):
     action = "creada" if created else "actualizada"
     logger.info(
         f"PaymentAllocation {action}: ${instance.amount} "
-        f"de Pago {instance.payment.id} a Venta {instance.sale.folio}"
+        f"de Pago {instance.payment_id} a Venta {instance.sale_id}"
     )
 
 
+@receiver(pre_delete, sender=Payment)
+def revert_payment_allocations(sender, instance, **kwargs):
+    """
+    Revierte los totales pagados de las ventas antes de que el borrado en
+    cascada del pago elimine sus asignaciones sin pasar por delete().
+    """
+    allocations = list(instance.allocations.values('sale').annotate(total=Sum('amount')))
+    for row in allocations:
+        Sale.apply_totals_delta(row['sale'], paid=-row['total'])
+    Sale.objects.filter(
+        pk__in=[row['sale'] for row in allocations],
+        payment_status=Sale.PaymentStatus.PAID,
+        balance__gt=0,
+    ).update(payment_status=Sale.PaymentStatus.CREDIT)
+
+
+@receiver(post_save, sender=Client)
+def create_client_balance(sender, instance, created, **kwargs):
+    """Crea el resumen de saldo vacío para clientes nuevos"""
+    if created:
+        ClientBalance.objects.get_or_create(client=instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=ClientBalance)
+def record_sync_tombstone(sender, instance, **kwargs):
+    """Registra el borrado para que las terminales eliminen su copia"""
+    SyncTombstone.objects.create(stream=SyncTombstone.STREAMS[sender], object_id=instance.pk)
+
+
+@receiver(post_delete, sender=Sale)
+@receiver(post_delete, sender=Payment)
+def refresh_client_balance_on_delete(sender, instance, **kwargs):
+    """Actualiza el resumen y el estado de cuenta del cliente al eliminar ventas o pagos"""
+    origin = kwargs.get('origin')
+    if isinstance(origin, Client) or getattr(origin, 'model', None) is Client:
+        # Borrado en cascada del propio cliente: su resumen también se elimina
+        return
+    ClientBalance.schedule_refresh(instance.client_id)
+    ClientStatementCheckpoint.invalidate(instance.client_id, instance.date)
+
+
+@receiver(pre_delete, sender=Sale)
+@receiver(pre_delete, sender=Purchase)
+def remove_rollups_on_delete(sender, instance, **kwargs):
+    """
+    Resta del acumulado diario los items del documento antes de que el borrado
+    en cascada los elimine sin pasar por SaleItem.delete/PurchaseItem.delete.
+    """
+    origin = kwargs.get('origin')
+    if isinstance(origin, (Client, Supplier)) or getattr(origin, 'model', None) in (Client, Supplier):
+        # Borrado en cascada del tercero: sus filas de acumulado también se eliminan
+        return
+    rollup = DailySalesRollup if sender is Sale else DailyPurchaseRollup
+    rollup.record_documents([instance.pk], sign=-1)
+
+
 @receiver(post_save, sender=PurchaseItem)
 def create_cost_history(sender, instance, created, **kwargs):
     """Crea registro de historial de costo cuando se crea un item de compra"""
     if created and instance.purchase.status == Purchase.Status.COMPLETED:
         ProductCostHistory.objects.create(
-            product=instance.product,
+            product_id=instance.product_id,
             cost=instance.unit_price,
             date=instance.purchase.date,
             source='PURCHASE'
         )
         logger.debug(
-            f"Historial de costo creado para {instance.product.name}: "
+            f"Historial de costo creado para producto {instance.product_id}: "
             f"${instance.unit_price}"
         )
\ No newline at end of file
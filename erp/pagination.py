@@ -0,0 +1,182 @@
+import base64
+import json
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+# -------------------------------------------------------------------------
+# CURSORES
+# -------------------------------------------------------------------------
+def encode_cursor(values, direction='next'):
+    """Codifica los valores de la clave de orden en un token opaco"""
+    payload = json.dumps({'d': direction, 'v': [str(v) for v in values]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decodifica un token; devuelve (direction, values) o None si es inválido"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction, values = payload['d'], payload['v']
+    except (ValueError, TypeError, KeyError):
+        return None
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        return None
+    return direction, values
+
+
+def keyset_filter(ordering, values, reverse=False):
+    """
+    Condición "después de values" para el orden dado, p. ej. para ('-date', '-id'):
+    date < d OR (date = d AND id < i). Con reverse=True, "antes de values".
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        descending = field.startswith('-') != reverse
+        condition |= equal & Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPage:
+    """Página de resultados con los tokens para avanzar y retroceder"""
+
+    def __init__(self, object_list, next_cursor, previous_cursor, querystring):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.querystring = querystring
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _url(self, cursor):
+        query = self.querystring.copy()
+        query['cursor'] = cursor
+        return f"?{query.urlencode()}"
+
+    def next_url(self):
+        return self._url(self.next_cursor) if self.has_next() else None
+
+    def previous_url(self):
+        return self._url(self.previous_cursor) if self.has_previous() else None
+
+
+# -------------------------------------------------------------------------
+# MIXINS
+# -------------------------------------------------------------------------
+class ListFilterMixin:
+    """
+    Filtros opcionales de la query string para vistas de listado (HTML o API):
+    filter_fields habilita ?date_from, ?date_to, ?status y ?client.
+    """
+    filter_fields = ()
+
+    def get_filters(self):
+        """Lee los filtros válidos de la query string (los inválidos se ignoran)"""
+        params = self.request.GET
+        filters = {}
+        if 'date' in self.filter_fields:
+            for param, lookup in (('date_from', 'date__gte'), ('date_to', 'date__lte')):
+                try:
+                    filters[lookup] = date.fromisoformat(params[param])
+                except (KeyError, ValueError):
+                    pass
+        if 'status' in self.filter_fields and params.get('status'):
+            filters['status'] = params['status']
+        if 'client' in self.filter_fields and params.get('client', '').isdigit():
+            filters['client_id'] = int(params['client'])
+        return filters
+
+    def get_queryset(self):
+        return super().get_queryset().filter(**self.get_filters())
+
+
+class KeysetPaginationMixin(ListFilterMixin):
+    """
+    Paginación por clave (keyset) para ListView: en lugar de OFFSET filtra por
+    los valores de la última fila mostrada (WHERE (date, id) < (...)), así cada
+    página cuesta lo mismo sin importar cuán profunda sea.
+
+    keyset_ordering debe terminar en una columna única (id).
+    """
+    paginate_by = 50
+    keyset_ordering = ('-date', '-id')
+    cursor_kwarg = 'cursor'
+
+    def get_ordering(self):
+        return self.keyset_ordering
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['filter_fields'] = self.filter_fields
+        context['filters'] = self.request.GET
+        if 'status' in self.filter_fields:
+            context['status_choices'] = self.model.Status.choices
+        return context
+
+    def get_cursor_values(self, cursor_values):
+        """Convierte los valores del token a los tipos de cada campo"""
+        return [
+            self.model._meta.get_field(field.lstrip('-')).to_python(value)
+            for field, value in zip(self.keyset_ordering, cursor_values)
+        ]
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = self.keyset_ordering
+        cursor = decode_cursor(self.request.GET.get(self.cursor_kwarg, ''))
+        direction, values = cursor or ('next', None)
+        if values is not None:
+            try:
+                values = self.get_cursor_values(values)
+            except ValidationError:
+                direction, values = 'next', None
+
+        backwards = direction == 'prev'
+        if values is not None:
+            queryset = queryset.filter(keyset_filter(ordering, values, reverse=backwards))
+        if backwards:
+            queryset = queryset.order_by(*[
+                field.lstrip('-') if field.startswith('-') else f'-{field}' for field in ordering
+            ])
+        else:
+            queryset = queryset.order_by(*ordering)
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backwards:
+            rows.reverse()
+
+        def key(obj):
+            return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+        # Hay página siguiente si avanzamos y sobró una fila, o si retrocedimos
+        has_next = has_more if not backwards else values is not None
+        has_previous = values is not None if not backwards else has_more
+        querystring = self.request.GET.copy()
+        querystring.pop(self.cursor_kwarg, None)
+        page = KeysetPage(
+            rows,
+            encode_cursor(key(rows[-1])) if rows and has_next else None,
+            encode_cursor(key(rows[0]), 'prev') if rows and has_previous else None,
+            querystring,
+        )
+        return None, page, rows, page.has_other_pages()
@@ -0,0 +1,294 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import DecimalField, ExpressionWrapper, F, Min, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    ClientBalance, ClientStatementCheckpoint, DailyPurchaseRollup, DailySalesRollup, Payment,
+    Sale, SaleItem, to_decimal
+)
+from .pagination import decode_cursor, encode_cursor
+
+
+# -------------------------------------------------------------------------
+# MÁRGENES
+# -------------------------------------------------------------------------
+MONEY = DecimalField(max_digits=18, decimal_places=4)
+
+
+def completed_sale_items(date_from=None, date_to=None):
+    """Items de ventas completadas, opcionalmente filtrados por fecha de venta"""
+    items = SaleItem.objects.filter(sale__status=Sale.Status.COMPLETED)
+    if date_from:
+        items = items.filter(sale__date__gte=date_from)
+    if date_to:
+        items = items.filter(sale__date__lte=date_to)
+    return items
+
+
+def _margin(items, *group_by):
+    """
+    Agrupa los items con un solo GROUP BY: cantidad total, venta, costo (según el
+    unit_cost guardado en cada item) y margen bruto, de mayor a menor margen.
+    """
+    return items.values(*group_by).annotate(
+        total_quantity=Sum('quantity'),
+        revenue=Sum(ExpressionWrapper(F('quantity') * F('unit_price'), output_field=MONEY)),
+        cost=Sum(ExpressionWrapper(F('quantity') * F('unit_cost'), output_field=MONEY)),
+    ).annotate(
+        margin=ExpressionWrapper(F('revenue') - F('cost'), output_field=MONEY),
+    ).order_by('-margin')
+
+
+def margin_by_product(date_from=None, date_to=None):
+    """Margen bruto por producto"""
+    return _margin(completed_sale_items(date_from, date_to), 'product_id', 'product__name')
+
+
+def margin_by_client(date_from=None, date_to=None):
+    """Margen bruto por cliente"""
+    return _margin(completed_sale_items(date_from, date_to), 'sale__client_id', 'sale__client__name')
+
+
+# -------------------------------------------------------------------------
+# ACUMULADOS DIARIOS (sin recorrer los items)
+# -------------------------------------------------------------------------
+ROLLUP_PARTIES = {DailySalesRollup: 'client', DailyPurchaseRollup: 'supplier'}
+
+
+def _rollup_rows(rollup, date_from=None, date_to=None):
+    rows = rollup.objects.all()
+    if date_from:
+        rows = rows.filter(date__gte=date_from)
+    if date_to:
+        rows = rows.filter(date__lte=date_to)
+    return rows
+
+
+def _rollup_totals(rows, *group_by):
+    totals = {name: Sum(name) for name in rows.model.VALUE_FIELDS}
+    return rows.values(*group_by).annotate(**{f'total_{k}': v for k, v in totals.items()})
+
+
+def sales_by_day(date_from=None, date_to=None):
+    """Ventas por día (documentos no cancelados)"""
+    return _rollup_totals(_rollup_rows(DailySalesRollup, date_from, date_to), 'date').order_by('date')
+
+
+def sales_by_client(date_from=None, date_to=None):
+    """Ventas por cliente, de mayor a menor importe"""
+    return _rollup_totals(
+        _rollup_rows(DailySalesRollup, date_from, date_to), 'client_id', 'client__name'
+    ).order_by('-total_amount')
+
+
+def sales_by_product(date_from=None, date_to=None):
+    """Ventas por producto, de mayor a menor importe"""
+    return _rollup_totals(
+        _rollup_rows(DailySalesRollup, date_from, date_to), 'product_id', 'product__name'
+    ).order_by('-total_amount')
+
+
+def purchases_by_supplier(date_from=None, date_to=None):
+    """Compras por proveedor, de mayor a menor importe"""
+    return _rollup_totals(
+        _rollup_rows(DailyPurchaseRollup, date_from, date_to), 'supplier_id', 'supplier__name'
+    ).order_by('-total_amount')
+
+
+def year_over_year(year, by='product', rollup=DailySalesRollup):
+    """
+    Importe y cantidad del año contra el anterior, agrupados por producto o por
+    tercero (by='party'), con una sola consulta de agregación condicional.
+    """
+    field = ROLLUP_PARTIES[rollup] if by == 'party' else 'product'
+    current = Q(date__gte=date(year, 1, 1))
+    rows = _rollup_rows(rollup, date(year - 1, 1, 1), date(year, 12, 31))
+    return rows.values(f'{field}_id', f'{field}__name').annotate(
+        total_amount=Sum('amount', filter=current),
+        previous_amount=Sum('amount', filter=~current),
+        total_quantity=Sum('quantity', filter=current),
+        previous_quantity=Sum('quantity', filter=~current),
+    ).order_by(F('total_amount').desc(nulls_last=True))
+
+
+# -------------------------------------------------------------------------
+# ANTIGÜEDAD DE SALDOS (CUENTAS POR COBRAR)
+# -------------------------------------------------------------------------
+# (campo, encabezado, días vencidos desde, hasta); "0-30" incluye lo no vencido
+AGING_BUCKETS = [
+    ('days_0_30', '0-30', None, 30),
+    ('days_31_60', '31-60', 31, 60),
+    ('days_61_90', '61-90', 61, 90),
+    ('days_90_plus', '90+', 91, None),
+]
+AGING_HEADERS = (
+    ['Cliente ID', 'Cliente'] + [label for _, label, _, _ in AGING_BUCKETS]
+    + ['Total', 'Vencimiento más antiguo']
+)
+
+
+def receivables_aging(as_of=None, client_id=None):
+    """
+    Saldo pendiente por cliente repartido por días de vencimiento a la fecha
+    as_of (hoy por omisión), en una sola consulta con agregación condicional
+    sobre las ventas a crédito abiertas. El saldo de cada venta ya descuenta
+    sus asignaciones de pago (Sale.balance); sin due_date vence el día de la venta.
+    """
+    as_of = as_of or timezone.now().date()
+    sales = ClientBalance.open_sales().filter(balance__gt=0)
+    if client_id:
+        sales = sales.filter(client_id=client_id)
+
+    due = Coalesce('due_date', 'date')
+    buckets = {}
+    for field, _, days_from, days_to in AGING_BUCKETS:
+        # Días vencidos entre days_from y days_to: due entre as_of - days_to y as_of - days_from
+        condition = Q()
+        if days_to is not None:
+            condition &= Q(aging_due__gte=as_of - timedelta(days=days_to))
+        if days_from is not None:
+            condition &= Q(aging_due__lte=as_of - timedelta(days=days_from))
+        buckets[field] = Sum('balance', filter=condition, default=0)
+
+    return sales.annotate(aging_due=due).values('client_id', 'client__name').annotate(
+        **buckets,
+        total=Sum('balance'),
+        oldest_due=Min('aging_due'),
+    ).order_by('-total', 'client_id')
+
+
+def aging_report(as_of=None, client_id=None):
+    """Filas del reporte con importes normalizados a 2 decimales y los totales"""
+    fields = [field for field, _, _, _ in AGING_BUCKETS] + ['total']
+    rows = [
+        {**row, **{field: to_decimal(row[field]) for field in fields}}
+        for row in receivables_aging(as_of, client_id)
+    ]
+    # Los totales se suman en Python, sin otra consulta
+    totals = {field: sum((row[field] for row in rows), Decimal('0.00')) for field in fields}
+    return rows, totals
+
+
+def aging_rows(as_of=None):
+    """Encabezado, filas y totales del reporte de antigüedad (para CSV)"""
+    rows, totals = aging_report(as_of)
+    yield AGING_HEADERS
+    for row in rows:
+        yield [
+            row['client_id'], row['client__name'],
+            *[row[field] for field, _, _, _ in AGING_BUCKETS],
+            row['total'], row['oldest_due'],
+        ]
+    yield ['', 'Total', *[totals[field] for field, _, _, _ in AGING_BUCKETS], totals['total'], '']
+
+
+# -------------------------------------------------------------------------
+# ESTADO DE CUENTA DEL CLIENTE
+# -------------------------------------------------------------------------
+# Tipos de movimiento; en el mismo día los cargos van antes que los pagos
+STATEMENT_KINDS = {0: 'sale', 1: 'payment'}
+STATEMENT_HEADERS = ['Fecha', 'Tipo', 'ID', 'Referencia', 'Cargo', 'Abono', 'Saldo']
+
+
+def encode_statement_cursor(after):
+    """Token de (fecha, tipo, id, saldo) de la última fila mostrada"""
+    return encode_cursor(after)
+
+
+def decode_statement_cursor(token):
+    """(fecha, tipo, id, saldo) de un token; ValidationError si es inválido"""
+    cursor = decode_cursor(token)
+    try:
+        day, kind, pk, balance = cursor[1]
+        return date.fromisoformat(day), int(kind), int(pk), to_decimal(balance)
+    except (TypeError, ValueError, ArithmeticError):
+        raise ValidationError("Cursor inválido.")
+
+
+def client_statement(client_id, date_from, date_to, after=None, limit=100):
+    """
+    Una página del estado de cuenta: ventas completadas (cargos) y pagos
+    (abonos) en orden cronológico con el saldo acumulado, calculado por la base
+    de datos con SUM() OVER sobre un UNION ALL de ambas tablas.
+
+    after es (fecha, tipo, id, saldo) de la última fila de la página anterior:
+    la página siguiente parte de ese saldo y solo lee las filas posteriores
+    (keyset), así ninguna página recorre las anteriores. La primera página
+    parte del saldo inicial (ver ClientStatementCheckpoint.opening_balance).
+
+    Devuelve (saldo anterior a la página, filas, after de la página siguiente o None).
+    """
+    if after:
+        start, kind, pk, balance = after
+    else:
+        start, balance = date_from, ClientStatementCheckpoint.opening_balance(client_id, date_from)
+
+    qn = connection.ops.quote_name
+    day, ident, kind_col = qn('date'), qn('id'), qn('kind')
+    charge, credit = qn('charge'), qn('credit')
+    sql = (
+        f"SELECT {day}, {kind_col}, {ident}, {qn('reference')}, {charge}, {credit}, "
+        f"SUM({charge} - {credit}) OVER (ORDER BY {day}, {kind_col}, {ident} ROWS UNBOUNDED PRECEDING) "
+        f"FROM ("
+        f"SELECT {day}, 0 AS {kind_col}, {ident}, {qn('folio')} AS {qn('reference')}, "
+        f"{qn('items_total')} + {qn('expenses_total')} AS {charge}, 0 AS {credit} "
+        f"FROM {qn(Sale._meta.db_table)} "
+        f"WHERE {qn('client_id')} = %s AND {qn('status')} = %s AND {day} >= %s AND {day} <= %s "
+        f"UNION ALL "
+        f"SELECT {day}, 1, {ident}, NULL, 0, {qn('amount')} "
+        f"FROM {qn(Payment._meta.db_table)} "
+        f"WHERE {qn('client_id')} = %s AND {day} >= %s AND {day} <= %s"
+        f") entries "
+    )
+    adapt = connection.ops.adapt_datefield_value
+    params = [
+        client_id, Sale.Status.COMPLETED, adapt(start), adapt(date_to),
+        client_id, adapt(start), adapt(date_to),
+    ]
+    if after:
+        sql += (
+            f"WHERE {day} > %s OR ({day} = %s AND "
+            f"({kind_col} > %s OR ({kind_col} = %s AND {ident} > %s))) "
+        )
+        params += [adapt(start), adapt(start), kind, kind, pk]
+    sql += f"ORDER BY {day}, {kind_col}, {ident} LIMIT %s"
+    params.append(limit + 1)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        fetched = cursor.fetchall()
+
+    rows, last = [], None
+    for day_value, kind_value, pk_value, reference, charge_value, credit_value, movement in fetched[:limit]:
+        if isinstance(day_value, str):
+            day_value = date.fromisoformat(day_value)
+        rows.append({
+            'date': day_value,
+            'kind': STATEMENT_KINDS[kind_value],
+            'id': pk_value,
+            'reference': reference or f"Pago {pk_value}",
+            'charge': to_decimal(charge_value),
+            'credit': to_decimal(credit_value),
+            'balance': to_decimal(balance + Decimal(str(movement))),
+        })
+        last = (day_value, kind_value, pk_value, rows[-1]['balance'])
+    return balance, rows, last if len(fetched) > limit else None
+
+
+def statement_rows(client_id, date_from, date_to, page_size=2000):
+    """Encabezado y todas las filas del estado de cuenta, página por página (para CSV)"""
+    yield STATEMENT_HEADERS
+    balance, rows, after = client_statement(client_id, date_from, date_to, limit=page_size)
+    yield [date_from, 'Saldo inicial', '', '', '', '', balance]
+    while True:
+        for row in rows:
+            yield [row['date'], row['kind'], row['id'], row['reference'],
+                   row['charge'], row['credit'], row['balance']]
+        if after is None:
+            return
+        _, rows, after = client_statement(client_id, date_from, date_to, after=after, limit=page_size)
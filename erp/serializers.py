@@ -1,37 +1,223 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
-from .models import Client, MerchandiseEntry, Purchase, Sale, Expense, AccountReceivable, Payment
+from .models import (
+    Supplier, Product, Client, Purchase, PurchaseItem, PurchaseExpense,
+    Sale, SaleItem, SaleExpense, Payment, PaymentAllocation, TransactionBase
+)
+from .services import PurchaseService, SaleService
+
+MONEY = {'max_digits': 14, 'decimal_places': 2, 'read_only': True}
+
+
+class SparseFieldsSerializer(serializers.ModelSerializer):
+    """ModelSerializer que acepta fields={...} para devolver solo esos campos (?fields=)"""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+# -------------------------------------------------------------------------
+# CATÁLOGOS
+# -------------------------------------------------------------------------
+class SupplierSerializer(SparseFieldsSerializer):
+    class Meta:
+        model = Supplier
+        fields = ['id', 'name', 'contact_info', 'active', 'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+
+class ProductSerializer(SparseFieldsSerializer):
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'name', 'description', 'unit_type', 'reference_price', 'stock', 'min_stock',
+            'last_cost', 'avg_cost', 'active', 'created_at', 'updated_at'
+        ]
+        # El stock solo cambia con movimientos (compras, ventas, ajustes)
+        read_only_fields = ['stock', 'last_cost', 'avg_cost', 'created_at', 'updated_at']
+
+class ClientSerializer(SparseFieldsSerializer):
+    open_debt = serializers.DecimalField(source='balance_summary.open_debt', **MONEY)
 
-class ClientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Client
-        fields = '__all__'
+        fields = ['id', 'name', 'contact_info', 'active', 'open_debt', 'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+
+
+# -------------------------------------------------------------------------
+# COMPRAS
+# -------------------------------------------------------------------------
+class PurchaseItemSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
 
-class MerchandiseEntrySerializer(serializers.ModelSerializer):
     class Meta:
-        model = MerchandiseEntry
-        fields = '__all__'
+        model = PurchaseItem
+        fields = ['id', 'product', 'product_name', 'quantity', 'unit_price']
+
+class PurchaseExpenseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PurchaseExpense
+        fields = ['id', 'description', 'amount']
+
+class PurchaseSerializer(SparseFieldsSerializer):
+    """Lectura: totales anotados con PurchaseQuerySet.with_totals()"""
+    supplier_name = serializers.CharField(source='supplier.name', read_only=True)
+    items_amount = serializers.DecimalField(**MONEY)
+    expenses_amount = serializers.DecimalField(**MONEY)
+    total_amount = serializers.DecimalField(**MONEY)
+    items = PurchaseItemSerializer(many=True, read_only=True)
+    expenses = PurchaseExpenseSerializer(many=True, read_only=True)
 
-class PurchaseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Purchase
-        fields = '__all__'
+        fields = [
+            'id', 'folio', 'supplier', 'supplier_name', 'date', 'status', 'notes',
+            'items_amount', 'expenses_amount', 'total_amount', 'items', 'expenses',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
+# -------------------------------------------------------------------------
+# VENTAS
+# -------------------------------------------------------------------------
+class SaleItemSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = SaleItem
+        fields = ['id', 'product', 'product_name', 'quantity', 'unit_price']
+
+class SaleExpenseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SaleExpense
+        fields = ['id', 'description', 'amount']
+
+class SaleSerializer(SparseFieldsSerializer):
+    """Lectura: los totales salen de las columnas desnormalizadas de Sale"""
+    client_name = serializers.CharField(source='client.name', read_only=True)
+    total = serializers.DecimalField(source='get_total', **MONEY)
+    items = SaleItemSerializer(many=True, read_only=True)
+    expenses = SaleExpenseSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Sale
+        fields = [
+            'id', 'folio', 'client', 'client_name', 'date', 'due_date', 'status',
+            'payment_status', 'notes', 'items_total', 'expenses_total', 'total',
+            'paid_total', 'balance', 'items', 'expenses', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
+# -------------------------------------------------------------------------
+# ALTA DE DOCUMENTOS (a través de los servicios)
+# -------------------------------------------------------------------------
+class LineSerializer(serializers.Serializer):
+    # Solo el id: el servicio valida todos los productos con una sola consulta
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.DecimalField(max_digits=14, decimal_places=3)
+    unit_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+class ExpenseLineSerializer(serializers.Serializer):
+    description = serializers.CharField(max_length=255)
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0)
+
+class DocumentCreateSerializer(serializers.ModelSerializer):
+    """
+    Crea el documento con sus items y gastos en una transacción con el servicio
+    correspondiente (un solo lock y un UPDATE de stock para todas las líneas,
+    un bulk_create para los gastos).
+    """
+    items = LineSerializer(many=True, allow_empty=False)
+    expenses = ExpenseLineSerializer(many=True, required=False)
+    status = serializers.ChoiceField(
+        choices=[TransactionBase.Status.PENDING, TransactionBase.Status.COMPLETED], required=False
+    )
+
+    party_field = None
+    service = None
+
+    def create(self, validated_data):
+        items = validated_data.pop('items')
+        party = validated_data.pop(self.party_field)
+        date = validated_data.pop('date')
+        try:
+            return self.service.create_with_items(party, date, items, **validated_data)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError({'non_field_errors': e.messages})
+
+class SaleCreateSerializer(DocumentCreateSerializer):
+    # Un alta no puede llegar cancelada; PAID o CREDIT, como en la sincronización
+    payment_status = serializers.ChoiceField(
+        choices=[Sale.PaymentStatus.PAID, Sale.PaymentStatus.CREDIT], required=False
+    )
+
+    party_field = 'client'
+    service = SaleService
 
-class SaleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Sale
-        fields = '__all__'
+        fields = ['client', 'date', 'due_date', 'status', 'payment_status', 'notes', 'items', 'expenses']
+
+class PurchaseCreateSerializer(DocumentCreateSerializer):
+    party_field = 'supplier'
+    service = PurchaseService
 
-class ExpenseSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Expense
-        fields = '__all__'
+        model = Purchase
+        fields = ['supplier', 'date', 'status', 'notes', 'items', 'expenses']
+
 
-class AccountReceivableSerializer(serializers.ModelSerializer):
+# -------------------------------------------------------------------------
+# PAGOS
+# -------------------------------------------------------------------------
+class PaymentAllocationSerializer(serializers.ModelSerializer):
     class Meta:
-        model = AccountReceivable
-        fields = '__all__'
+        model = PaymentAllocation
+        fields = ['id', 'sale', 'amount']
+
+class PaymentSerializer(SparseFieldsSerializer):
+    client_name = serializers.CharField(source='client.name', read_only=True)
+    allocated = serializers.SerializerMethodField()
+    allocations = PaymentAllocationSerializer(many=True, read_only=True)
 
-class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
-        fields = '__all__'
+        fields = [
+            'id', 'client', 'client_name', 'date', 'amount', 'notes',
+            'allocated', 'allocations', 'created_at'
+        ]
+        read_only_fields = ['created_at']
+
+    def get_allocated(self, obj):
+        # Anotado por PaymentQuerySet.with_allocated() en la vista
+        allocated = getattr(obj, 'allocated', None)
+        if allocated is None:
+            allocated = obj.total_allocated()
+        return serializers.DecimalField(max_digits=14, decimal_places=2).to_representation(allocated)
+
+
+# -------------------------------------------------------------------------
+# SINCRONIZACIÓN (TERMINALES FUERA DE LÍNEA)
+# -------------------------------------------------------------------------
+class OfflineSaleSerializer(serializers.Serializer):
+    # Clave generada por la terminal; un reintento con la misma clave no duplica la venta
+    key = serializers.UUIDField()
+    client = serializers.IntegerField(min_value=1)
+    date = serializers.DateField()
+    due_date = serializers.DateField(required=False, allow_null=True)
+    status = serializers.ChoiceField(
+        choices=[Sale.Status.PENDING, Sale.Status.COMPLETED], required=False
+    )
+    payment_status = serializers.ChoiceField(
+        choices=[Sale.PaymentStatus.PAID, Sale.PaymentStatus.CREDIT], required=False
+    )
+    notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    items = LineSerializer(many=True, allow_empty=False)
+
+class SyncUploadSerializer(serializers.Serializer):
+    sales = OfflineSaleSerializer(many=True, allow_empty=False, max_length=500)
@@ -0,0 +1,541 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+import logging
+
+from .models import (
+    Client, Product, ProductCostHistory, Purchase, PurchaseExpense, PurchaseItem,
+    Sale, SaleExpense, SaleItem, StockMovement, ClientBalance, ClientStatementCheckpoint,
+    DailyPurchaseRollup, DailySalesRollup, reserve_folios, to_decimal
+)
+
+logger = logging.getLogger(__name__)
+
+
+# -------------------------------------------------------------------------
+# UTILS
+# -------------------------------------------------------------------------
+def item_line(item):
+    """Convierte un item (sin guardar) en una línea para los servicios"""
+    return {
+        'product': item.product_id,
+        'quantity': item.quantity,
+        'unit_price': item.unit_price,
+    }
+
+
+def normalize_lines(lines, item_model):
+    """
+    Normaliza las líneas a (product_id, quantity, unit_price) y las valida
+    con item_model.clean(). No admite productos repetidos.
+    """
+    normalized = []
+    seen = set()
+    for line in lines:
+        product = line['product']
+        product_id = getattr(product, 'pk', product)
+        item = item_model(
+            product_id=product_id,
+            quantity=Decimal(line['quantity']),
+            unit_price=Decimal(line['unit_price']),
+        )
+        item.clean()
+        if product_id in seen:
+            raise ValidationError(f"El producto {product_id} está repetido en el documento.")
+        seen.add(product_id)
+        normalized.append((product_id, item.quantity, item.unit_price))
+    return normalized
+
+
+def locked_product_ids(product_ids):
+    """Bloquea los productos en una sola consulta, siempre ordenados por pk"""
+    return list(
+        Product.objects.select_for_update().filter(pk__in=product_ids)
+        .order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def lines_by_document(item_model, fk_name, document_ids):
+    """Agrupa (product_id, quantity) de los items por documento en una sola consulta"""
+    lines = defaultdict(list)
+    for document_id, product_id, quantity in item_model.objects.filter(
+        **{f'{fk_name}__in': document_ids}
+    ).values_list(fk_name, 'product_id', 'quantity'):
+        lines[document_id].append((product_id, quantity))
+    return lines
+
+
+def build_expenses(expense_model, fk_name, document, expenses):
+    """Instancias de gasto validadas (sin guardar) para bulk_create"""
+    built = []
+    for expense in expenses:
+        expense = expense_model(**{fk_name: document}, **expense)
+        expense.clean()
+        built.append(expense)
+    return built
+
+
+def save_item_formset(document, formset, add_items):
+    """
+    Guarda un formset de items ya validado: bajas y cambios item por item,
+    altas en bloque con add_items(document, lines).
+    """
+    formset.instance = document
+    formset.save(commit=False)
+    with transaction.atomic():
+        for item in formset.deleted_objects:
+            item.delete()
+        for item, _ in formset.changed_objects:
+            item.save()
+        add_items(document, [item_line(item) for item in formset.new_objects])
+
+
+# -------------------------------------------------------------------------
+# COMPRAS
+# -------------------------------------------------------------------------
+class PurchaseService:
+    """
+    Recepción de compras en bloque: inserta los items con bulk_create, suma el
+    stock de todos los productos en un solo UPDATE y registra el historial de
+    costos con bulk_create, sin pasar por PurchaseItem.save ni sus señales.
+    """
+
+    @classmethod
+    def create_with_items(cls, supplier, date, lines, expenses=(), **fields):
+        """Crea la compra, recibe sus items y agrega sus gastos en una sola transacción"""
+        with transaction.atomic():
+            purchase = Purchase(supplier=supplier, date=date, **fields)
+            purchase.save()
+            cls.receive(purchase, lines)
+            cls.add_expenses(purchase, expenses)
+        return purchase
+
+    @classmethod
+    def add_expenses(cls, purchase, expenses):
+        """Agrega gastos (dicts con description y amount) con un solo bulk_create"""
+        expenses = build_expenses(PurchaseExpense, 'purchase', purchase, expenses)
+        return PurchaseExpense.objects.bulk_create(expenses) if expenses else []
+
+    @classmethod
+    def receive(cls, purchase, lines):
+        """
+        Recibe líneas nuevas en una compra existente.
+        lines: iterable de dicts con product (instancia o id), quantity y unit_price.
+        """
+        lines = normalize_lines(lines, PurchaseItem)
+        if not lines:
+            return []
+
+        with transaction.atomic():
+            locked = Purchase.objects.select_for_update().only(
+                'status', 'date', 'supplier_id'
+            ).get(pk=purchase.pk)
+            if locked.status == Purchase.Status.CANCELLED:
+                raise ValidationError("No se pueden agregar items a una compra cancelada.")
+
+            product_ids = [product_id for product_id, _, _ in lines]
+            repeated = list(
+                purchase.items.filter(product_id__in=product_ids)
+                .values_list('product__name', flat=True)
+            )
+            if repeated:
+                raise ValidationError(
+                    f"Los productos ya existen en la compra: {', '.join(repeated)}"
+                )
+
+            missing = set(product_ids) - set(locked_product_ids(product_ids))
+            if missing:
+                raise ValidationError(
+                    f"Productos no encontrados: {', '.join(map(str, sorted(missing)))}"
+                )
+
+            items = PurchaseItem.objects.bulk_create([
+                PurchaseItem(purchase_id=purchase.pk, product_id=product_id,
+                             quantity=quantity, unit_price=unit_price)
+                for product_id, quantity, unit_price in lines
+            ])
+            StockMovement.apply_many(
+                {product_id: quantity for product_id, quantity, _ in lines},
+                StockMovement.Source.PURCHASE, purchase.pk,
+                costs={product_id: unit_price for product_id, _, unit_price in lines},
+            )
+            DailyPurchaseRollup.record([DailyPurchaseRollup.item_line(locked, item) for item in items])
+            if locked.status == Purchase.Status.COMPLETED:
+                ProductCostHistory.objects.bulk_create([
+                    ProductCostHistory(
+                        product_id=product_id, cost=unit_price,
+                        date=locked.date, source='PURCHASE'
+                    )
+                    for product_id, _, unit_price in lines
+                ])
+                Product.refresh_last_cost(product_ids)
+
+        logger.info(f"Compra {purchase.folio}: {len(items)} item(s) recibidos")
+        return items
+
+    @classmethod
+    def save_item_formset(cls, purchase, formset):
+        """Guarda un formset de PurchaseItem (altas en bloque con receive)"""
+        save_item_formset(purchase, formset, cls.receive)
+
+    @classmethod
+    def cancel_many(cls, queryset):
+        """
+        Cancela en bloque las compras del queryset. Valida el stock negativo en
+        memoria con una sola lectura de items y productos, revierte el stock con
+        un UPDATE agrupado por producto y cambia los estados en un solo UPDATE.
+        Devuelve (folios cancelados, {folio: error}).
+        """
+        with transaction.atomic():
+            purchases = dict(
+                queryset.exclude(status=Purchase.Status.CANCELLED)
+                .select_for_update().order_by('pk').values_list('pk', 'folio')
+            )
+            lines = lines_by_document(PurchaseItem, 'purchase_id', list(purchases))
+            product_ids = {pid for doc in lines.values() for pid, _ in doc}
+            products = {
+                pk: [name, stock]
+                for pk, name, stock in Product.objects.select_for_update()
+                .filter(pk__in=product_ids).order_by('pk').values_list('pk', 'name', 'stock')
+            }
+
+            cancelled, failures, movements = [], {}, []
+            for purchase_id, folio in purchases.items():
+                doc_lines = lines.get(purchase_id, [])
+                short = [products[pid][0] for pid, qty in doc_lines if products[pid][1] < qty]
+                if short:
+                    failures[folio] = (
+                        f"Cancelar esta compra dejaría stock negativo en {', '.join(short)}"
+                    )
+                    continue
+                for pid, qty in doc_lines:
+                    products[pid][1] -= qty
+                    movements.append((purchase_id, pid, -qty))
+                cancelled.append(purchase_id)
+
+            StockMovement.apply_lines(StockMovement.Source.PURCHASE, movements)
+            DailyPurchaseRollup.record_documents(cancelled, sign=-1)
+            Purchase.objects.filter(pk__in=cancelled).update(
+                status=Purchase.Status.CANCELLED, updated_at=timezone.now()
+            )
+            Product.refresh_last_cost({pid for _, pid, _ in movements})
+
+        folios = [purchases[pk] for pk in cancelled]
+        logger.info(f"{len(folios)} compra(s) cancelada(s) en bloque, {len(failures)} con error")
+        return folios, failures
+
+
+# -------------------------------------------------------------------------
+# VENTAS
+# -------------------------------------------------------------------------
+class SaleService:
+    """
+    Creación de ventas en bloque: bloquea todos los productos en una sola
+    consulta (ordenada por pk para evitar deadlocks), valida el stock de
+    todas las líneas a la vez e inserta los items con bulk_create.
+    """
+
+    STOCK_ERROR = (
+        "Stock insuficiente para {name}. "
+        "Disponible: {stock}, Requerido: {required}, Faltante: {missing}"
+    )
+
+    @classmethod
+    def create_with_items(cls, client, date, lines, expenses=(), **fields):
+        """Crea la venta, sus items y sus gastos en una sola transacción"""
+        with transaction.atomic(), ClientBalance.deferred():
+            sale = Sale(client=client, date=date, **fields)
+            sale.save()
+            cls.add_items(sale, lines)
+            cls.add_expenses(sale, expenses)
+        return sale
+
+    @classmethod
+    def add_expenses(cls, sale, expenses):
+        """
+        Agrega gastos (dicts con description y amount) con un solo bulk_create
+        y un solo UPDATE de los totales, sin pasar por SaleExpense.save.
+        """
+        expenses = build_expenses(SaleExpense, 'sale', sale, expenses)
+        if not expenses:
+            return []
+        with transaction.atomic():
+            expenses = SaleExpense.objects.bulk_create(expenses)
+            Sale.apply_totals_delta(sale.pk, expenses=sum(expense.amount for expense in expenses))
+            ClientBalance.schedule_refresh(sale.client_id)
+        sale.refresh_from_db(fields=Sale.TOTAL_FIELDS)
+        return expenses
+
+    @classmethod
+    def add_items(cls, sale, lines):
+        """
+        Agrega líneas nuevas a una venta existente.
+        lines: iterable de dicts con product (instancia o id), quantity y unit_price.
+        """
+        lines = normalize_lines(lines, SaleItem)
+        if not lines:
+            return []
+
+        with transaction.atomic():
+            locked = Sale.objects.select_for_update().only('status', 'date', 'client_id').get(pk=sale.pk)
+            if locked.status == Sale.Status.CANCELLED:
+                raise ValidationError("No se pueden modificar items de una venta cancelada.")
+
+            product_ids = [product_id for product_id, _, _ in lines]
+            repeated = list(
+                sale.items.filter(product_id__in=product_ids).values_list('product__name', flat=True)
+            )
+            if repeated:
+                raise ValidationError(
+                    f"Los productos ya existen en la venta: {', '.join(repeated)}"
+                )
+
+            # Un solo lock de todos los productos, siempre en el mismo orden
+            stock = {
+                pk: (name, available, avg_cost)
+                for pk, name, available, avg_cost in Product.objects.select_for_update()
+                .filter(pk__in=product_ids).order_by('pk')
+                .values_list('pk', 'name', 'stock', 'avg_cost')
+            }
+            errors = []
+            for product_id, quantity, _ in lines:
+                if product_id not in stock:
+                    errors.append(f"Producto {product_id} no encontrado.")
+                    continue
+                name, available, _ = stock[product_id]
+                if available < quantity:
+                    errors.append(cls.STOCK_ERROR.format(
+                        name=name, stock=available, required=quantity,
+                        missing=quantity - available,
+                    ))
+            if errors:
+                raise ValidationError(errors)
+
+            items = SaleItem.objects.bulk_create([
+                SaleItem(sale_id=sale.pk, product_id=product_id, quantity=quantity,
+                         unit_price=unit_price, unit_cost=stock[product_id][2])
+                for product_id, quantity, unit_price in lines
+            ])
+            StockMovement.apply_many(
+                {product_id: -quantity for product_id, quantity, _ in lines},
+                StockMovement.Source.SALE, sale.pk,
+                error_message=cls.STOCK_ERROR,
+            )
+            Sale.apply_totals_delta(sale.pk, items=sum(item.get_total() for item in items))
+            DailySalesRollup.record([DailySalesRollup.item_line(locked, item) for item in items])
+            ClientBalance.schedule_refresh(locked.client_id)
+
+        sale.refresh_from_db(fields=Sale.TOTAL_FIELDS)
+        logger.info(f"Venta {sale.folio}: {len(items)} item(s) agregados, total ${sale.get_total()}")
+        return items
+
+    @classmethod
+    def sync_offline(cls, sales, user=None):
+        """
+        Aplica un lote de ventas hechas fuera de línea por una terminal.
+        sales: iterable de dicts con key (clave de idempotencia), client (id),
+        date, items (líneas como en add_items) y campos opcionales de Sale.
+
+        Las claves ya registradas se reportan como duplicadas sin volver a
+        aplicarse, así la terminal puede reintentar el lote completo; una clave
+        repetida dentro del lote se aplica una vez y sus copias son duplicadas.
+        El stock de todo el lote se valida en memoria con un solo lock de los
+        productos, en el orden recibido; las ventas que no alcanzan se rechazan
+        y el resto se inserta con bulk_create y un solo UPDATE de stock.
+        Devuelve un resultado por venta, en el orden recibido.
+
+        Si otra transacción registra una de las claves al mismo tiempo (dos
+        reintentos concurrentes del mismo lote), el INSERT falla por unicidad
+        de sync_key: el lote se revierte y se vuelve a aplicar una vez, ya
+        viendo esas claves como duplicadas.
+        """
+        sales = list(sales)
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    results, created = cls._apply_offline_sales(sales, user)
+                break
+            except IntegrityError as e:
+                if attempt or 'sync_key' not in str(e):
+                    raise
+                logger.info("Sincronización: clave registrada por otra transacción, reintentando lote")
+
+        logger.info(f"Sincronización: {created} venta(s) creada(s) de {len(sales)} recibida(s)")
+        return results
+
+    @staticmethod
+    def _synced_sales(keys):
+        """{sync_key: (pk, folio)} de las claves ya registradas"""
+        return {
+            key: (pk, folio)
+            for pk, folio, key in Sale.objects.filter(sync_key__in=keys)
+            .values_list('pk', 'folio', 'sync_key')
+        }
+
+    @classmethod
+    def _apply_offline_sales(cls, sales, user):
+        """Cuerpo de sync_offline; debe llamarse dentro de una transacción"""
+        results = {}
+        first = {}  # clave -> posición de su primera aparición en el lote
+        existing = cls._synced_sales([data['key'] for data in sales])
+        clients = set(
+            Client.objects.filter(pk__in={data['client'] for data in sales})
+            .values_list('pk', flat=True)
+        )
+
+        candidates = []
+        for index, data in enumerate(sales):
+            key = data['key']
+            if key in first:
+                continue
+            first[key] = index
+            if key in existing:
+                pk, folio = existing[key]
+                results[key] = {'key': key, 'status': 'duplicate', 'sale': pk, 'folio': folio}
+                continue
+            fields = {
+                name: value for name, value in data.items()
+                if name not in ('key', 'client', 'date', 'items')
+            }
+            try:
+                if data['client'] not in clients:
+                    raise ValidationError(f"Cliente {data['client']} no encontrado.")
+                lines = normalize_lines(data['items'], SaleItem)
+                if not lines:
+                    raise ValidationError("La venta no tiene items.")
+                sale = Sale(client_id=data['client'], date=data['date'], sync_key=key,
+                            created_by=user, **fields)
+                sale.clean()
+            except ValidationError as e:
+                results[key] = {'key': key, 'status': 'rejected', 'errors': e.messages}
+                continue
+            candidates.append((sale, lines))
+
+        # Un solo lock de todos los productos del lote, siempre en el mismo orden
+        stock = {
+            pk: [name, available, avg_cost]
+            for pk, name, available, avg_cost in Product.objects.select_for_update()
+            .filter(pk__in={pid for _, lines in candidates for pid, _, _ in lines})
+            .order_by('pk').values_list('pk', 'name', 'stock', 'avg_cost')
+        }
+        accepted = []
+        for sale, lines in candidates:
+            errors = []
+            for product_id, quantity, _ in lines:
+                if product_id not in stock:
+                    errors.append(f"Producto {product_id} no encontrado.")
+                    continue
+                name, available, _ = stock[product_id]
+                if available < quantity:
+                    errors.append(cls.STOCK_ERROR.format(
+                        name=name, stock=available, required=quantity,
+                        missing=quantity - available,
+                    ))
+            if errors:
+                results[sale.sync_key] = {
+                    'key': sale.sync_key, 'status': 'rejected', 'errors': errors
+                }
+                continue
+            for product_id, quantity, _ in lines:
+                stock[product_id][1] -= quantity
+            accepted.append((sale, lines))
+
+        if accepted:
+            items = {}
+            for (sale, lines), folio in zip(accepted, reserve_folios('SALE', len(accepted))):
+                sale.folio = folio
+                items[folio] = [
+                    SaleItem(product_id=product_id, quantity=quantity,
+                             unit_price=unit_price, unit_cost=stock[product_id][2])
+                    for product_id, quantity, unit_price in lines
+                ]
+                sale.items_total = to_decimal(sum(item.get_total() for item in items[folio]))
+                sale.balance = sale.items_total
+            Sale.objects.bulk_create([sale for sale, _ in accepted])
+
+            for sale, _ in accepted:
+                for item in items[sale.folio]:
+                    item.sale_id = sale.pk
+            SaleItem.objects.bulk_create([item for doc in items.values() for item in doc])
+            StockMovement.apply_lines(
+                StockMovement.Source.SALE,
+                [(sale.pk, product_id, -quantity)
+                 for sale, lines in accepted for product_id, quantity, _ in lines],
+                error_message=cls.STOCK_ERROR,
+            )
+            DailySalesRollup.record([
+                DailySalesRollup.item_line(sale, item)
+                for sale, _ in accepted for item in items[sale.folio]
+            ])
+            ClientBalance.rebuild(
+                Client.objects.filter(pk__in={sale.client_id for sale, _ in accepted})
+            )
+            ClientStatementCheckpoint.invalidate_sales(
+                Sale.objects.filter(pk__in=[sale.pk for sale, _ in accepted])
+            )
+            for sale, _ in accepted:
+                results[sale.sync_key] = {
+                    'key': sale.sync_key, 'status': 'created', 'sale': sale.pk, 'folio': sale.folio
+                }
+
+        # Copias de una clave dentro del lote: duplicadas de su primera aparición
+        output = []
+        for index, data in enumerate(sales):
+            result = results[data['key']]
+            if first[data['key']] != index:
+                result = {'key': data['key'], 'status': 'duplicate',
+                          'sale': result.get('sale'), 'folio': result.get('folio')}
+            output.append(result)
+        return output, len(accepted)
+
+    @classmethod
+    def save_item_formset(cls, sale, formset):
+        """
+        Guarda un formset de SaleItem (altas en bloque con add_items); el saldo
+        del cliente se recalcula una vez para todo el formset
+        """
+        with transaction.atomic(), ClientBalance.deferred():
+            save_item_formset(sale, formset, cls.add_items)
+
+    @classmethod
+    def cancel_many(cls, queryset):
+        """
+        Cancela en bloque las ventas del queryset. Rechaza las que tienen pagos
+        asignados (según paid_total), devuelve el stock con un UPDATE agrupado por
+        producto y cambia los estados en un solo UPDATE.
+        Devuelve (folios cancelados, {folio: error}).
+        """
+        with transaction.atomic():
+            sales = {
+                pk: (folio, paid_total, client_id)
+                for pk, folio, paid_total, client_id in queryset
+                .exclude(status=Sale.Status.CANCELLED).select_for_update().order_by('pk')
+                .values_list('pk', 'folio', 'paid_total', 'client_id')
+            }
+            failures = {
+                folio: "tiene pagos asignados"
+                for folio, paid_total, _ in sales.values() if paid_total > 0
+            }
+            cancelled = [pk for pk, (folio, _, _) in sales.items() if folio not in failures]
+
+            lines = lines_by_document(SaleItem, 'sale_id', cancelled)
+            locked_product_ids({pid for doc in lines.values() for pid, _ in doc})
+            StockMovement.apply_lines(StockMovement.Source.SALE, [
+                (sale_id, pid, qty) for sale_id, doc in lines.items() for pid, qty in doc
+            ])
+            DailySalesRollup.record_documents(cancelled, sign=-1)
+            Sale.objects.filter(pk__in=cancelled).update(
+                status=Sale.Status.CANCELLED,
+                payment_status=Sale.PaymentStatus.CANCELLED,
+                updated_at=timezone.now(),
+            )
+            ClientBalance.rebuild(
+                Client.objects.filter(pk__in={sales[pk][2] for pk in cancelled})
+            )
+            ClientStatementCheckpoint.invalidate_sales(Sale.objects.filter(pk__in=cancelled))
+
+        folios = [sales[pk][0] for pk in cancelled]
+        logger.info(f"{len(folios)} venta(s) cancelada(s) en bloque, {len(failures)} con error")
+        return folios, failures
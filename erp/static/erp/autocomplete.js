@@ -0,0 +1,36 @@
+// Búsqueda de catálogo para los select con data-autocomplete-url.
+// Usa delegación de eventos para cubrir también las filas agregadas al formset.
+(function() {
+    const timers = new WeakMap();
+
+    function search(input) {
+        const select = document.getElementById(input.dataset.target);
+        if (!select) {
+            return;
+        }
+        const url = select.dataset.autocompleteUrl + '?q=' + encodeURIComponent(input.value.trim());
+        fetch(url, {headers: {'Accept': 'application/json'}})
+            .then(function(response) { return response.json(); })
+            .then(function(data) {
+                const current = select.value;
+                const options = [new Option('---------', '')];
+                data.results.forEach(function(result) {
+                    options.push(new Option(result.text, result.id, false, String(result.id) === current));
+                });
+                if (current && !data.results.some(function(r) { return String(r.id) === current; })) {
+                    const selected = select.options[select.selectedIndex];
+                    options.push(new Option(selected.text, current, true, true));
+                }
+                select.replaceChildren.apply(select, options);
+            });
+    }
+
+    document.addEventListener('input', function(event) {
+        const input = event.target;
+        if (!input.classList || !input.classList.contains('autocomplete-search')) {
+            return;
+        }
+        clearTimeout(timers.get(input));
+        timers.set(input, setTimeout(function() { search(input); }, 250));
+    });
+})();
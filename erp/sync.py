@@ -0,0 +1,171 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.utils import timezone
+
+from .models import Client, ClientBalance, Product, SyncTombstone
+from .pagination import decode_cursor, encode_cursor, keyset_filter
+
+
+# -------------------------------------------------------------------------
+# FLUJOS DE CAMBIOS PARA TERMINALES FUERA DE LÍNEA
+# -------------------------------------------------------------------------
+# Cada flujo: (queryset base, columnas). El orden de cambios es (updated_at, pk),
+# cubierto por un índice en cada modelo. Product lleva precio y stock: cada
+# movimiento de stock actualiza updated_at en el mismo UPDATE.
+SYNC_STREAMS = {
+    'products': (
+        Product.objects.all(),
+        ['id', 'name', 'unit_type', 'reference_price', 'stock', 'active'],
+    ),
+    'clients': (
+        Client.objects.all(),
+        ['id', 'name', 'contact_info', 'active'],
+    ),
+    'balances': (
+        ClientBalance.objects.all(),
+        ['client_id', 'open_debt', 'unallocated_credit'],
+    ),
+}
+
+SYNC_ORDERING = ('updated_at', 'pk')
+
+# Cursor de los borrados (SyncTombstone), guardado al final de la marca de agua
+DELETED = 'deleted'
+
+
+def decode_watermark(token):
+    """
+    Decodifica la marca de agua: {flujo: (updated_at, pk) o None}, más el
+    cursor de borrados en DELETED. Sin token (primera sincronización) todos los
+    flujos empiezan desde cero. Las marcas anteriores a los borrados (sin ese
+    cursor) siguen siendo válidas y reciben los borrados desde el principio.
+    """
+    if not token:
+        return dict.fromkeys([*SYNC_STREAMS, DELETED])
+    decoded = decode_cursor(token)
+    streams = [*SYNC_STREAMS, DELETED]
+    if decoded is None or len(decoded[1]) not in (2 * len(streams) - 2, 2 * len(streams)):
+        raise ValidationError("Marca de agua inválida.")
+    values = decoded[1] + ['', ''] * (len(decoded[1]) < 2 * len(streams))
+    return {
+        stream: tuple(values[2 * i:2 * i + 2]) if values[2 * i] else None
+        for i, stream in enumerate(streams)
+    }
+
+
+def encode_watermark(cursors):
+    """Codifica {flujo: (updated_at, pk) o None} en un token opaco"""
+    values = []
+    for stream in [*SYNC_STREAMS, DELETED]:
+        values.extend(cursors.get(stream) or ('', ''))
+    return encode_cursor(values)
+
+
+def oldest_open_transaction():
+    """
+    Inicio de la transacción abierta más antigua de las demás conexiones a la
+    base (pg_stat_activity), o None. Solo PostgreSQL; el usuario de la
+    aplicación ve xact_start de sus propias conexiones.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT MIN(xact_start) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND pid <> pg_backend_pid() "
+            "AND backend_type = 'client backend'"
+        )
+        oldest = cursor.fetchone()[0]
+    if oldest is not None and timezone.is_aware(oldest) and not settings.USE_TZ:
+        oldest = timezone.make_naive(oldest)
+    return oldest
+
+
+def sync_cutoff():
+    """
+    updated_at máximo de las filas que se pueden entregar. Una fila se pierde
+    si su transacción confirma cuando la marca de agua ya pasó su updated_at
+    (que se fija al escribir, no al confirmar). El límite es el menor de:
+
+    - ahora - ERP_SYNC_LAG_SECONDS: cubre transacciones de hasta ese largo y la
+      diferencia de reloj entre la aplicación y la base;
+    - en PostgreSQL, el inicio de la transacción abierta más antigua menos el
+      mismo margen: ninguna fila sin confirmar queda detrás de la marca, dure lo
+      que dure su transacción (una transacción larga solo demora la entrega).
+
+    En SQLite (desarrollo, un solo escritor) rige solo el margen.
+    """
+    lag = timedelta(seconds=getattr(settings, 'ERP_SYNC_LAG_SECONDS', 2))
+    cutoff = timezone.now() - lag
+    oldest = oldest_open_transaction()
+    if oldest is not None:
+        cutoff = min(cutoff, oldest - lag)
+    return cutoff
+
+
+def read_stream(queryset, cursor, cutoff, columns, limit):
+    """Hasta limit + 1 filas (updated_at, pk, *columns) posteriores al cursor"""
+    queryset = queryset.filter(updated_at__lte=cutoff)
+    if cursor:
+        queryset = queryset.filter(keyset_filter(SYNC_ORDERING, cursor))
+    return list(queryset.order_by(*SYNC_ORDERING).values_list(*SYNC_ORDERING, *columns)[:limit + 1])
+
+
+def compact_value(value):
+    # Los montos viajan como texto, igual que en los serializers (sin perder precisión)
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def changes_since(token=None, limit=500):
+    """
+    Devuelve los cambios posteriores a la marca de agua: hasta `limit` filas
+    por flujo, como listas compactas de valores, los ids borrados de cada flujo
+    y la nueva marca de agua. La terminal aplica primero las filas y después
+    los borrados (un id borrado no vuelve a usarse). Solo se entregan filas y
+    borrados anteriores a sync_cutoff().
+    """
+    cursors = decode_watermark(token)
+    cutoff = sync_cutoff()
+
+    changes = {}
+    has_more = False
+    for stream, (queryset, columns) in SYNC_STREAMS.items():
+        rows = read_stream(queryset, cursors[stream], cutoff, columns, limit)
+        if len(rows) > limit:
+            has_more = True
+            rows = rows[:limit]
+        if rows:
+            cursors[stream] = rows[-1][:2]
+        changes[stream] = {
+            'columns': columns,
+            'rows': [[compact_value(value) for value in row[2:]] for row in rows],
+            'deleted': [],
+        }
+
+    if token:
+        tombstones = read_stream(
+            SyncTombstone.objects.all(), cursors[DELETED], cutoff, ['stream', 'object_id'], limit
+        )
+        if len(tombstones) > limit:
+            has_more = True
+            tombstones = tombstones[:limit]
+        for _, _, stream, object_id in tombstones:
+            changes[stream]['deleted'].append(object_id)
+    else:
+        # Primera sincronización: la terminal no tiene copias que borrar
+        tombstones = list(
+            SyncTombstone.objects.filter(updated_at__lte=cutoff)
+            .order_by(*[f'-{field}' for field in SYNC_ORDERING]).values_list(*SYNC_ORDERING)[:1]
+        )
+    if tombstones:
+        cursors[DELETED] = tombstones[-1][:2]
+
+    return {
+        'watermark': encode_watermark(cursors),
+        'has_more': has_more,
+        'changes': changes,
+    }
@@ -0,0 +1,1670 @@
+import base64
+import csv
+import json
+import re
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
+from uuid import uuid4
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    Client, ClientBalance, ClientStatementCheckpoint, DailyPurchaseRollup, DailySalesRollup,
+    FolioSequence, Payment, PaymentAllocation, Product, ProductCostHistory, Purchase, Sale,
+    SaleExpense, SaleItem, StockMovement, Supplier, folio_database, prefix_search, reserve_folios,
+    search_key
+)
+from .instrumentation import QueryBudgetExceeded, record_queries
+from .middleware import QueryInstrumentationMiddleware
+from .pagination import encode_cursor
+from .reports import client_statement, margin_by_client, margin_by_product, receivables_aging
+from .services import PurchaseService, SaleService
+from .sync import SYNC_STREAMS, changes_since
+from .management.commands.rebuild_average_cost import Command as RebuildAverageCostCommand
+from .views import SaleListView
+
+
+class ERPTestCase(TestCase):
+    """Catálogo mínimo: un proveedor, un cliente y productos con stock"""
+    # Incluye la conexión de folios cuando está configurada (ver folio_database)
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.supplier = Supplier.objects.create(name="Proveedor")
+        cls.client_obj = Client.objects.create(name="Cliente")
+        cls.product = Product.objects.create(name="Producto A", reference_price=Decimal('10.00'))
+        cls.other = Product.objects.create(name="Producto B", reference_price=Decimal('10.00'))
+        PurchaseService.create_with_items(
+            cls.supplier, date(2026, 1, 1),
+            [{'product': p, 'quantity': 1000, 'unit_price': Decimal('1.00')}
+             for p in (cls.product, cls.other)],
+            status=Purchase.Status.COMPLETED,
+        )
+
+    def create_sale(self, lines, **fields):
+        fields.setdefault('status', Sale.Status.COMPLETED)
+        return SaleService.create_with_items(
+            fields.pop('client', self.client_obj), fields.pop('date', date(2026, 2, 1)),
+            lines, **fields,
+        )
+
+    def assert_journal_matches_stock(self):
+        """La suma del diario de movimientos de cada producto es su stock"""
+        journal = dict(
+            StockMovement.objects.values('product').annotate(total=Sum('delta'))
+            .values_list('product', 'total')
+        )
+        for pk, stock in Product.objects.values_list('pk', 'stock'):
+            self.assertEqual(journal.get(pk, 0), stock)
+
+    def rollup_rows(self, rollup):
+        """Filas con movimiento del acumulado (las que quedan en cero no cuentan)"""
+        return list(
+            rollup.objects.exclude(documents=0).order_by('date', rollup.PARTY_FIELD, 'product')
+            .values_list('date', rollup.PARTY_FIELD, 'product', *rollup.VALUE_FIELDS)
+        )
+
+    def assert_rollup_matches_rebuild(self, rollup):
+        incremental = self.rollup_rows(rollup)
+        rollup.rebuild()
+        self.assertEqual(incremental, self.rollup_rows(rollup))
+
+    def raw_value(self, model, pk, column):
+        """Valor tal como quedó guardado (sin el redondeo que aplica el ORM al leer)"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {connection.ops.quote_name(column)} FROM {model._meta.db_table} WHERE id = %s",
+                [pk],
+            )
+            return cursor.fetchone()[0]
+
+
+# -------------------------------------------------------------------------
+# FOLIOS
+# -------------------------------------------------------------------------
+class FolioTests(ERPTestCase):
+
+    def test_blocks_are_consecutive(self):
+        first = reserve_folios('TEST', 3)
+        second = reserve_folios('TEST', 2)
+
+        self.assertEqual([folio[-5:] for folio in first + second],
+                         ['00001', '00002', '00003', '00004', '00005'])
+        self.assertEqual(FolioSequence.objects.get(prefix='TEST').last_value, 5)
+
+    def test_reserves_on_folio_connection_when_configured(self):
+        self.assertEqual(folio_database(), 'default')
+        with mock.patch.dict(settings.DATABASES, folios=settings.DATABASES['default']), \
+                mock.patch.object(FolioSequence, 'reserve', return_value=(1, 1)) as reserve:
+            reserve_folios('TEST', 1)
+        self.assertEqual(reserve.call_args.kwargs['using'], 'folios')
+
+
+# -------------------------------------------------------------------------
+# TOTALES DESNORMALIZADOS
+# -------------------------------------------------------------------------
+class SaleTotalsTests(ERPTestCase):
+
+    def test_item_deltas_do_not_accumulate_float_error(self):
+        sale = self.create_sale([])
+        SaleItem(sale=sale, product=self.product, quantity=1, unit_price=Decimal('0.10')).save()
+        SaleItem(sale=sale, product=self.other, quantity=1, unit_price=Decimal('0.20')).save()
+        SaleExpense.objects.create(sale=sale, description="Flete", amount=Decimal('0.10'))
+
+        self.assertTrue(Sale.objects.filter(
+            pk=sale.pk, items_total=Decimal('0.30'), balance=Decimal('0.40')
+        ).exists())
+        self.assertEqual(Decimal(str(self.raw_value(Sale, sale.pk, 'balance'))), Decimal('0.40'))
+
+    def test_rebuild_totals_matches_incremental_totals(self):
+        sale = self.create_sale([
+            {'product': self.product, 'quantity': 3, 'unit_price': Decimal('0.10')},
+            {'product': self.other, 'quantity': 1, 'unit_price': Decimal('0.20')},
+        ])
+        before = Sale.objects.values(*Sale.TOTAL_FIELDS).get(pk=sale.pk)
+        Sale.rebuild_totals(Sale.objects.filter(pk=sale.pk))
+        self.assertEqual(Sale.objects.values(*Sale.TOTAL_FIELDS).get(pk=sale.pk), before)
+        self.assertTrue(Sale.objects.filter(pk=sale.pk, balance=Decimal('0.50')).exists())
+
+    def corrupt_sales_and_balance(self):
+        """
+        Ventas liquidada, parcial, de contado y cancelada con payment_status, totales
+        y ClientBalance alterados; devuelve las ventas y el resumen esperados.
+        """
+        line = [{'product': self.product, 'quantity': 3, 'unit_price': Decimal('0.10')}]
+        settled = self.create_sale(line, payment_status=Sale.PaymentStatus.CREDIT)
+        partial = self.create_sale(line, payment_status=Sale.PaymentStatus.CREDIT)
+        cash = self.create_sale(line, payment_status=Sale.PaymentStatus.PAID)
+        cancelled = self.create_sale(line, payment_status=Sale.PaymentStatus.CREDIT)
+        for sale, amount in ((settled, Decimal('0.30')), (partial, Decimal('0.10'))):
+            payment = Payment.objects.create(client=self.client_obj, date=date(2026, 2, 2), amount=amount)
+            PaymentAllocation.objects.create(payment=payment, sale=sale, amount=amount)
+        SaleService.cancel_many(Sale.objects.filter(pk=cancelled.pk))
+        summary = ClientBalance.objects.values(*ClientBalance.SUMMARY_FIELDS).get(client=self.client_obj)
+
+        Sale.objects.filter(pk=settled.pk).update(
+            payment_status=Sale.PaymentStatus.CREDIT, paid_total=0, balance=Decimal('0.30')
+        )
+        Sale.objects.filter(pk=partial.pk).update(payment_status=Sale.PaymentStatus.PAID)
+        ClientBalance.objects.filter(client=self.client_obj).update(open_debt=999, credit_sales_count=9)
+        return {
+            settled.pk: (Sale.PaymentStatus.PAID, Decimal('0.00')),
+            partial.pk: (Sale.PaymentStatus.CREDIT, Decimal('0.20')),
+            cash.pk: (Sale.PaymentStatus.PAID, Decimal('0.30')),
+            cancelled.pk: (Sale.PaymentStatus.CANCELLED, Decimal('0.30')),
+        }, summary
+
+    def assert_rebuilt(self, expected, summary):
+        self.assertEqual(
+            {pk: (status, Decimal(balance)) for pk, status, balance
+             in Sale.objects.values_list('pk', 'payment_status', 'balance')},
+            expected,
+        )
+        self.assertEqual(
+            ClientBalance.objects.values(*ClientBalance.SUMMARY_FIELDS).get(client=self.client_obj),
+            summary,
+        )
+        self.assertEqual(summary['open_debt'], Decimal('0.20'))
+
+    def test_rebuild_totals_restores_payment_status_and_client_balance(self):
+        expected, summary = self.corrupt_sales_and_balance()
+        Sale.rebuild_totals()
+        self.assert_rebuilt(expected, summary)
+
+    def test_rebuild_sale_totals_command_rebuilds_client_balances(self):
+        expected, summary = self.corrupt_sales_and_balance()
+        out = StringIO()
+        call_command('rebuild_sale_totals', batch_size=1, stdout=out)
+        self.assert_rebuilt(expected, summary)
+        self.assertIn("4 venta(s) recalculada(s), 1 saldo(s)", out.getvalue())
+
+    def test_stock_and_rollup_deltas_stay_exact(self):
+        for quantity in ('0.1', '0.2'):
+            self.create_sale([{'product': self.product, 'quantity': Decimal(quantity),
+                               'unit_price': Decimal('0.10')}])
+        self.assertTrue(Product.objects.filter(pk=self.product.pk, stock=Decimal('999.700')).exists())
+        self.assertTrue(DailySalesRollup.objects.filter(
+            product=self.product, quantity=Decimal('0.300'), amount=Decimal('0.03')
+        ).exists())
+
+
+# -------------------------------------------------------------------------
+# PAGOS
+# -------------------------------------------------------------------------
+class PaymentAllocationTests(ERPTestCase):
+
+    def allocate(self, sale, amount):
+        payment = Payment.objects.create(client=self.client_obj, date=date(2026, 2, 2), amount=amount)
+        PaymentAllocation.objects.create(payment=payment, sale=sale, amount=amount)
+
+    def assert_settled(self, sale):
+        sale.refresh_from_db()
+        self.assertEqual(sale.payment_status, Sale.PaymentStatus.PAID)
+        self.assertEqual(sale.balance, Decimal('0.00'))
+        summary = ClientBalance.objects.get(client=self.client_obj)
+        self.assertEqual(summary.open_debt, Decimal('0.00'))
+        self.assertEqual(summary.credit_sales_count, 0)
+        self.assertFalse(receivables_aging(date(2026, 3, 1)).exists())
+
+    def test_full_allocation_marks_sale_paid(self):
+        sale = self.create_sale([
+            {'product': self.product, 'quantity': 1, 'unit_price': Decimal('0.10')},
+            {'product': self.other, 'quantity': 1, 'unit_price': Decimal('0.20')},
+        ])
+        self.allocate(sale, Decimal('0.30'))
+        self.assert_settled(sale)
+
+    def test_full_allocation_marks_sale_paid_with_drifted_balance(self):
+        # Saldo guardado como REAL con error de redondeo (filas anteriores al Round())
+        sale = self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('0.30')}])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Sale._meta.db_table} SET balance = %s WHERE id = %s",
+                [0.1 + 0.2, sale.pk],
+            )
+        self.allocate(sale, Decimal('0.30'))
+        self.assert_settled(sale)
+
+    def test_removing_allocation_reopens_sale(self):
+        sale = self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('5.00')}])
+        self.allocate(sale, Decimal('5.00'))
+        PaymentAllocation.objects.get(sale=sale).delete()
+        sale.refresh_from_db()
+        self.assertEqual(sale.payment_status, Sale.PaymentStatus.CREDIT)
+        self.assertEqual(sale.balance, Decimal('5.00'))
+
+    def credit_sales(self):
+        """Ventas a crédito con distinto vencimiento, una cancelada y una pagada de contado"""
+        def sale(amount, **fields):
+            fields.setdefault('payment_status', Sale.PaymentStatus.CREDIT)
+            return self.create_sale(
+                [{'product': self.product, 'quantity': 1, 'unit_price': Decimal(amount)}], **fields
+            )
+        sales = {
+            'late': sale('10.00', due_date=date(2026, 3, 10)),
+            'soon': sale('6.00', due_date=date(2026, 2, 15)),
+            'undated': sale('4.00', date=date(2026, 1, 20)),
+            'cancelled': sale('8.00', due_date=date(2026, 2, 1)),
+            'cash': sale('9.00', payment_status=Sale.PaymentStatus.PAID, due_date=date(2026, 2, 1)),
+        }
+        SaleService.cancel_many(Sale.objects.filter(pk=sales['cancelled'].pk))
+        return sales
+
+    def allocated(self, payment):
+        return list(payment.allocations.order_by('pk').values_list('sale__folio', 'amount'))
+
+    def test_auto_allocate_oldest_due_first_with_partial_last(self):
+        sales = self.credit_sales()
+        payment = Payment.objects.create(client=self.client_obj, date=date(2026, 2, 20), amount=Decimal('12.00'))
+
+        payment.auto_allocate()
+
+        self.assertEqual(self.allocated(payment), [
+            (sales['soon'].folio, Decimal('6.00')), (sales['late'].folio, Decimal('6.00')),
+        ])
+        sales['late'].refresh_from_db()
+        self.assertEqual((sales['late'].balance, sales['late'].payment_status),
+                         (Decimal('4.00'), Sale.PaymentStatus.CREDIT))
+        self.assertEqual(Sale.objects.get(pk=sales['soon'].pk).payment_status, Sale.PaymentStatus.PAID)
+        self.assertEqual(ClientBalance.objects.get(client=self.client_obj).open_debt, Decimal('8.00'))
+
+    def test_auto_allocate_overpayment_keeps_remainder(self):
+        sales = self.credit_sales()
+        payment = Payment.objects.create(client=self.client_obj, date=date(2026, 2, 20), amount=Decimal('30.00'))
+
+        payment.auto_allocate()
+
+        # Sin vencimiento al final; la cancelada y la de contado no se tocan
+        self.assertEqual(self.allocated(payment), [
+            (sales['soon'].folio, Decimal('6.00')), (sales['late'].folio, Decimal('10.00')),
+            (sales['undated'].folio, Decimal('4.00')),
+        ])
+        self.assertEqual(payment.unallocated_amount(), Decimal('10.00'))
+        summary = ClientBalance.objects.get(client=self.client_obj)
+        self.assertEqual((summary.open_debt, summary.unallocated_credit), (Decimal('0.00'), Decimal('10.00')))
+        self.assertEqual(payment.auto_allocate(), [])
+        for key in ('cancelled', 'cash'):
+            self.assertFalse(PaymentAllocation.objects.filter(sale=sales[key]).exists())
+
+    def test_admin_action_allocates_selected_payments(self):
+        sales = self.credit_sales()
+        first = Payment.objects.create(client=self.client_obj, date=date(2026, 2, 10), amount=Decimal('7.00'))
+        second = Payment.objects.create(client=self.client_obj, date=date(2026, 2, 20), amount=Decimal('5.00'))
+        skipped = Payment.objects.create(client=self.client_obj, date=date(2026, 2, 25), amount=Decimal('5.00'))
+        self.client.force_login(get_user_model().objects.create_superuser(
+            username='admin', email='admin@example.com', password='x'
+        ))
+
+        response = self.client.post(reverse('admin:erp_payment_changelist'), {
+            'action': 'auto_allocate', '_selected_action': [first.pk, second.pk],
+        }, follow=True)
+
+        self.assertContains(response, "3 asignación(es) creada(s) automáticamente.")
+        # El pago más antiguo se reparte primero
+        self.assertEqual(self.allocated(first), [
+            (sales['soon'].folio, Decimal('6.00')), (sales['late'].folio, Decimal('1.00')),
+        ])
+        self.assertEqual(self.allocated(second), [(sales['late'].folio, Decimal('5.00'))])
+        self.assertEqual(self.allocated(skipped), [])
+
+
+class ClientBalanceTests(ERPTestCase):
+
+    def lines(self, count):
+        products = [
+            Product(name=f"Extra {n}", reference_price=Decimal('1.00')) for n in range(count)
+        ]
+        Product.objects.bulk_create(products)
+        PurchaseService.create_with_items(
+            self.supplier, date(2026, 1, 1),
+            [{'product': p, 'quantity': 10, 'unit_price': Decimal('1.00')} for p in products],
+            status=Purchase.Status.COMPLETED,
+        )
+        return [{'product': p, 'quantity': 1, 'unit_price': Decimal('2.00')} for p in products]
+
+    def test_sale_with_items_refreshes_once(self):
+        with mock.patch.object(ClientBalance, 'refresh', wraps=ClientBalance.refresh) as refresh:
+            self.create_sale(self.lines(5), payment_status=Sale.PaymentStatus.CREDIT)
+
+        refresh.assert_called_once_with(self.client_obj.pk)
+        summary = ClientBalance.objects.get(client=self.client_obj)
+        self.assertEqual(summary.open_debt, Decimal('10.00'))
+        self.assertEqual(summary.credit_sales_count, 1)
+
+    def test_deferred_line_writes_refresh_once(self):
+        sale = self.create_sale(self.lines(3), payment_status=Sale.PaymentStatus.CREDIT)
+        with mock.patch.object(ClientBalance, 'refresh', wraps=ClientBalance.refresh) as refresh:
+            with ClientBalance.deferred():
+                for item in sale.items.all():
+                    item.quantity = 2
+                    item.save()
+                SaleExpense.objects.create(sale=sale, description="Flete", amount=Decimal('1.50'))
+
+        refresh.assert_called_once_with(self.client_obj.pk)
+        self.assertEqual(
+            ClientBalance.objects.get(client=self.client_obj).open_debt, Decimal('13.50')
+        )
+
+    def test_failed_block_does_not_refresh(self):
+        with mock.patch.object(ClientBalance, 'refresh') as refresh:
+            with self.assertRaises(ValidationError):
+                SaleService.create_with_items(
+                    self.client_obj, date(2026, 2, 1),
+                    [{'product': self.product, 'quantity': 5000, 'unit_price': Decimal('1.00')}],
+                )
+        refresh.assert_not_called()
+
+    def test_refresh_creates_missing_summary(self):
+        ClientBalance.objects.filter(client=self.client_obj).delete()
+        self.create_sale(
+            [{'product': self.product, 'quantity': 1, 'unit_price': Decimal('4.00')}],
+            payment_status=Sale.PaymentStatus.CREDIT,
+        )
+        self.assertEqual(Client.objects.get(pk=self.client_obj.pk).get_total_debt(), Decimal('4.00'))
+
+
+# -------------------------------------------------------------------------
+# ADMIN
+# -------------------------------------------------------------------------
+class AdminChangelistQueryTests(ERPTestCase):
+    """Los listados del admin no hacen una consulta por fila"""
+    ROWS = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin_user = get_user_model().objects.create_superuser(
+            username='admin', email='admin@example.com', password='x'
+        )
+        clients = Client.objects.bulk_create(
+            Client(name=f"Cliente {n:03}") for n in range(cls.ROWS)
+        )
+        suppliers = Supplier.objects.bulk_create(
+            Supplier(name=f"Proveedor {n:03}") for n in range(cls.ROWS)
+        )
+        for n, (client, supplier) in enumerate(zip(clients, suppliers)):
+            payment = Payment.objects.create(client=client, date=date(2026, 2, 2), amount=Decimal('3.00'))
+            sale = SaleService.create_with_items(
+                client, date(2026, 2, 1),
+                [{'product': cls.product, 'quantity': 1, 'unit_price': Decimal('5.00')}],
+                status=Sale.Status.COMPLETED if n % 2 else Sale.Status.PENDING,
+            )
+            if n % 2:
+                PaymentAllocation.objects.create(payment=payment, sale=sale, amount=Decimal('3.00'))
+            PurchaseService.create_with_items(
+                supplier, date(2026, 1, 2),
+                [{'product': cls.other, 'quantity': 1, 'unit_price': Decimal('1.00')}],
+                status=Purchase.Status.COMPLETED if n % 2 else Purchase.Status.PENDING,
+            )
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def assert_changelist_queries(self, model, count):
+        """Consultas exactas del listado (sesión y usuario incluidos), dentro de su presupuesto"""
+        view_name = f'admin:erp_{model._meta.model_name}_changelist'
+        with self.assertNumQueries(count):
+            response = self.client.get(reverse(view_name))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(len(response.context['cl'].result_list), self.ROWS)
+        self.assertLessEqual(count, QueryInstrumentationMiddleware.get_budget('GET', view_name))
+
+    def test_client_changelist(self):
+        self.assert_changelist_queries(Client, 5)
+
+    def test_supplier_changelist(self):
+        self.assert_changelist_queries(Supplier, 5)
+
+    def test_payment_changelist(self):
+        # + filtro de cliente y date_hierarchy
+        self.assert_changelist_queries(Payment, 8)
+
+    def test_sale_changelist(self):
+        # Saldos y totales desnormalizados: sin subconsultas por fila
+        self.assert_changelist_queries(Sale, 8)
+
+    def test_purchase_changelist(self):
+        self.assert_changelist_queries(Purchase, 8)
+
+
+# -------------------------------------------------------------------------
+# API
+# -------------------------------------------------------------------------
+class SaleAPITests(ERPTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user(
+            username='api', email='api@example.com', password='x'
+        )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def list_sales(self, **params):
+        with record_queries() as stats:
+            response = self.api.get(reverse('api-sale-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], stats.count
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('2.00')}])
+        _, few = self.list_sales()
+        for _ in range(20):
+            self.create_sale([
+                {'product': self.product, 'quantity': 1, 'unit_price': Decimal('2.00')},
+                {'product': self.other, 'quantity': 2, 'unit_price': Decimal('3.00')},
+            ])
+        results, many = self.list_sales()
+
+        self.assertEqual(len(results), 21)
+        self.assertEqual(many, few)
+
+    def test_sparse_fields_skip_nested_prefetch(self):
+        sale = self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('2.00')}])
+        _, full = self.list_sales()
+        results, sparse = self.list_sales(fields='id,folio')
+
+        self.assertEqual(results, [{'id': sale.pk, 'folio': sale.folio}])
+        self.assertEqual(sparse, full - 2)  # sin los prefetch de items y expenses
+
+    def test_create_goes_through_sale_service(self):
+        response = self.api.post(reverse('api-sale-list'), {
+            'client': self.client_obj.pk, 'date': '2026-02-01', 'status': Sale.Status.COMPLETED,
+            'items': [{'product': self.product.pk, 'quantity': '4', 'unit_price': '2.50'}],
+            'expenses': [{'description': 'Flete', 'amount': '1.00'}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['items_total'], data['expenses_total']), ('10.00', '1.00'))
+        self.assertEqual(data['balance'], '11.00')
+        sale = Sale.objects.get(pk=data['id'])
+        self.assertEqual(sale.created_by, self.user)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 996)
+
+    def post_sale_with_expenses(self, count):
+        payload = {
+            'client': self.client_obj.pk, 'date': '2026-02-01', 'status': Sale.Status.COMPLETED,
+            'items': [{'product': self.product.pk, 'quantity': '1', 'unit_price': '2.00'}],
+            'expenses': [{'description': f'Gasto {n}', 'amount': '1.25'} for n in range(count)],
+        }
+        with mock.patch.object(SaleExpense, 'save') as save, record_queries() as stats:
+            response = self.api.post(reverse('api-sale-list'), payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        save.assert_not_called()
+        return response.json(), stats.count
+
+    def test_create_with_expenses_in_bulk(self):
+        _, one = self.post_sale_with_expenses(1)
+        data, four = self.post_sale_with_expenses(4)
+
+        self.assertEqual(four, one)
+        self.assertEqual(data['expenses_total'], '5.00')
+        self.assertEqual(len(data['expenses']), 4)
+        self.assertEqual(
+            ClientBalance.objects.get(client=self.client_obj).open_debt, Decimal('10.25')
+        )
+
+    def test_create_rejects_cancelled_payment_status(self):
+        for field, value in (('payment_status', Sale.PaymentStatus.CANCELLED),
+                             ('status', Sale.Status.CANCELLED)):
+            response = self.api.post(reverse('api-sale-list'), {
+                'client': self.client_obj.pk, 'date': '2026-02-01', field: value,
+                'items': [{'product': self.product.pk, 'quantity': '1', 'unit_price': '2.00'}],
+            }, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(field, response.json())
+        self.assertFalse(Sale.objects.exists())
+
+    def test_create_without_stock_is_rejected(self):
+        response = self.api.post(reverse('api-sale-list'), {
+            'client': self.client_obj.pk, 'date': '2026-02-01', 'status': Sale.Status.COMPLETED,
+            'items': [{'product': self.product.pk, 'quantity': '1001', 'unit_price': '1.00'}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Sale.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1000)
+
+
+# -------------------------------------------------------------------------
+# SINCRONIZACIÓN FUERA DE LÍNEA
+# -------------------------------------------------------------------------
+class SyncOfflineTests(ERPTestCase):
+
+    def offline_sale(self, key=None, quantity=1):
+        return {
+            'key': key or uuid4(), 'client': self.client_obj.pk, 'date': date(2026, 2, 1),
+            'items': [{'product': self.product, 'quantity': quantity, 'unit_price': Decimal('2.00')}],
+        }
+
+    def test_repeated_key_in_batch_is_applied_once(self):
+        data = self.offline_sale()
+        results = SaleService.sync_offline([data, dict(data)])
+
+        self.assertEqual([r['status'] for r in results], ['created', 'duplicate'])
+        self.assertEqual(results[1]['sale'], results[0]['sale'])
+        self.assertEqual(results[1]['folio'], results[0]['folio'])
+        self.assertEqual(Sale.objects.filter(sync_key=data['key']).count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 999)
+
+    def test_retried_batch_reports_duplicates(self):
+        batch = [self.offline_sale(), self.offline_sale()]
+        created = SaleService.sync_offline(batch)
+        retried = SaleService.sync_offline(batch)
+
+        self.assertEqual([r['status'] for r in retried], ['duplicate', 'duplicate'])
+        self.assertEqual([r['sale'] for r in retried], [r['sale'] for r in created])
+        self.assertEqual(Sale.objects.filter(sync_key__isnull=False).count(), 2)
+
+    def test_key_registered_concurrently_is_duplicate(self):
+        # Otra transacción registra la clave después de que el lote consultó las existentes
+        data = self.offline_sale()
+        other = SaleService.sync_offline([data])[0]
+        lookup = SaleService._synced_sales
+        with mock.patch.object(
+            SaleService, '_synced_sales', side_effect=[{}, lookup([data['key']])]
+        ) as synced:
+            results = SaleService.sync_offline([data, self.offline_sale()])
+
+        self.assertEqual(synced.call_count, 2)
+        self.assertEqual(results[0], {**other, 'status': 'duplicate'})
+        self.assertEqual(results[1]['status'], 'created')
+        self.assertEqual(Sale.objects.filter(sync_key=data['key']).count(), 1)
+
+    def test_api_repeated_key_is_not_server_error(self):
+        user = get_user_model().objects.create_user(
+            username='terminal', email='terminal@example.com', password='x'
+        )
+        api = APIClient()
+        api.force_authenticate(user)
+        data = self.offline_sale()
+        data.update(items=[{'product': self.product.pk, 'quantity': 1, 'unit_price': '2.00'}])
+        response = api.post('/erp/api/sync/sales/', {'sales': [data, data]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [r['status'] for r in response.json()['results']], ['created', 'duplicate']
+        )
+
+
+
+@override_settings(ERP_SYNC_LAG_SECONDS=2)
+class SyncChangesTests(ERPTestCase):
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        for model in (Product, Client, ClientBalance):
+            model.objects.update(updated_at=self.now - timedelta(hours=1))
+
+    def sync(self, token=None, seconds=0):
+        """changes_since visto desde ahora + seconds"""
+        with mock.patch('django.utils.timezone.now', return_value=self.now + timedelta(seconds=seconds)):
+            return changes_since(token)
+
+    def product_ids(self, data):
+        return [row[0] for row in data['changes']['products']['rows']]
+
+    def touch(self, product, seconds):
+        Product.objects.filter(pk=product.pk).update(updated_at=self.now + timedelta(seconds=seconds))
+
+    def test_rows_inside_lag_wait_for_next_sync(self):
+        first = self.sync()
+        self.assertEqual(self.product_ids(first), [self.product.pk, self.other.pk])
+
+        # Escrita hace 1 s: su transacción puede seguir abierta
+        self.touch(self.product, -1)
+        second = self.sync(first['watermark'])
+        self.assertEqual(self.product_ids(second), [])
+        third = self.sync(second['watermark'], seconds=2)
+        self.assertEqual(self.product_ids(third), [self.product.pk])
+
+    def test_commit_within_lag_is_not_missed(self):
+        watermark = self.sync()['watermark']
+        # Fila escrita 1.5 s antes de la sincronización anterior y confirmada después
+        self.touch(self.other, -1.5)
+        self.assertEqual(self.product_ids(self.sync(watermark, seconds=5)), [self.other.pk])
+
+    def test_commit_beyond_lag_is_the_documented_limit(self):
+        watermark = self.sync()['watermark']
+        self.touch(self.product, -3600)
+        self.touch(self.other, -5)
+        # Escrita antes de la marca de agua: fuera de la cota sin el límite de PostgreSQL
+        self.assertEqual(self.product_ids(self.sync(watermark)), [self.other.pk])
+
+    def test_open_transaction_holds_cutoff(self):
+        watermark = self.sync()['watermark']
+        self.touch(self.product, -5)
+        with mock.patch('erp.sync.oldest_open_transaction', return_value=self.now - timedelta(seconds=4)):
+            self.assertEqual(self.product_ids(self.sync(watermark)), [])
+        self.assertEqual(self.product_ids(self.sync(watermark)), [self.product.pk])
+
+    @override_settings(ERP_SYNC_LAG_SECONDS=0)
+    def test_deactivated_and_deleted_rows_reach_terminals(self):
+        gone_product = Product.objects.create(name="Descontinuado")
+        gone_client = Client.objects.create(name="Cliente dado de baja")
+        watermark = self.sync(seconds=5)['watermark']
+
+        gone = {'product': gone_product.pk, 'client': gone_client.pk}
+        self.product.active = False
+        self.product.save()
+        gone_product.delete()
+        gone_client.delete()
+        data = changes_since(watermark)
+
+        products = data['changes']['products']
+        active = products['columns'].index('active')
+        self.assertEqual([(row[0], row[active]) for row in products['rows']], [(self.product.pk, False)])
+        self.assertEqual(products['deleted'], [gone['product']])
+        self.assertEqual(data['changes']['clients']['deleted'], [gone['client']])
+        self.assertEqual(data['changes']['balances']['deleted'], [gone['client']])
+
+        # Sin marca de agua no hay copias que borrar; con ella no se repiten
+        self.assertEqual(changes_since()['changes']['products']['deleted'], [])
+        self.assertEqual(changes_since(data['watermark'])['changes']['products']['deleted'], [])
+
+    @override_settings(ERP_SYNC_LAG_SECONDS=0)
+    def test_watermark_without_deleted_cursor_is_accepted(self):
+        Product.objects.create(name="Descontinuado").delete()
+        old_token = encode_cursor(['', ''] * len(SYNC_STREAMS))
+        self.assertEqual(len(changes_since(old_token)['changes']['products']['deleted']), 1)
+        with self.assertRaises(ValidationError):
+            changes_since(encode_cursor(['']))
+
+
+# -------------------------------------------------------------------------
+# DATOS SINTÉTICOS Y BENCHMARK
+# -------------------------------------------------------------------------
+class GenerateDataTests(TestCase):
+    """generate_data deja los datos como si se hubieran cargado por los servicios"""
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_data', clients=8, products=6, suppliers=2, sales=120, purchases=15,
+            years=1, seed=7, stdout=StringIO(),
+        )
+
+    def test_stock_matches_movement_journal(self):
+        journal = dict(
+            StockMovement.objects.values('product').annotate(total=Sum('delta'))
+            .values_list('product', 'total')
+        )
+        for pk, stock in Product.objects.values_list('pk', 'stock'):
+            self.assertEqual(stock, journal.get(pk, 0), f"producto {pk}")
+            self.assertGreaterEqual(stock, 0)
+
+    def test_sale_totals_match_rebuild(self):
+        columns = ('pk', 'items_total', 'expenses_total', 'paid_total', 'balance', 'payment_status')
+        generated = list(Sale.objects.order_by('pk').values_list(*columns))
+        self.assertTrue(generated)
+        Sale.rebuild_totals()
+        self.assertEqual(list(Sale.objects.order_by('pk').values_list(*columns)), generated)
+
+    def test_allocations_fit_payments(self):
+        self.assertTrue(PaymentAllocation.objects.exists())
+        for payment in Payment.objects.with_allocated():
+            self.assertLessEqual(payment.allocated, payment.amount)
+
+    def test_client_balances_match_rebuild(self):
+        columns = ('client', 'open_debt', 'credit_sales_count', 'unallocated_credit')
+        generated = sorted(ClientBalance.objects.values_list(*columns))
+        self.assertEqual(len(generated), Client.objects.count())
+        ClientBalance.rebuild()
+        self.assertEqual(sorted(ClientBalance.objects.values_list(*columns)), generated)
+
+    def test_benchmark_report(self):
+        get_user_model().objects.create_superuser(
+            username='bench', email='bench@example.com', password='x'
+        )
+        out = StringIO()
+        call_command(
+            'benchmark', repeat=2, warmup=0, only=['model.', 'view.sale_list'], label='test',
+            stdout=out, stderr=StringIO(),
+        )
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(report['label'], 'test')
+        self.assertEqual(report['rows']['sales'], Sale.objects.count())
+        self.assertEqual(
+            [result['name'] for result in report['results']],
+            ['model.sale_item_save', 'model.payment_allocation_save',
+             'model.client_get_total_debt', 'view.sale_list'],
+        )
+        for result in report['results']:
+            self.assertEqual(result['runs'], 2)
+            self.assertGreater(result['queries'], 0)
+            self.assertLessEqual(result['min_ms'], result['median_ms'])
+
+
+# -------------------------------------------------------------------------
+# INSTRUMENTACIÓN DE CONSULTAS
+# -------------------------------------------------------------------------
+@override_settings(ERP_QUERY_INSTRUMENTATION=True, ERP_QUERY_BUDGET_STRICT=False)
+class QueryInstrumentationTests(ERPTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user(
+            username='api', email='api@example.com', password='x'
+        )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def create_sale_payload(self, quantity='1'):
+        return {
+            'client': self.client_obj.pk, 'date': '2026-02-01', 'status': Sale.Status.COMPLETED,
+            'items': [{'product': self.product.pk, 'quantity': quantity, 'unit_price': '2.00'}],
+        }
+
+    def test_headers_and_json_log_line(self):
+        with self.assertLogs('erp.middleware', 'INFO') as logs, record_queries() as stats:
+            response = self.api.get(reverse('api-sale-list'))
+
+        self.assertEqual(response['X-DB-Query-Count'], str(stats.count))
+        self.assertGreaterEqual(float(response['X-DB-Time-Ms']), 0)
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '0')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(
+            {k: record[k] for k in ('method', 'path', 'view', 'status', 'queries')},
+            {'method': 'GET', 'path': reverse('api-sale-list'), 'view': 'api-sale-list',
+             'status': 200, 'queries': stats.count},
+        )
+
+    def test_duplicate_fingerprints(self):
+        def view(request):
+            for pk in (self.product.pk, self.other.pk, self.product.pk):
+                Product.objects.get(pk=pk)
+            return HttpResponse()
+
+        with self.assertLogs('erp.middleware', 'INFO') as logs:
+            response = QueryInstrumentationMiddleware(view)(RequestFactory().get('/'))
+
+        self.assertEqual(response['X-DB-Query-Count'], '3')
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '2')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(len(record['duplicate_fingerprints']), 1)
+        self.assertIn('"erp_product"', record['duplicate_fingerprints'][0])
+        self.assertIn('"erp_product"."id" = %s', record['duplicate_fingerprints'][0])
+
+    @override_settings(ERP_QUERY_BUDGET_STRICT=True, ERP_QUERY_BUDGETS={'api-sale-list': 1})
+    def test_strict_mode_raises_over_budget(self):
+        self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('2.00')}])
+        with self.assertLogs('erp.middleware', 'WARNING'), self.assertRaises(QueryBudgetExceeded):
+            self.api.get(reverse('api-sale-list'))
+
+    @override_settings(ERP_QUERY_BUDGET_STRICT=True, ERP_QUERY_BUDGETS={'api-sale-list': 1})
+    def test_list_budget_does_not_apply_to_create(self):
+        response = self.api.post(reverse('api-sale-list'), self.create_sale_payload(), format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.api.post(
+            reverse('api-sale-list'), self.create_sale_payload(quantity='5000'), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(ERP_QUERY_BUDGET_STRICT=True,
+                       ERP_QUERY_BUDGETS={('POST', 'api-sale-list'): 1})
+    def test_method_budget(self):
+        with self.assertLogs('erp.middleware', 'WARNING'), self.assertRaises(QueryBudgetExceeded):
+            self.api.post(reverse('api-sale-list'), self.create_sale_payload(), format='json')
+
+
+# -------------------------------------------------------------------------
+# IMPORTACIÓN DE CATÁLOGOS
+# -------------------------------------------------------------------------
+class CatalogImportTests(ERPTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user(
+            username='importer', email='importer@example.com', password='x'
+        )
+        cls.user.user_permissions.set(Permission.objects.filter(
+            content_type__app_label='erp',
+            codename__in=['add_product', 'change_product', 'add_client', 'change_client'],
+        ))
+
+    def upload(self, catalog, content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return self.client.post(reverse('catalog-import'), {
+            'catalog': catalog, 'file': SimpleUploadedFile('catalogo.csv', content),
+        })
+
+    def test_requires_login_and_permission(self):
+        response = self.client.get(reverse('catalog-import'))
+        self.assertRedirects(response, f"{reverse('admin:login')}?next={reverse('catalog-import')}",
+                             fetch_redirect_response=False)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('catalog-import')).status_code, 200)
+        # Sin permisos sobre proveedores
+        self.assertEqual(self.upload('suppliers', "name\nNuevo\n").status_code, 403)
+        self.assertFalse(Supplier.objects.filter(name="Nuevo").exists())
+
+    def test_products_upsert_by_name(self):
+        self.client.force_login(self.user)
+        response = self.upload(
+            'products', "name,reference_price\nProducto A,12.50\nProducto Nuevo,3.00\n"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        result = response.context['result']
+        self.assertEqual((result.created, result.updated, result.errors), (1, 1, []))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reference_price, Decimal('12.50'))
+        self.assertEqual(self.product.stock, 1000)  # columnas ausentes no se tocan
+        self.assertEqual(Product.objects.get(name="Producto Nuevo").reference_price, Decimal('3.00'))
+
+    def test_clients_upsert_and_balance_rows(self):
+        self.client.force_login(self.user)
+        self.upload('clients', "name,contact_info\nCliente,Nuevo contacto\nÑandú SA,\n")
+
+        self.client_obj.refresh_from_db()
+        self.assertEqual(self.client_obj.contact_info, "Nuevo contacto")
+        new = Client.objects.get(name="Ñandú SA")
+        self.assertTrue(ClientBalance.objects.filter(client=new, open_debt=0).exists())
+
+    def test_bad_rows_are_reported_by_line(self):
+        self.client.force_login(self.user)
+        response = self.upload('products', "name,active\nBueno,si\nMalo,quizas\n,1\n")
+
+        result = response.context['result']
+        self.assertEqual(result.created, 1)
+        self.assertEqual([line for line, _ in result.errors], [3, 4])
+        self.assertFalse(Product.objects.filter(name="Malo").exists())
+
+    def test_bad_encoding_imports_nothing(self):
+        self.client.force_login(self.user)
+        rows = ''.join(f"Producto {n}\n" for n in range(1500)).encode('utf-8')
+        response = self.upload('products', b"name\n" + rows + "Café\n".encode('latin-1'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("UTF-8", str(response.context['form'].errors['file']))
+        self.assertFalse(Product.objects.filter(name__startswith="Producto ").exclude(
+            pk__in=[self.product.pk, self.other.pk]).exists())
+
+
+# -------------------------------------------------------------------------
+# EXPORTACIONES
+# -------------------------------------------------------------------------
+class LedgerExportTests(ERPTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user(
+            username='auditor', email='auditor@example.com', password='x'
+        )
+        cls.user.user_permissions.set(Permission.objects.filter(
+            content_type__app_label='erp', codename='view_sale'
+        ))
+
+    def export(self, ledger, **params):
+        """(filas del CSV, consultas al generar la respuesta y recorrer el contenido)"""
+        with record_queries() as stats:
+            response = self.client.get(reverse('ledger-export', args=[ledger]), params)
+            self.assertEqual(response.status_code, 200)
+            content = b''.join(response.streaming_content).decode('utf-8')
+        return list(csv.reader(StringIO(content))), stats.count
+
+    def test_requires_login_and_permission(self):
+        url = reverse('ledger-export', args=['sales'])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('ledger-export', args=['payments'])).status_code, 403)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_streams_rows_with_constant_queries(self):
+        self.client.force_login(self.user)
+        line = [{'product': self.product, 'quantity': 1, 'unit_price': Decimal('2.00')}]
+        self.create_sale(line)
+        _, few = self.export('sales')
+        for day in range(1, 21):
+            self.create_sale(line, date=date(2026, 2, day))
+        rows, many = self.export('sales')
+
+        self.assertEqual(many, few)
+        self.assertEqual(rows[0][:3], ['Folio', 'Fecha', 'Vencimiento'])
+        self.assertEqual(len(rows), 1 + 21)
+        self.assertEqual(rows[1][4], self.client_obj.name)
+
+        rows, _ = self.export('sales', date_from='2026-02-10', date_to='2026-02-12')
+        self.assertEqual([row[1] for row in rows[1:]], ['2026-02-10', '2026-02-11', '2026-02-12'])
+
+
+# -------------------------------------------------------------------------
+# REPORTES
+# -------------------------------------------------------------------------
+class ReportViewTests(ERPTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user(
+            username='reports', email='reports@example.com', password='x'
+        )
+
+    def assert_login_required(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(reverse('admin:login')))
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.client.logout()
+        return response
+
+    def test_aging_views_require_login(self):
+        self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('5.00')}],
+                         due_date=date(2026, 2, 15))
+        response = self.assert_login_required(reverse('aging-report') + '?as_of=2026-03-01')
+        self.assertContains(response, self.client_obj.name)
+        response = self.assert_login_required(reverse('aging-export') + '?as_of=2026-03-01')
+        self.assertIn(self.client_obj.name, b''.join(response.streaming_content).decode('utf-8'))
+
+    def test_statement_views_require_login(self):
+        self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('5.00')}])
+        query = '?date_from=2026-01-01&date_to=2026-03-01'
+        response = self.assert_login_required(
+            reverse('client-statement', args=[self.client_obj.pk]) + query
+        )
+        self.assertContains(response, self.client_obj.name)
+        response = self.assert_login_required(
+            reverse('client-statement-export', args=[self.client_obj.pk]) + query
+        )
+        # Encabezado, saldo inicial y la venta
+        self.assertEqual(len(b''.join(response.streaming_content).decode('utf-8').splitlines()), 3)
+
+
+# -------------------------------------------------------------------------
+# ESTADO DE CUENTA
+# -------------------------------------------------------------------------
+class ClientStatementTests(ERPTestCase):
+
+    def setUp(self):
+        line = {'product': self.product, 'quantity': 1}
+        # Dos ventas y un pago el mismo día: orden por (fecha, tipo, id)
+        self.create_sale([{**line, 'unit_price': Decimal('10.00')}], date=date(2026, 1, 20))
+        self.create_sale([{**line, 'unit_price': Decimal('5.00')}], date=date(2026, 2, 10))
+        self.create_sale([{**line, 'unit_price': Decimal('7.00')}], date=date(2026, 2, 10))
+        Payment.objects.create(client=self.client_obj, date=date(2026, 2, 10), amount=Decimal('4.00'))
+        Payment.objects.create(client=self.client_obj, date=date(2026, 3, 5), amount=Decimal('6.00'))
+        self.create_sale([{**line, 'unit_price': Decimal('3.00')}], date=date(2026, 3, 20))
+
+    def statement(self, date_from=date(2026, 1, 1), date_to=date(2026, 12, 31), limit=100):
+        """Saldo inicial y todas las filas, recorriendo las páginas con el cursor"""
+        opening, rows, after = client_statement(self.client_obj.pk, date_from, date_to, limit=limit)
+        while after:
+            _, page, after = client_statement(
+                self.client_obj.pk, date_from, date_to, after=after, limit=limit
+            )
+            rows += page
+        return opening, rows
+
+    def test_running_balance(self):
+        opening, rows = self.statement()
+        self.assertEqual(opening, Decimal('0.00'))
+        self.assertEqual(
+            [(row['date'].day, row['kind'], row['balance']) for row in rows],
+            [(20, 'sale', Decimal('10.00')), (10, 'sale', Decimal('15.00')),
+             (10, 'sale', Decimal('22.00')), (10, 'payment', Decimal('18.00')),
+             (5, 'payment', Decimal('12.00')), (20, 'sale', Decimal('15.00'))],
+        )
+
+    def test_keyset_pages_across_equal_dates(self):
+        full = self.statement()
+        for limit in (1, 2, 4):
+            self.assertEqual(self.statement(limit=limit), full)
+        opening, rows = self.statement(date_from=date(2026, 2, 10), limit=1)
+        self.assertEqual(opening, Decimal('10.00'))
+        self.assertEqual(rows, full[1][1:])
+
+    def test_checkpoints_match_full_scan(self):
+        days = [date(2026, 1, 31), date(2026, 2, 10), date(2026, 2, 11), date(2026, 3, 31), date(2026, 4, 1)]
+        expected = [self.statement(date_from=day) for day in days]
+
+        self.assertEqual(ClientStatementCheckpoint.rebuild(through=date(2026, 3, 31)), 3)
+        self.assertEqual([self.statement(date_from=day) for day in days], expected)
+
+        # El saldo inicial parte del último punto de control previo, no de toda la historia
+        ClientStatementCheckpoint.objects.filter(date=date(2026, 2, 28)).update(balance=Decimal('100.00'))
+        self.assertEqual(
+            ClientStatementCheckpoint.opening_balance(self.client_obj.pk, date(2026, 3, 10)),
+            Decimal('94.00'),
+        )
+
+    def test_backdated_payment_invalidates_checkpoints(self):
+        ClientStatementCheckpoint.rebuild(through=date(2026, 3, 31))
+        Payment.objects.create(client=self.client_obj, date=date(2026, 2, 1), amount=Decimal('1.00'))
+        self.assertEqual(
+            list(ClientStatementCheckpoint.objects.values_list('date', flat=True)), [date(2026, 1, 31)]
+        )
+        self.assertEqual(
+            ClientStatementCheckpoint.opening_balance(self.client_obj.pk, date(2026, 4, 1)),
+            Decimal('14.00'),
+        )
+
+    def test_rebuild_and_invalidate_lock_client_balance(self):
+        with mock.patch.object(ClientBalance, 'lock', wraps=ClientBalance.lock) as lock:
+            ClientStatementCheckpoint.rebuild(through=date(2026, 3, 31))
+            ClientStatementCheckpoint.invalidate(self.client_obj.pk, date(2026, 2, 1))
+        self.assertEqual(lock.call_count, 2)
+
+
+# -------------------------------------------------------------------------
+# COSTO PROMEDIO Y MÁRGENES
+# -------------------------------------------------------------------------
+class AverageCostTests(ERPTestCase):
+
+    def purchase(self, product, quantity, unit_price, day=date(2026, 1, 15)):
+        return PurchaseService.create_with_items(
+            self.supplier, day,
+            [{'product': product, 'quantity': quantity, 'unit_price': Decimal(unit_price)}],
+            status=Purchase.Status.COMPLETED,
+        )
+
+    def test_next_average_cost(self):
+        next_cost = StockMovement.next_average_cost
+        self.assertEqual(next_cost(Decimal('10'), Decimal('2'), Decimal('10'), Decimal('4')), Decimal('3.0000'))
+        self.assertEqual(next_cost(Decimal('0'), Decimal('0'), Decimal('3'), Decimal('1.10')), Decimal('1.1000'))
+        # El stock negativo cuenta como cero
+        self.assertEqual(next_cost(Decimal('-5'), Decimal('2'), Decimal('10'), Decimal('4')), Decimal('4.0000'))
+
+    def test_sale_item_keeps_cost_at_time_of_sale(self):
+        self.purchase(self.product, 1000, '3.00')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.avg_cost, Decimal('2.0000'))
+
+        sale = self.create_sale([{'product': self.product, 'quantity': 2, 'unit_price': Decimal('5.00')}])
+        self.purchase(self.product, 500, '7.00')
+        item = sale.items.get()
+        self.assertEqual(item.unit_cost, Decimal('2.0000'))
+        self.assertEqual(item.get_margin(), Decimal('6.00'))
+        self.assertTrue(DailySalesRollup.objects.filter(
+            product=self.product, date=sale.date, cost=Decimal('4.0000')
+        ).exists())
+
+    def snapshot(self):
+        return (
+            list(Product.objects.order_by('pk').values_list('pk', 'avg_cost')),
+            list(SaleItem.objects.order_by('pk').values_list('pk', 'unit_cost')),
+            list(DailySalesRollup.objects.order_by('date', 'product').values_list('date', 'product', 'cost')),
+        )
+
+    def test_replay_matches_incremental_costs(self):
+        self.purchase(self.product, 1000, '3.00')
+        self.create_sale([{'product': self.product, 'quantity': 2, 'unit_price': Decimal('5.00')},
+                          {'product': self.other, 'quantity': 1, 'unit_price': Decimal('5.00')}])
+        self.purchase(self.other, 200, '2.20', day=date(2026, 2, 5))
+        self.create_sale([{'product': self.other, 'quantity': 3, 'unit_price': Decimal('5.00')}],
+                         date=date(2026, 2, 20))
+        expected = self.snapshot()
+
+        Product.objects.update(avg_cost=Decimal('0'))
+        SaleItem.objects.filter(sale__date=date(2026, 2, 20)).update(unit_cost=Decimal('0'))
+        with mock.patch.object(DailySalesRollup, 'rebuild', wraps=DailySalesRollup.rebuild) as rebuild:
+            call_command('rebuild_average_cost', chunk_size=1, stdout=StringIO())
+
+        # Solo se recalcula el día de los items cuyo costo cambió
+        rebuild.assert_called_once_with(date(2026, 2, 20), date(2026, 2, 20))
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_replay_commits_per_product_chunk(self):
+        command = RebuildAverageCostCommand(stdout=StringIO())
+        with mock.patch.object(command, 'rebuild_chunk', wraps=command.rebuild_chunk) as rebuild_chunk:
+            call_command(command, chunk_size=1)
+        self.assertEqual(
+            [call.args[0] for call in rebuild_chunk.call_args_list], [[self.product.pk], [self.other.pk]]
+        )
+
+    def test_margin_by_product_and_client(self):
+        other_client = Client.objects.create(name="Otro cliente")
+        self.create_sale([{'product': self.product, 'quantity': 2, 'unit_price': Decimal('5.00')},
+                          {'product': self.other, 'quantity': 1, 'unit_price': Decimal('3.00')}])
+        self.create_sale([{'product': self.other, 'quantity': 4, 'unit_price': Decimal('2.00')}],
+                         client=other_client)
+        cancelled = self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('9.00')}])
+        SaleService.cancel_many(Sale.objects.filter(pk=cancelled.pk))
+
+        with self.assertNumQueries(1):
+            by_product = [
+                (row['product__name'], row['total_quantity'], row['revenue'], row['cost'], row['margin'])
+                for row in margin_by_product()
+            ]
+        self.assertEqual(by_product, [
+            ("Producto A", Decimal('2'), Decimal('10'), Decimal('2'), Decimal('8')),
+            ("Producto B", Decimal('5'), Decimal('11'), Decimal('5'), Decimal('6')),
+        ])
+
+        with self.assertNumQueries(1):
+            by_client = [(row['sale__client__name'], row['margin']) for row in margin_by_client()]
+        self.assertEqual(by_client, [("Cliente", Decimal('10')), ("Otro cliente", Decimal('4'))])
+        self.assertEqual(list(margin_by_client(date_from=date(2026, 3, 1))), [])
+
+
+# -------------------------------------------------------------------------
+# BÚSQUEDA POR PREFIJO
+# -------------------------------------------------------------------------
+class PrefixSearchTests(ERPTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Product.objects.create(name="Ácido cítrico")
+        Product.objects.create(name="acero")
+        Product.objects.create(name="Ñame")
+        Product.objects.create(name="Nabo", active=False)
+        Product.objects.bulk_create([Product(name="Éter 50%"), Product(name="Eterna")])
+
+    def search(self, term):
+        return list(prefix_search(Product.objects.order_by('search_name', 'pk'), term)
+                    .values_list('name', flat=True))
+
+    def test_search_key_folds_accents_and_case(self):
+        self.assertEqual(search_key("Piñón Ácido"), "PINON ACIDO")
+        self.assertEqual(Product.objects.get(name="Éter 50%").search_name, "ETER 50%")
+
+    def test_accented_prefixes(self):
+        self.assertEqual(self.search("ac"), ["acero", "Ácido cítrico"])
+        self.assertEqual(self.search("ÁCI"), ["Ácido cítrico"])
+        self.assertEqual(self.search("ñ"), ["Nabo", "Ñame"])
+        self.assertEqual(self.search("éter 5"), ["Éter 50%"])
+        self.assertEqual(self.search("eter 50%"), ["Éter 50%"])
+        self.assertEqual(self.search("eter_"), [])
+        self.assertEqual(len(self.search("")), Product.objects.count())
+
+    def test_rename_updates_search_name(self):
+        product = Product.objects.get(name="acero")
+        product.name = "Óxido"
+        product.save()
+        self.assertEqual(self.search("ox"), ["Óxido"])
+
+    def test_catalog_autocomplete(self):
+        url = reverse('catalog-autocomplete', args=['products'])
+        response = self.client.get(url, {'q': 'na'})
+        self.assertEqual(response.json(), {
+            'results': [{'id': Product.objects.get(name="Ñame").pk, 'text': "Ñame"}]
+        })
+        response = self.client.get(url, {'q': 'É'})
+        self.assertEqual([r['text'] for r in response.json()['results']], ["Éter 50%", "Eterna"])
+        response = self.client.get(reverse('catalog-autocomplete', args=['clients']), {'q': 'cli'})
+        self.assertEqual([r['text'] for r in response.json()['results']], ["Cliente"])
+        self.assertEqual(self.client.get(reverse('catalog-autocomplete', args=['otros'])).status_code, 404)
+
+
+# -------------------------------------------------------------------------
+# ÚLTIMO COSTO
+# -------------------------------------------------------------------------
+class LastCostTests(ERPTestCase):
+
+    def purchase(self, day, unit_price, status=Purchase.Status.COMPLETED):
+        return PurchaseService.create_with_items(
+            self.supplier, day,
+            [{'product': self.product, 'quantity': 5, 'unit_price': Decimal(unit_price)}],
+            status=status,
+        )
+
+    def assert_last_cost(self, cost, day):
+        product = Product.objects.with_last_cost().get(pk=self.product.pk)
+        self.assertEqual((product.last_cost, product.last_cost_date), (Decimal(cost), day))
+        # El campo cacheado coincide con la subconsulta
+        self.assertEqual((product.last_purchase_cost, product.last_purchase_date), (Decimal(cost), day))
+
+    def test_receive_updates_last_cost(self):
+        self.assert_last_cost('1.00', date(2026, 1, 1))
+        self.purchase(date(2026, 1, 10), '2.50')
+        self.assert_last_cost('2.50', date(2026, 1, 10))
+        # Una compra con fecha anterior no reemplaza el último costo
+        self.purchase(date(2025, 12, 1), '9.00')
+        self.assert_last_cost('2.50', date(2026, 1, 10))
+
+    def test_pending_purchase_counts_once_completed(self):
+        purchase = self.purchase(date(2026, 1, 10), '2.50', status=Purchase.Status.PENDING)
+        self.assert_last_cost('1.00', date(2026, 1, 1))
+        purchase.status = Purchase.Status.COMPLETED
+        purchase.save()
+        self.assert_last_cost('2.50', date(2026, 1, 10))
+
+    def test_cancel_restores_previous_cost(self):
+        bulk = self.purchase(date(2026, 1, 10), '2.50')
+        single = self.purchase(date(2026, 1, 20), '3.00')
+        self.assert_last_cost('3.00', date(2026, 1, 20))
+
+        single.status = Purchase.Status.CANCELLED
+        single.save()
+        self.assert_last_cost('2.50', date(2026, 1, 10))
+        PurchaseService.cancel_many(Purchase.objects.filter(pk=bulk.pk))
+        self.assert_last_cost('1.00', date(2026, 1, 1))
+
+
+# -------------------------------------------------------------------------
+# CANCELACIÓN EN BLOQUE
+# -------------------------------------------------------------------------
+class CancelManyTests(ERPTestCase):
+
+    def stock(self, product):
+        return Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+
+    def test_sale_stock_is_returned_once(self):
+        first = self.create_sale([{'product': self.product, 'quantity': 3, 'unit_price': Decimal('2.00')},
+                                  {'product': self.other, 'quantity': 2, 'unit_price': Decimal('2.00')}])
+        second = self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('2.00')}])
+        SaleService.cancel_many(Sale.objects.filter(pk=second.pk))
+        movements = StockMovement.objects.count()
+
+        sales = Sale.objects.filter(pk__in=[first.pk, second.pk])
+        self.assertEqual(SaleService.cancel_many(sales), ([first.folio], {}))
+        self.assertEqual(StockMovement.objects.count(), movements + 2)
+        self.assertEqual(SaleService.cancel_many(sales), ([], {}))
+        self.assertEqual(StockMovement.objects.count(), movements + 2)
+
+        self.assertEqual(self.stock(self.product), Decimal('1000.000'))
+        self.assertEqual(self.stock(self.other), Decimal('1000.000'))
+        self.assertEqual(set(sales.values_list('status', 'payment_status')),
+                         {(Sale.Status.CANCELLED, Sale.PaymentStatus.CANCELLED)})
+        self.assert_journal_matches_stock()
+
+    def test_sale_with_payments_is_reported(self):
+        sale = self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('5.00')}],
+                                payment_status=Sale.PaymentStatus.CREDIT)
+        payment = Payment.objects.create(client=self.client_obj, date=date(2026, 2, 2), amount=Decimal('2.00'))
+        PaymentAllocation.objects.create(payment=payment, sale=sale, amount=Decimal('2.00'))
+
+        self.assertEqual(SaleService.cancel_many(Sale.objects.filter(pk=sale.pk)),
+                         ([], {sale.folio: "tiene pagos asignados"}))
+        sale.refresh_from_db()
+        self.assertEqual(sale.status, Sale.Status.COMPLETED)
+        self.assertEqual(self.stock(self.product), Decimal('999.000'))
+
+    def test_sale_cancel_updates_balance_and_rollups(self):
+        line = {'product': self.product, 'quantity': 2, 'unit_price': Decimal('5.00')}
+        kept = self.create_sale([line], payment_status=Sale.PaymentStatus.CREDIT)
+        cancelled = self.create_sale([line], payment_status=Sale.PaymentStatus.CREDIT)
+        self.assertEqual(ClientBalance.objects.get(client=self.client_obj).open_debt, Decimal('20.00'))
+
+        SaleService.cancel_many(Sale.objects.filter(pk=cancelled.pk))
+
+        summary = ClientBalance.objects.get(client=self.client_obj)
+        self.assertEqual((summary.open_debt, summary.credit_sales_count), (Decimal('10.00'), 1))
+        self.assertEqual(
+            self.rollup_rows(DailySalesRollup),
+            [(kept.date, self.client_obj.pk, self.product.pk,
+              Decimal('2.000'), Decimal('10.00'), Decimal('2.0000'), 1)],
+        )
+        self.assert_rollup_matches_rebuild(DailySalesRollup)
+
+    def test_purchase_cancel_reports_negative_stock(self):
+        extra = Product.objects.create(name="Producto C")
+        short = PurchaseService.create_with_items(
+            self.supplier, date(2026, 1, 10),
+            [{'product': extra, 'quantity': 5, 'unit_price': Decimal('1.00')}],
+            status=Purchase.Status.COMPLETED,
+        )
+        ok = PurchaseService.create_with_items(
+            self.supplier, date(2026, 1, 10),
+            [{'product': self.other, 'quantity': 5, 'unit_price': Decimal('1.00')}],
+            status=Purchase.Status.COMPLETED,
+        )
+        self.create_sale([{'product': extra, 'quantity': 3, 'unit_price': Decimal('2.00')}])
+
+        purchases = Purchase.objects.filter(pk__in=[short.pk, ok.pk])
+        self.assertEqual(PurchaseService.cancel_many(purchases), (
+            [ok.folio], {short.folio: "Cancelar esta compra dejaría stock negativo en Producto C"}
+        ))
+        self.assertEqual(PurchaseService.cancel_many(purchases.filter(pk=ok.pk)), ([], {}))
+
+        self.assertEqual(self.stock(extra), Decimal('2.000'))
+        self.assertEqual(self.stock(self.other), Decimal('1000.000'))
+        self.assertEqual(Purchase.objects.get(pk=short.pk).status, Purchase.Status.COMPLETED)
+        self.assert_journal_matches_stock()
+        self.assert_rollup_matches_rebuild(DailyPurchaseRollup)
+
+
+# -------------------------------------------------------------------------
+# PAGINACIÓN
+# -------------------------------------------------------------------------
+class KeysetPaginationTests(ERPTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_client = Client.objects.create(name="Otro cliente")
+        # Fechas repetidas: el orden (-date, -id) desempata por id
+        cls.sales = [
+            SaleService.create_with_items(
+                cls.other_client if n % 3 == 0 else cls.client_obj, date(2026, 2, 1 + n // 5),
+                [{'product': cls.product, 'quantity': 1, 'unit_price': Decimal('1.00')}],
+                status=Sale.Status.PENDING if n % 2 else Sale.Status.COMPLETED,
+            )
+            for n in range(7)
+        ]
+        cls.expected = [
+            sale.pk for sale in sorted(cls.sales, key=lambda sale: (sale.date, sale.pk), reverse=True)
+        ]
+
+    def page(self, per_page=3, **params):
+        request = RequestFactory().get(reverse('sale-list'), params)
+        response = SaleListView.as_view(paginate_by=per_page)(request)
+        return response.context_data['page_obj']
+
+    def test_next_and_previous_cursors(self):
+        pages, page = [], self.page()
+        self.assertFalse(page.has_previous())
+        while True:
+            pages.append([sale.pk for sale in page])
+            if not page.has_next():
+                break
+            page = self.page(cursor=page.next_cursor)
+        self.assertEqual(pages, [self.expected[:3], self.expected[3:6], self.expected[6:]])
+
+        for expected in reversed(pages[:-1]):
+            page = self.page(cursor=page.previous_cursor)
+            self.assertEqual([sale.pk for sale in page], expected)
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_cursor_keeps_filters(self):
+        page = self.page(per_page=1, status=Sale.Status.COMPLETED)
+        self.assertIn('status=COMPLETED', page.next_url())
+        self.assertIn('cursor=', page.next_url())
+
+    def test_tampered_cursor_returns_first_page(self):
+        first = [sale.pk for sale in self.page()]
+        for cursor in ('basura', encode_cursor(['no-es-fecha', '1']), encode_cursor(['2026-02-01', '1'], 'up'),
+                       base64.urlsafe_b64encode(b'{"d": "next"}').decode()):
+            with self.subTest(cursor=cursor):
+                page = self.page(cursor=cursor)
+                self.assertEqual([sale.pk for sale in page], first)
+                self.assertFalse(page.has_previous())
+
+    def test_filter_combinations(self):
+        def listed(**params):
+            return {sale.pk for sale in self.page(per_page=50, **params)}
+
+        by_client = {sale.pk for sale in self.sales if sale.client_id == self.client_obj.pk}
+        completed = {sale.pk for sale in self.sales if sale.status == Sale.Status.COMPLETED}
+        first_day = {sale.pk for sale in self.sales if sale.date == date(2026, 2, 1)}
+
+        self.assertEqual(listed(client=self.client_obj.pk), by_client)
+        self.assertEqual(listed(client=self.client_obj.pk, status=Sale.Status.COMPLETED), by_client & completed)
+        self.assertEqual(listed(date_to='2026-02-01', status=Sale.Status.COMPLETED), first_day & completed)
+        self.assertEqual(listed(date_from='2026-02-02', date_to='2026-02-02'), set(self.expected) - first_day)
+        # Los filtros inválidos se ignoran
+        self.assertEqual(listed(date_from='ayer', client='uno'), set(self.expected))
+
+
+# -------------------------------------------------------------------------
+# DIARIO DE STOCK
+# -------------------------------------------------------------------------
+class StockMovementTests(ERPTestCase):
+
+    def stock(self, product):
+        return Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+
+    def test_conditional_update_rejects_oversell_without_partial_changes(self):
+        movements = StockMovement.objects.count()
+        with self.assertRaisesMessage(ValidationError, "Stock insuficiente para Producto B"):
+            StockMovement.apply_many(
+                {self.product.pk: Decimal('-5'), self.other.pk: Decimal('-1000.001')},
+                StockMovement.Source.SALE,
+            )
+        self.assertEqual(self.stock(self.product), Decimal('1000.000'))
+        self.assertEqual(self.stock(self.other), Decimal('1000.000'))
+        self.assertEqual(StockMovement.objects.count(), movements)
+
+    def test_journal_rows_match_stock_delta(self):
+        sale = self.create_sale([{'product': self.product, 'quantity': 3, 'unit_price': Decimal('2.00')},
+                                 {'product': self.other, 'quantity': 2, 'unit_price': Decimal('2.00')}])
+        item = sale.items.get(product=self.product)
+        item.quantity = Decimal('5')
+        item.save()
+        sale.items.get(product=self.other).delete()
+
+        self.assertEqual(
+            list(StockMovement.objects.filter(source_type=StockMovement.Source.SALE, source_id=sale.pk)
+                 .order_by('pk').values_list('product', 'delta')),
+            [(self.product.pk, Decimal('-3.000')), (self.other.pk, Decimal('-2.000')),
+             (self.product.pk, Decimal('-2.000')), (self.other.pk, Decimal('2.000'))],
+        )
+        self.assertEqual(self.stock(self.product), Decimal('995.000'))
+        self.assertEqual(self.stock(self.other), Decimal('1000.000'))
+        self.assert_journal_matches_stock()
+
+    def test_rejected_item_edit_keeps_stock_and_journal(self):
+        sale = self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('2.00')}])
+        item = sale.items.get()
+        item.quantity = Decimal('2000')
+        with self.assertRaises(ValidationError):
+            item.save()
+        self.assertEqual(self.stock(self.product), Decimal('999.000'))
+        self.assertEqual(SaleItem.objects.get(pk=item.pk).quantity, Decimal('1.000'))
+        self.assert_journal_matches_stock()
+
+    def test_opening_adjustment_backfill(self):
+        # Migración 0004: el stock previo al diario entra como un ajuste por producto
+        seed_opening_movements = import_module('erp.migrations.0004_stock_movement').seed_opening_movements
+        empty = Product.objects.create(name="Sin stock")
+        StockMovement.objects.all().delete()
+
+        seed_opening_movements(django_apps, None)
+
+        self.assertEqual(
+            set(StockMovement.objects.values_list('product', 'delta', 'source_type', 'source_id')),
+            {(self.product.pk, Decimal('1000.000'), StockMovement.Source.ADJUSTMENT, None),
+             (self.other.pk, Decimal('1000.000'), StockMovement.Source.ADJUSTMENT, None)},
+        )
+        self.assertFalse(StockMovement.objects.filter(product=empty).exists())
+        self.assert_journal_matches_stock()
+
+
+# -------------------------------------------------------------------------
+# VENTAS Y COMPRAS EN BLOQUE
+# -------------------------------------------------------------------------
+class DocumentServiceTestMixin:
+
+    def product_lock_queries(self, queries):
+        """SELECT de productos con el lock de los servicios (ordenado por pk)"""
+        table = connection.ops.quote_name(Product._meta.db_table)
+        pk = f'{table}.{connection.ops.quote_name("id")}'
+        # values_list ordena por posición cuando la primera columna es el pk
+        order = re.compile(rf'SELECT {re.escape(pk)}.* ORDER BY (1|{re.escape(pk)}) ASC')
+        locks = [q['sql'] for q in queries if f'FROM {table} ' in q['sql'] and order.match(q['sql'])]
+        if connection.features.has_select_for_update:
+            locks = [sql for sql in locks if 'FOR UPDATE' in sql]
+        return locks
+
+
+class SaleServiceTests(DocumentServiceTestMixin, ERPTestCase):
+
+    def test_oversell_at_update_leaves_no_partial_items(self):
+        sales, items = Sale.objects.count(), SaleItem.objects.count()
+        apply_many = StockMovement.apply_many
+
+        def concurrent_sale_then_apply(*args, **kwargs):
+            # Otra venta confirmada entre la validación y el UPDATE condicional
+            Product.objects.filter(pk=self.other.pk).update(stock=Decimal('1.000'))
+            return apply_many(*args, **kwargs)
+
+        with mock.patch.object(StockMovement, 'apply_many', side_effect=concurrent_sale_then_apply), \
+                self.assertRaisesMessage(ValidationError, "Stock insuficiente para Producto B"):
+            self.create_sale([{'product': self.product, 'quantity': 2, 'unit_price': Decimal('1.00')},
+                              {'product': self.other, 'quantity': 5, 'unit_price': Decimal('1.00')}])
+
+        self.assertEqual((Sale.objects.count(), SaleItem.objects.count()), (sales, items))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, Decimal('1000.000'))
+        self.assert_journal_matches_stock()
+
+    def test_validation_reports_every_short_line(self):
+        with self.assertRaises(ValidationError) as error:
+            self.create_sale([{'product': self.product, 'quantity': 1001, 'unit_price': Decimal('1.00')},
+                              {'product': self.other, 'quantity': 1002, 'unit_price': Decimal('1.00')}])
+        self.assertEqual(len(error.exception.messages), 2)
+        self.assertFalse(SaleItem.objects.exists())
+
+    def test_duplicate_products_are_rejected(self):
+        line = {'product': self.product, 'quantity': 1, 'unit_price': Decimal('1.00')}
+        with self.assertRaisesMessage(ValidationError, "está repetido en el documento"):
+            self.create_sale([line, {**line, 'product': self.product.pk}])
+        self.assertFalse(Sale.objects.exists())
+
+        sale = self.create_sale([line])
+        with self.assertRaisesMessage(ValidationError, "Los productos ya existen en la venta: Producto A"):
+            SaleService.add_items(sale, [line])
+        self.assertEqual(sale.items.count(), 1)
+
+    def test_products_are_locked_once_in_pk_order(self):
+        lines = [{'product': p, 'quantity': 1, 'unit_price': Decimal('1.00')} for p in (self.other, self.product)]
+        with CaptureQueriesContext(connection) as queries:
+            self.create_sale(lines)
+        self.assertEqual(len(self.product_lock_queries(queries)), 1)
+
+
+class PurchaseServiceTests(DocumentServiceTestMixin, ERPTestCase):
+
+    def products(self, count, prefix="Insumo"):
+        return Product.objects.bulk_create(Product(name=f"{prefix} {n:03}") for n in range(count))
+
+    def receive(self, products, status=Purchase.Status.COMPLETED):
+        return PurchaseService.create_with_items(
+            self.supplier, date(2026, 1, 5),
+            [{'product': p, 'quantity': 2, 'unit_price': Decimal('1.50')} for p in products],
+            status=status,
+        )
+
+    def test_receive_writes_journal_and_cost_history(self):
+        products = self.products(3)
+        purchase = self.receive(products)
+
+        self.assertEqual(
+            set(StockMovement.objects.filter(source_type=StockMovement.Source.PURCHASE, source_id=purchase.pk)
+                .values_list('product', 'delta', 'unit_cost')),
+            {(p.pk, Decimal('2.000'), Decimal('1.50')) for p in products},
+        )
+        self.assertEqual(
+            set(ProductCostHistory.objects.filter(product__in=products).values_list('product', 'cost', 'date')),
+            {(p.pk, Decimal('1.50'), date(2026, 1, 5)) for p in products},
+        )
+        self.assert_journal_matches_stock()
+
+    def test_pending_purchase_has_no_cost_history(self):
+        products = self.products(2)
+        self.receive(products, status=Purchase.Status.PENDING)
+        self.assertFalse(ProductCostHistory.objects.filter(product__in=products).exists())
+        self.assertEqual(Product.objects.get(pk=products[0].pk).stock, Decimal('2.000'))
+
+    def test_query_count_does_not_grow_with_lines(self):
+        small, large = self.products(5, "Chico"), self.products(50, "Grande")
+        with CaptureQueriesContext(connection) as small_queries:
+            self.receive(small)
+        with CaptureQueriesContext(connection) as large_queries:
+            self.receive(large)
+        self.assertEqual(len(large_queries), len(small_queries))
+        self.assertEqual(len(self.product_lock_queries(large_queries)), 1)
+
+    def test_duplicate_products_are_rejected(self):
+        line = {'product': self.product, 'quantity': 1, 'unit_price': Decimal('1.00')}
+        with self.assertRaisesMessage(ValidationError, "está repetido en el documento"):
+            PurchaseService.create_with_items(self.supplier, date(2026, 1, 5), [line, line])
+
+        purchase = PurchaseService.create_with_items(self.supplier, date(2026, 1, 5), [line])
+        with self.assertRaisesMessage(ValidationError, "Los productos ya existen en la compra: Producto A"):
+            PurchaseService.receive(purchase, [line])
+        self.assertEqual(purchase.items.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, Decimal('1001.000'))
+        self.assert_journal_matches_stock()
+
+
+# -------------------------------------------------------------------------
+# ACUMULADOS DIARIOS
+# -------------------------------------------------------------------------
+class DailyRollupTests(ERPTestCase):
+
+    def test_sale_lifecycle_matches_rebuild(self):
+        other_client = Client.objects.create(name="Otro cliente")
+        sale = self.create_sale([{'product': self.product, 'quantity': 2, 'unit_price': Decimal('3.00')},
+                                 {'product': self.other, 'quantity': 1, 'unit_price': Decimal('4.00')}])
+        self.create_sale([{'product': self.product, 'quantity': 1, 'unit_price': Decimal('3.00')}])
+        self.assert_rollup_matches_rebuild(DailySalesRollup)
+
+        item = sale.items.get(product=self.product)
+        item.quantity = Decimal('5')
+        item.unit_price = Decimal('2.50')
+        item.save()
+        sale.items.get(product=self.other).delete()
+        SaleService.add_items(sale, [{'product': self.other, 'quantity': 3, 'unit_price': Decimal('1.00')}])
+        self.assert_rollup_matches_rebuild(DailySalesRollup)
+
+        sale.date = date(2026, 2, 3)
+        sale.client = other_client
+        sale.save()
+        self.assert_rollup_matches_rebuild(DailySalesRollup)
+
+        SaleService.cancel_many(Sale.objects.filter(pk=sale.pk))
+        self.assert_rollup_matches_rebuild(DailySalesRollup)
+
+        self.create_sale([{'product': self.other, 'quantity': 2, 'unit_price': Decimal('4.00')}]).delete()
+        self.assert_rollup_matches_rebuild(DailySalesRollup)
+
+    def test_purchase_receive_and_cancel_match_rebuild(self):
+        purchase = PurchaseService.create_with_items(
+            self.supplier, date(2026, 1, 1),
+            [{'product': self.product, 'quantity': 4, 'unit_price': Decimal('1.25')}],
+            status=Purchase.Status.COMPLETED,
+        )
+        PurchaseService.receive(purchase, [{'product': self.other, 'quantity': 2, 'unit_price': Decimal('2.00')}])
+        self.assert_rollup_matches_rebuild(DailyPurchaseRollup)
+
+        PurchaseService.cancel_many(Purchase.objects.filter(pk=purchase.pk))
+        self.assert_rollup_matches_rebuild(DailyPurchaseRollup)
+        self.assertEqual(
+            self.rollup_rows(DailyPurchaseRollup),
+            [(date(2026, 1, 1), self.supplier.pk, p.pk, Decimal('1000.000'), Decimal('1000.00'), 1)
+             for p in (self.product, self.other)],
+        )
+
+    @skipUnless(connection.vendor == 'sqlite', "Solo SQLite limita las particiones en paralelo")
+    def test_rebuild_command_uses_one_worker_on_sqlite(self):
+        self.create_sale([{'product': self.product, 'quantity': 2, 'unit_price': Decimal('3.00')}])
+        self.create_sale([{'product': self.other, 'quantity': 1, 'unit_price': Decimal('4.00')}],
+                         date=date(2026, 3, 15))
+        expected = self.rollup_rows(DailySalesRollup)
+        DailySalesRollup.objects.all().delete()
+        stdout, stderr = StringIO(), StringIO()
+
+        with mock.patch('erp.management.commands.rebuild_rollups.ThreadPoolExecutor') as pool:
+            call_command('rebuild_rollups', only='sales', workers=4, partition_days=7,
+                         stdout=stdout, stderr=stderr)
+
+        pool.assert_not_called()
+        self.assertIn("se usa --workers 1", stderr.getvalue())
+        self.assertEqual(self.rollup_rows(DailySalesRollup), expected)
@@ -1,4 +1,9 @@
-from django.urls import path
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+from .api import (
+    SupplierViewSet, ProductViewSet, ClientViewSet, PurchaseViewSet, SaleViewSet, PaymentViewSet,
+    ReportViewSet, SyncViewSet,
+)
 from .views import (
     SupplierListView, SupplierCreateView, SupplierUpdateView, SupplierDeleteView,
     ProductListView, ProductCreateView, ProductUpdateView, ProductDeleteView,
@@ -6,8 +11,21 @@ from .views import (
     PurchaseListView, PurchaseCreateView, PurchaseUpdateView, PurchaseDeleteView,
     SaleListView, SaleCreateView, SaleUpdateView, SaleDeleteView,
     PaymentListView, PaymentCreateView, PaymentUpdateView, PaymentDeleteView,
+    CatalogAutocompleteView, LedgerExportView, CatalogImportView,
+    AgingReportView, AgingExportView, ClientStatementView, ClientStatementExportView,
 )
 
+# Prefijo api- para no chocar con los nombres de las vistas HTML (sale-list, ...)
+router = DefaultRouter()
+router.register('suppliers', SupplierViewSet, basename='api-supplier')
+router.register('products', ProductViewSet, basename='api-product')
+router.register('clients', ClientViewSet, basename='api-client')
+router.register('purchases', PurchaseViewSet, basename='api-purchase')
+router.register('sales', SaleViewSet, basename='api-sale')
+router.register('payments', PaymentViewSet, basename='api-payment')
+router.register('sync', SyncViewSet, basename='api-sync')
+router.register('reports', ReportViewSet, basename='api-report')
+
 urlpatterns = [
     # Supplier URLs
     path('suppliers/', SupplierListView.as_view(), name='supplier-list'),
@@ -26,6 +44,8 @@ urlpatterns = [
     path('clients/create/', ClientCreateView.as_view(), name='client-create'),
     path('clients/<int:pk>/update/', ClientUpdateView.as_view(), name='client-update'),
     path('clients/<int:pk>/delete/', ClientDeleteView.as_view(), name='client-delete'),
+    path('clients/<int:pk>/statement/', ClientStatementView.as_view(), name='client-statement'),
+    path('clients/<int:pk>/statement/csv/', ClientStatementExportView.as_view(), name='client-statement-export'),
 
     # Purchase URLs
     path('purchases/', PurchaseListView.as_view(), name='purchase-list'),
@@ -44,4 +64,20 @@ urlpatterns = [
     path('payments/create/', PaymentCreateView.as_view(), name='payment-create'),
     path('payments/<int:pk>/update/', PaymentUpdateView.as_view(), name='payment-update'),
     path('payments/<int:pk>/delete/', PaymentDeleteView.as_view(), name='payment-delete'),
-]
\ No newline at end of file
+
+    # Autocomplete URLs
+    path('autocomplete/<str:catalog>/', CatalogAutocompleteView.as_view(), name='catalog-autocomplete'),
+
+    # Export URLs
+    path('export/<str:ledger>/', LedgerExportView.as_view(), name='ledger-export'),
+
+    # Report URLs
+    path('reports/aging/', AgingReportView.as_view(), name='aging-report'),
+    path('reports/aging/csv/', AgingExportView.as_view(), name='aging-export'),
+
+    # Import URLs
+    path('import/', CatalogImportView.as_view(), name='catalog-import'),
+
+    # API REST
+    path('api/', include(router.urls)),
+]
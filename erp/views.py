@@ -1,17 +1,35 @@
+from datetime import date, timedelta
+from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import F
 from django.forms import inlineformset_factory
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView
+from django.utils import timezone
+from django.views import View
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, FormView, TemplateView
 from .models import (
-    Supplier, Product, Client, Purchase, PurchaseItem, PurchaseExpense, Sale, SaleItem, Payment
+    Supplier, Product, Client, Purchase, PurchaseItem, PurchaseExpense, Sale, SaleItem, Payment,
+    prefix_search
 )
 from .forms import (
-    SupplierForm, ProductForm, ClientForm, PurchaseForm, PurchaseItemForm, PurchaseExpenseForm, SaleForm, SaleItemForm, PaymentForm
+    CatalogFormSet, CatalogImportForm, SupplierForm, ProductForm, ClientForm, PurchaseForm, PurchaseItemForm, PurchaseExpenseForm, SaleForm, SaleItemForm, PaymentForm
 )
+from .exports import LEDGERS, ledger_rows, stream_csv
+from .imports import CATALOGS, import_catalog, utf8_lines
+from .pagination import KeysetPaginationMixin
+from .reports import (
+    AGING_BUCKETS, aging_report, aging_rows, client_statement, decode_statement_cursor,
+    encode_statement_cursor, statement_rows
+)
+from .services import PurchaseService, SaleService, item_line
 
 # Supplier Views
-class SupplierListView(ListView):
+class SupplierListView(KeysetPaginationMixin, ListView):
     model = Supplier
+    keyset_ordering = ('name', 'id')
     template_name = 'supplier_list.html'
     context_object_name = 'suppliers'
 
@@ -33,8 +51,9 @@ class SupplierDeleteView(DeleteView):
     success_url = reverse_lazy('supplier-list')
 
 # Product Views
-class ProductListView(ListView):
+class ProductListView(KeysetPaginationMixin, ListView):
     model = Product
+    keyset_ordering = ('name', 'id')
     template_name = 'product_list.html'
     context_object_name = 'products'
 
@@ -56,8 +75,9 @@ class ProductDeleteView(DeleteView):
     success_url = reverse_lazy('product-list')
 
 # Client Views
-class ClientListView(ListView):
+class ClientListView(KeysetPaginationMixin, ListView):
     model = Client
+    keyset_ordering = ('name', 'id')
     template_name = 'client_list.html'
     context_object_name = 'clients'
 
@@ -79,8 +99,10 @@ class ClientDeleteView(DeleteView):
     success_url = reverse_lazy('client-list')
 
 # Purchase Views
-class PurchaseListView(ListView):
+class PurchaseListView(KeysetPaginationMixin, ListView):
     model = Purchase
+    queryset = Purchase.objects.select_related('supplier').with_totals()
+    filter_fields = ('date', 'status')
     template_name = 'purchase_list.html'
     context_object_name = 'purchases'
 
@@ -92,7 +114,7 @@ class PurchaseCreateView(CreateView):
 
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
-        PurchaseItemFormSet = inlineformset_factory(Purchase, PurchaseItem, form=PurchaseItemForm, extra=1, can_delete=True)
+        PurchaseItemFormSet = inlineformset_factory(Purchase, PurchaseItem, form=PurchaseItemForm, formset=CatalogFormSet, extra=1, can_delete=True)
         if self.request.POST:
             data['item_formset'] = PurchaseItemFormSet(self.request.POST, prefix='items')
         else:
@@ -102,12 +124,18 @@ class PurchaseCreateView(CreateView):
     def form_valid(self, form):
         context = self.get_context_data()
         item_formset = context['item_formset']
-        with transaction.atomic():
-            self.object = form.save()
-            if item_formset.is_valid():
-                item_formset.instance = self.object
-                item_formset.save()
-        return super().form_valid(form)
+        if not item_formset.is_valid():
+            return self.form_invalid(form)
+        fields = dict(form.cleaned_data)
+        lines = [item_line(item) for item in item_formset.save(commit=False)]
+        try:
+            self.object = PurchaseService.create_with_items(
+                fields.pop('supplier'), fields.pop('date'), lines, **fields
+            )
+        except ValidationError as e:
+            form.add_error(None, e)
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 class PurchaseUpdateView(UpdateView):
     model = Purchase
@@ -117,7 +145,7 @@ class PurchaseUpdateView(UpdateView):
 
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
-        PurchaseItemFormSet = inlineformset_factory(Purchase, PurchaseItem, form=PurchaseItemForm, extra=1, can_delete=True)
+        PurchaseItemFormSet = inlineformset_factory(Purchase, PurchaseItem, form=PurchaseItemForm, formset=CatalogFormSet, extra=1, can_delete=True)
         if self.request.POST:
             data['item_formset'] = PurchaseItemFormSet(self.request.POST, instance=self.object, prefix='items')
         else:
@@ -127,12 +155,16 @@ class PurchaseUpdateView(UpdateView):
     def form_valid(self, form):
         context = self.get_context_data()
         item_formset = context['item_formset']
-        with transaction.atomic():
-            self.object = form.save()
-            if item_formset.is_valid():
-                item_formset.instance = self.object
-                item_formset.save()
-        return super().form_valid(form)
+        if not item_formset.is_valid():
+            return self.form_invalid(form)
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                PurchaseService.save_item_formset(self.object, item_formset)
+        except ValidationError as e:
+            form.add_error(None, e)
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 class PurchaseDeleteView(DeleteView):
     model = Purchase
@@ -140,8 +172,10 @@ class PurchaseDeleteView(DeleteView):
     success_url = reverse_lazy('purchase-list')
 
 # Sale Views
-class SaleListView(ListView):
+class SaleListView(KeysetPaginationMixin, ListView):
     model = Sale
+    queryset = Sale.objects.select_related('client')
+    filter_fields = ('date', 'status', 'client')
     template_name = 'sale_list.html'
     context_object_name = 'sales'
 
@@ -153,7 +187,7 @@ class SaleCreateView(CreateView):
 
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
-        SaleItemFormSet = inlineformset_factory(Sale, SaleItem, form=SaleItemForm, extra=1, can_delete=True)
+        SaleItemFormSet = inlineformset_factory(Sale, SaleItem, form=SaleItemForm, formset=CatalogFormSet, extra=1, can_delete=True)
         if self.request.POST:
             data['item_formset'] = SaleItemFormSet(self.request.POST, prefix='items')
         else:
@@ -163,12 +197,18 @@ class SaleCreateView(CreateView):
     def form_valid(self, form):
         context = self.get_context_data()
         item_formset = context['item_formset']
-        with transaction.atomic():
-            self.object = form.save()
-            if item_formset.is_valid():
-                item_formset.instance = self.object
-                item_formset.save()
-        return super().form_valid(form)
+        if not item_formset.is_valid():
+            return self.form_invalid(form)
+        fields = dict(form.cleaned_data)
+        lines = [item_line(item) for item in item_formset.save(commit=False)]
+        try:
+            self.object = SaleService.create_with_items(
+                fields.pop('client'), fields.pop('date'), lines, **fields
+            )
+        except ValidationError as e:
+            form.add_error(None, e)
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 class SaleUpdateView(UpdateView):
     model = Sale
@@ -178,7 +218,7 @@ class SaleUpdateView(UpdateView):
 
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
-        SaleItemFormSet = inlineformset_factory(Sale, SaleItem, form=SaleItemForm, extra=1, can_delete=True)
+        SaleItemFormSet = inlineformset_factory(Sale, SaleItem, form=SaleItemForm, formset=CatalogFormSet, extra=1, can_delete=True)
         if self.request.POST:
             data['item_formset'] = SaleItemFormSet(self.request.POST, instance=self.object, prefix='items')
         else:
@@ -188,12 +228,16 @@ class SaleUpdateView(UpdateView):
     def form_valid(self, form):
         context = self.get_context_data()
         item_formset = context['item_formset']
-        with transaction.atomic():
-            self.object = form.save()
-            if item_formset.is_valid():
-                item_formset.instance = self.object
-                item_formset.save()
-        return super().form_valid(form)
+        if not item_formset.is_valid():
+            return self.form_invalid(form)
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                SaleService.save_item_formset(self.object, item_formset)
+        except ValidationError as e:
+            form.add_error(None, e)
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 class SaleDeleteView(DeleteView):
     model = Sale
@@ -201,8 +245,12 @@ class SaleDeleteView(DeleteView):
     success_url = reverse_lazy('sale-list')
 
 # Payment Views
-class PaymentListView(ListView):
+class PaymentListView(KeysetPaginationMixin, ListView):
     model = Payment
+    queryset = Payment.objects.select_related('client').with_allocated().annotate(
+        unallocated=F('amount') - F('allocated')
+    )
+    filter_fields = ('date', 'client')
     template_name = 'payment_list.html'
     context_object_name = 'payments'
 
@@ -221,4 +269,175 @@ class PaymentUpdateView(UpdateView):
 class PaymentDeleteView(DeleteView):
     model = Payment
     template_name = 'payment_confirm_delete.html'
-    success_url = reverse_lazy('payment-list')
\ No newline at end of file
+    success_url = reverse_lazy('payment-list')
+
+# Autocomplete Views
+class CatalogAutocompleteView(View):
+    """Búsqueda por prefijo del nombre (JSON) para los selectores de catálogo"""
+    catalogs = {'products': Product, 'clients': Client, 'suppliers': Supplier}
+    limit = 20
+
+    def get(self, request, catalog):
+        model = self.catalogs.get(catalog)
+        if model is None:
+            raise Http404("Catálogo no encontrado")
+        queryset = prefix_search(model.objects.filter(active=True), request.GET.get('q', '').strip())
+        results = [
+            {'id': pk, 'text': name}
+            for pk, name in queryset.order_by('search_name', 'pk').values_list('pk', 'name')[:self.limit]
+        ]
+        return JsonResponse({'results': results})
+
+# Export Views
+class LedgerExportView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """
+    Exporta un libro (ventas, compras o pagos) como CSV en streaming.
+    Requiere el permiso de consulta del modelo del libro.
+    """
+
+    def get_permission_required(self):
+        if self.kwargs['ledger'] not in LEDGERS:
+            return []  # get() responde 404
+        model_name = LEDGERS[self.kwargs['ledger']][1].model._meta.model_name
+        return [f'erp.view_{model_name}']
+
+    def get(self, request, ledger):
+        if ledger not in LEDGERS:
+            raise Http404("Libro no encontrado")
+        bounds = {}
+        for param in ('date_from', 'date_to'):
+            try:
+                bounds[param] = date.fromisoformat(request.GET[param])
+            except (KeyError, ValueError):
+                bounds[param] = None
+        response = StreamingHttpResponse(
+            stream_csv(ledger_rows(ledger, **bounds)), content_type='text/csv; charset=utf-8'
+        )
+        suffix = '_'.join(str(value) for value in bounds.values() if value)
+        filename = f"{ledger}_{suffix}.csv" if suffix else f"{ledger}.csv"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+# Report Views
+def as_of_date(request):
+    """Fecha de corte ?as_of=AAAA-MM-DD (hoy si falta o es inválida)"""
+    try:
+        return date.fromisoformat(request.GET['as_of'])
+    except (KeyError, ValueError):
+        return timezone.now().date()
+
+class AgingReportView(LoginRequiredMixin, TemplateView):
+    """Antigüedad de saldos por cliente (0-30, 31-60, 61-90 y más de 90 días)"""
+    template_name = 'aging_report.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        as_of = as_of_date(self.request)
+        rows, totals = aging_report(as_of)
+        fields = [field for field, _, _, _ in AGING_BUCKETS]
+        context.update(
+            as_of=as_of,
+            buckets=AGING_BUCKETS,
+            rows=[{**row, 'amounts': [row[field] for field in fields]} for row in rows],
+            totals={**totals, 'amounts': [totals[field] for field in fields]},
+        )
+        return context
+
+class AgingExportView(LoginRequiredMixin, View):
+    """Antigüedad de saldos como CSV"""
+
+    def get(self, request):
+        as_of = as_of_date(request)
+        response = StreamingHttpResponse(
+            stream_csv(aging_rows(as_of)), content_type='text/csv; charset=utf-8'
+        )
+        response['Content-Disposition'] = f'attachment; filename="aging_{as_of}.csv"'
+        return response
+
+def statement_range(request, days=90):
+    """Rango ?date_from/?date_to del estado de cuenta (por omisión, los últimos 90 días)"""
+    bounds = {}
+    for param in ('date_from', 'date_to'):
+        try:
+            bounds[param] = date.fromisoformat(request.GET[param])
+        except (KeyError, ValueError):
+            bounds[param] = None
+    date_to = bounds['date_to'] or timezone.now().date()
+    return bounds['date_from'] or date_to - timedelta(days=days), date_to
+
+class ClientStatementView(LoginRequiredMixin, TemplateView):
+    """Estado de cuenta del cliente: cargos, pagos y saldo acumulado, por páginas"""
+    template_name = 'client_statement.html'
+    paginate_by = 100
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        client = get_object_or_404(Client, pk=self.kwargs['pk'])
+        date_from, date_to = statement_range(self.request)
+        after = None
+        if self.request.GET.get('cursor'):
+            try:
+                after = decode_statement_cursor(self.request.GET['cursor'])
+            except ValidationError:
+                after = None
+        balance, rows, next_after = client_statement(
+            client.pk, date_from, date_to, after=after, limit=self.paginate_by
+        )
+        query = self.request.GET.copy()
+        query['date_from'], query['date_to'] = date_from, date_to
+        query.pop('cursor', None)
+        context.update(
+            client=client, date_from=date_from, date_to=date_to, rows=rows,
+            balance_forward=balance, continued=after is not None,
+            querystring=query.urlencode(),
+        )
+        if next_after:
+            query['cursor'] = encode_statement_cursor(next_after)
+            context['next_url'] = f"?{query.urlencode()}"
+        return context
+
+class ClientStatementExportView(LoginRequiredMixin, View):
+    """Estado de cuenta completo del rango como CSV en streaming"""
+
+    def get(self, request, pk):
+        client = get_object_or_404(Client, pk=pk)
+        date_from, date_to = statement_range(request)
+        response = StreamingHttpResponse(
+            stream_csv(statement_rows(client.pk, date_from, date_to)),
+            content_type='text/csv; charset=utf-8',
+        )
+        filename = f"estado_cuenta_{client.pk}_{date_from}_{date_to}.csv"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+# Import Views
+class CatalogImportView(LoginRequiredMixin, PermissionRequiredMixin, FormView):
+    """
+    Importa un CSV de productos, clientes o proveedores (upsert por nombre).
+    Requiere los permisos de alta y cambio del catálogo elegido.
+    """
+    form_class = CatalogImportForm
+    template_name = 'catalog_import.html'
+    max_errors = 200
+
+    def get_catalog(self):
+        catalog = self.request.POST.get('catalog') or self.request.GET.get('catalog')
+        return catalog if catalog in CATALOGS else 'products'
+
+    def get_permission_required(self):
+        model_name = CATALOGS[self.get_catalog()][0]._meta.model_name
+        return [f'erp.add_{model_name}', f'erp.change_{model_name}']
+
+    def get_initial(self):
+        return {'catalog': self.get_catalog()}
+
+    def form_valid(self, form):
+        try:
+            lines = utf8_lines(form.cleaned_data['file'])
+        except UnicodeDecodeError:
+            form.add_error('file', "El archivo debe estar codificado en UTF-8.")
+            return self.form_invalid(form)
+        result = import_catalog(form.cleaned_data['catalog'], lines)
+        return self.render_to_response(self.get_context_data(
+            form=form, result=result, errors=result.errors[:self.max_errors]
+        ))
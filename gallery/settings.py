@@ -71,8 +71,43 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
 
+# Sincronización de terminales: margen (segundos) para no saltar filas de
+# transacciones que aún no confirman. Cubre transacciones de hasta ese largo y la
+# diferencia de reloj con la base; en PostgreSQL además se espera a la transacción
+# abierta más antigua (ver erp.sync.sync_cutoff)
+ERP_SYNC_LAG_SECONDS = int(os.getenv('ERP_SYNC_LAG_SECONDS', '2'))
+
+# Instrumentación de consultas por petición (ver erp.middleware); por defecto solo en DEBUG
+ERP_QUERY_INSTRUMENTATION = os.getenv('ERP_QUERY_INSTRUMENTATION', str(DEBUG)).lower() in ['true', '1', 't']
+# Con True, superar el presupuesto lanza QueryBudgetExceeded en lugar de un warning
+ERP_QUERY_BUDGET_STRICT = os.getenv('ERP_QUERY_BUDGET_STRICT', 'False').lower() in ['true', '1', 't']
+# Máximo de consultas por vista (nombre de URL), incluidas sesión y usuario. La clave
+# 'vista' aplica a GET/HEAD; para otros métodos usar ('POST', 'vista')
+ERP_QUERY_BUDGETS = {
+    'supplier-list': 6,
+    'product-list': 6,
+    'client-list': 6,
+    'purchase-list': 6,
+    'sale-list': 6,
+    'payment-list': 6,
+    'api-sale-list': 6,
+    'api-purchase-list': 6,
+    'api-payment-list': 6,
+    'aging-report': 4,
+    'aging-export': 4,
+    'api-report-aging': 4,
+    'client-statement': 8,
+    'api-client-statement': 7,
+    'admin:erp_sale_changelist': 8,
+    'admin:erp_purchase_changelist': 8,
+    'admin:erp_payment_changelist': 10,
+    'admin:erp_client_changelist': 10,
+    'admin:erp_supplier_changelist': 10,
+}
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'erp.middleware.QueryInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -100,6 +135,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'gallery.wsgi.application'
 
+# Las vistas HTML que requieren sesión usan el login del admin
+LOGIN_URL = 'admin:login'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -114,6 +152,12 @@ if DATABASE_URL:
             conn_health_checks=True,
         )
     }
+    # Segunda conexión a la misma base, en autocommit, para reservar folios fuera de
+    # la transacción del documento (ver erp.models.folio_database): el consecutivo
+    # del día no queda bloqueado mientras se guarda cada venta o compra. No en SQLite:
+    # un solo escritor, la segunda conexión esperaría el lock de la transacción
+    if DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+        DATABASES['folios'] = {**DATABASES['default']}
 else:
     # Fallback para desarrollo local
     DATABASES = {